@@ -0,0 +1,78 @@
+"""
+Compares answering stateless commands through the command classes
+with the pre-serialized fast path of ``PownceBot``.
+
+Run from the top of the source tree::
+
+    python benchmarks/fastpath.py [-n NUMBER] [COMMAND ...]
+
+"""
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from twisted.words.protocols.jabber.jid import JID
+from twisted.words.xish import domish
+
+from powncebot import settings
+settings.DATABASE_URI = 'sqlite:///:memory:'
+settings.COMMAND_THREADS = 0
+settings.RATE_PER_JID = settings.RATE_GLOBAL = 0
+
+from powncebot import PownceBot
+
+class StubOutbound(object):
+    """
+    Stands in for the outbound queue and serializes stanzas the way
+    the XML stream does.
+    """
+    def __init__(self):
+        self.bytes = 0
+
+    def send(self, obj, key=None):
+        if domish.IElement.providedBy(obj):
+            obj = obj.toXml()
+        if isinstance(obj, unicode):
+            obj = obj.encode('utf-8')
+        self.bytes += len(obj)
+
+def make_message(text):
+    message = domish.Element((None, 'message'))
+    message['from'] = 'monitor@example.com/probe'
+    message['to'] = 'bot@example.com'
+    message['type'] = 'chat'
+    message.addElement('body', content=text)
+    return message
+
+def run(bot, message, number):
+    start = time.time()
+    for i in xrange(number):
+        bot.onMessage(message)
+    return time.time() - start
+
+def main():
+    parser = OptionParser(usage="%prog [-n NUMBER] [COMMAND ...]")
+    parser.add_option('-n', '--number', type='int', default=20000,
+                      help="messages per command and path")
+    options, names = parser.parse_args()
+    names = names or ['ping', 'about', 'greeting', 'help']
+
+    bot = PownceBot(JID('bot@example.com/bot'))
+    bot.outbound = StubOutbound()
+    templates = bot.templates
+
+    print "%-10s %12s %12s %8s" % ('command', 'classes/s', 'fastpath/s', 'speedup')
+    for name in names:
+        message = make_message(name)
+        bot.templates = {}
+        slow = run(bot, message, options.number)
+        bot.templates = templates
+        fast = run(bot, message, options.number)
+        print "%-10s %12.0f %12.0f %7.1fx" % (
+            name, options.number / slow, options.number / fast, slow / fast)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+Drives ``PownceBot`` end to end against a local stand-in for
+api.pownce.com and reports the throughput and reply latencies.
+
+Chat messages are fed to the bot at a target rate through a stub XML
+stream, picking commands from a weighted mix, and the time until the
+first reply to each of them is measured. The fake Pownce server can be
+made slow or flaky. Several mixes are run one after another.
+
+Replies telling the user that something failed are counted as errors,
+apart from the latencies. The run fails if a mix with commands talking
+to Pownce didn't make the fake Pownce server see a single request.
+
+Run from the top of the source tree::
+
+    python benchmarks/loadtest.py [--rate 100] [--duration 10]
+        [--mix ping:4,message:2,link:1,refresh:2,help:1 [--mix ...]]
+        [--latency 0.05]
+        [--error-rate 0.01] [--async] [--threads 4]
+
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import simplejson
+
+from twisted.internet import defer, reactor, task
+from twisted.web import resource, server
+from twisted.words.protocols.jabber.jid import JID
+from twisted.words.xish import domish
+
+USERS = 50
+
+DEFAULT_MIX = 'ping:4,message:2,link:1,refresh:2,help:1'
+
+MESSAGES = {
+    'ping': 'ping',
+    'about': 'about',
+    'help': 'help',
+    'greeting': 'hi',
+    'refresh': 'refresh',
+    'message': 'message benchmarking the bot, note %d',
+    'link': 'link http://example.com/%d a link to benchmark with',
+}
+
+# commands which make requests to Pownce
+POWNCE_COMMANDS = ('message', 'link', 'refresh')
+
+# the beginnings of the replies telling that a command failed
+ERROR_REPLIES = (
+    'Something went wrong',
+    'Please register your Pownce account first',
+    'Username and password do not match',
+    'Pownce is having a nap',
+    'Usage: ',
+    'Slow down!',
+    'Unknown command.',
+)
+
+class FakePownce(resource.Resource):
+    """
+    Answers the Pownce API requests the bot makes, after ``latency``
+    seconds, failing a fraction of ``error_rate`` of them.
+    """
+    isLeaf = True
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        resource.Resource.__init__(self)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.note_ids = 0
+
+    def render(self, request):
+        self.requests += 1
+        if random.random() < self.error_rate:
+            request.setResponseCode(500)
+            body = 'Pownce is having a nap.'
+        else:
+            status, json_obj = self.respond(request.path.split('/')[2:])
+            request.setResponseCode(status)
+            request.setHeader('content-type', 'application/json')
+            body = simplejson.dumps(json_obj)
+        if not self.latency:
+            return body
+        reactor.callLater(self.latency, self.finish, request, body)
+        return server.NOT_DONE_YET
+
+    def finish(self, request, body):
+        request.write(body)
+        request.finish()
+
+    def respond(self, parts):
+        path = '/'.join(parts)
+        if path == 'send/send_to.json':
+            return 200, {'selected': 'public',
+                         'options': [{'id': 'public', 'name': 'The public'}]}
+        if path in ('send/message.json', 'send/link.json'):
+            return 200, self.note(parts[1][:-5])
+        if len(parts) == 2 and parts[0] == 'users':
+            return 200, self.user(parts[1][:-5])
+        if len(parts) == 2 and parts[0] == 'note_lists':
+            return 200, {'notes': []}
+        return 404, {'error': {'status_code': 404, 'message': 'Not found'}}
+
+    def user(self, username):
+        return {'id': abs(hash(username)) % 100000, 'username': username,
+                'first_name': username, 'short_name': username,
+                'permalink': 'http://pownce.com/%s/' % username,
+                'is_pro': 0, 'fan_count': 1, 'fan_of_count': 1,
+                'friend_count': 1, 'max_upload_mb': 10}
+
+    def note(self, note_type):
+        self.note_ids += 1
+        note = {'id': self.note_ids, 'type': note_type, 'body': 'note',
+                'display_since': 'now', 'permalink': 'http://pownce.com/',
+                'seconds_since': 0, 'timestamp': int(time.time()),
+                'is_public': 1, 'num_recipients': 0, 'num_replies': 0,
+                'sender': self.user('bench0')}
+        if note_type == 'link':
+            note['link'] = {'url': 'http://example.com/'}
+        return note
+
+class StubTransport(object):
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+class StubXmlStream(object):
+    """
+    Takes the stanzas the bot sends and notes the time of the first
+    reply to every pending message.
+    """
+    def __init__(self):
+        self.transport = StubTransport()
+        self.pending = {}
+        self.latencies = {}
+        self.errors = {}
+        self.replies = 0
+
+    def expect(self, jid, command):
+        self.pending[jid] = (command, time.time())
+
+    def send(self, obj):
+        self.replies += 1
+        if domish.IElement.providedBy(obj):
+            to = obj['to']
+            body = unicode(obj.body)
+        else:
+            # a pre-serialized stanza
+            to = obj.split("to='", 1)[1].split("'", 1)[0]
+            body = obj.split('<body>', 1)[1]
+        sent = self.pending.pop(to, None)
+        if sent is not None:
+            command, start = sent
+            if body.startswith(ERROR_REPLIES):
+                self.errors[command] = self.errors.get(command, 0) + 1
+            else:
+                self.latencies.setdefault(command, []).append(time.time() - start)
+
+def make_message(jid, text):
+    message = domish.Element((None, 'message'))
+    message['from'] = jid
+    message['to'] = 'bot@example.com'
+    message['type'] = 'chat'
+    message.addElement('body', content=text)
+    return message
+
+def parse_mix(mix):
+    weights = []
+    for item in mix.split(','):
+        name, weight = item.split(':')
+        if name not in MESSAGES:
+            raise SystemExit("Unknown command in mix: %s" % name)
+        weights.extend([name] * int(weight))
+    return weights
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class Load(object):
+    """
+    Sends the messages of one command mix to ``bot`` at ``rate``
+    messages per second for ``duration`` seconds.
+    """
+    # seconds between sending the messages due
+    TICK = 0.01
+
+    def __init__(self, bot, xmlstream, mix, rate, duration, grace):
+        self.bot = bot
+        self.xmlstream = xmlstream
+        self.mix = parse_mix(mix)
+        self.rate = rate
+        self.duration = duration
+        # seconds to wait for the last replies
+        self.grace = grace
+        self.sent = 0
+        self.elapsed = 0.0
+
+    def run(self, serial):
+        """
+        Returns a ``Deferred`` firing when the replies are in or the
+        grace time is up. ``serial`` keeps the JIDs of the runs apart.
+        """
+        self.serial = serial
+        self.xmlstream.pending.clear()
+        self.xmlstream.latencies = {}
+        self.xmlstream.errors = {}
+        self.replies = self.xmlstream.replies
+        self.start = time.time()
+        self.total = int(self.rate * self.duration)
+        loop = task.LoopingCall(self.send_due)
+        loop.start(self.TICK)
+        d = task.deferLater(reactor, self.duration, loop.stop)
+        d.addCallback(lambda ignored: self.wait(time.time() + self.grace))
+        return d
+
+    def send_due(self):
+        # the messages due by now, so the rate holds however late the
+        # loop is called
+        due = int((time.time() - self.start) * self.rate)
+        for i in xrange(min(due, self.total) - self.sent):
+            self.sent += 1
+            command = random.choice(self.mix)
+            text = MESSAGES[command]
+            if '%d' in text:
+                text = text % self.sent
+            jid = 'bench%d@example.com/r%d-%d' % (self.sent % USERS, self.serial,
+                                                  self.sent)
+            self.xmlstream.expect(jid, command)
+            self.bot.onMessage(make_message(jid, text))
+
+    def wait(self, until):
+        if self.xmlstream.pending and time.time() < until:
+            return task.deferLater(reactor, 0.1, self.wait, until)
+        self.elapsed = time.time() - self.start
+        self.replies = self.xmlstream.replies - self.replies
+        self.latencies = self.xmlstream.latencies
+        self.errors = self.xmlstream.errors
+        self.unanswered = len(self.xmlstream.pending)
+
+    def report(self, mix):
+        print "mix %s" % mix
+        print "%d messages in %.1fs (%.1f/s), %d replies (%.1f/s), %d unanswered" % (
+            self.sent, self.elapsed, self.sent / self.duration, self.replies,
+            self.replies / self.elapsed, self.unanswered)
+        print "%-10s %8s %10s %8s %9s %9s %9s" % ('command', 'replies', 'replies/s',
+            'errors', 'p50 ms', 'p95 ms', 'p99 ms')
+        for command in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies.get(command, []))
+            errors = self.errors.get(command, 0)
+            if not latencies:
+                print "%-10s %8d %10.1f %8d" % (command, 0, 0, errors)
+                continue
+            print "%-10s %8d %10.1f %8d %9.1f %9.1f %9.1f" % (
+                command, len(latencies), len(latencies) / self.duration, errors,
+                percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000,
+                percentile(latencies, 0.99) * 1000)
+        if self.errors:
+            print "WARNING: %d replies were errors" % sum(self.errors.values())
+        print
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--rate', type='float', default=100,
+                      help="messages per second")
+    parser.add_option('--duration', type='float', default=10,
+                      help="seconds to send messages for, per mix")
+    parser.add_option('--mix', action='append', default=[],
+                      help="commands and their weights, may be given more than once")
+    parser.add_option('--latency', type='float', default=0.05,
+                      help="seconds the fake Pownce takes to answer")
+    parser.add_option('--error-rate', type='float', default=0.0,
+                      help="fraction of failing Pownce requests")
+    parser.add_option('--async', action='store_true', default=False,
+                      help="use the non-blocking Pownce client")
+    parser.add_option('--threads', type='int', default=4,
+                      help="command threads of the blocking client")
+    options, args = parser.parse_args()
+    mixes = options.mix or [DEFAULT_MIX]
+    load_commands = []
+    for mix in mixes:
+        load_commands.extend(parse_mix(mix))
+
+    fake = FakePownce(options.latency, options.error_rate)
+    port = reactor.listenTCP(0, server.Site(fake), interface='127.0.0.1')
+
+    from powncebot import settings
+    database = tempfile.mktemp(suffix='.db')
+    settings.DATABASE_URI = 'sqlite:///%s' % database
+    settings.APPLICATION_KEY = 'benchmark'
+    settings.ASYNC_API = options.async
+    settings.COMMAND_THREADS = options.threads
+    settings.RATE_PER_JID = settings.RATE_GLOBAL = 0
+    settings.TIMELINE_INTERVAL = 0
+    settings.OUTBOX_INTERVAL = 1
+    settings.API_URL = 'http://127.0.0.1:%d/2.0/' % port.getHost().port
+
+    from powncebot import PownceBot
+
+    bot = PownceBot(JID('bot@example.com/bot'))
+    for i in xrange(USERS):
+        bot.datastore.register('bench%d' % i, 'secret', 'bench%d@example.com' % i)
+    xmlstream = StubXmlStream()
+    bot.outbound.attach(xmlstream)
+
+    grace = max(2.0, options.latency * 10)
+    loads = [Load(bot, xmlstream, mix, options.rate, options.duration, grace)
+             for mix in mixes]
+
+    @defer.inlineCallbacks
+    def run():
+        try:
+            for (serial, load) in enumerate(loads):
+                yield load.run(serial)
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    bot.outbox.stop()
+    os.remove(database)
+
+    print "%d Pownce requests, %s API\n" % (
+        fake.requests, options.async and 'async' or 'blocking')
+    for (mix, load) in zip(mixes, loads):
+        load.report(mix)
+    if not fake.requests and [command for command in load_commands
+                              if command in POWNCE_COMMANDS]:
+        raise SystemExit("FAILED: the commands didn't make any Pownce requests")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Times building the ``pownce`` models from decoded API responses, using
+generated payloads of realistic size: note lists of 100 notes, notes
+with nested replies and long recipient lists.
+
+Besides the time per call every benchmark reports the objects kept
+alive by its result and how much the peak memory use grew while it ran.
+Every benchmark runs in a fresh process, so the peak of one doesn't
+hide the growth of the next. The results are saved as JSON, in the
+temporary directory unless a file is given, and a former run can be
+given to compare with.
+
+Run from the top of the source tree::
+
+    python benchmarks/parsing.py [-n NUMBER] [-o FILE] [-c OLD_FILE]
+        [BENCHMARK ...]
+
+"""
+import os
+import gc
+import sys
+import time
+import platform
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'powncebot'))
+
+import simplejson
+
+import pownce
+
+NOTES = 100
+REPLIES = 25
+RECIPIENTS = 200
+# bytes per chunk of a streamed note list, as read from a connection
+CHUNK_SIZE = pownce.ConnectionPool.CHUNK_SIZE
+
+def make_user(i):
+    return {'id': i, 'username': 'user%d' % i, 'first_name': 'User',
+            'short_name': 'User %d.' % i, 'permalink': 'http://pownce.com/user%d/' % i,
+            'blurb': 'Posting notes since 2007, this is user number %d.' % i,
+            'country': 'United States', 'location': 'San Francisco, CA',
+            'gender': 'Dude', 'age': 30, 'is_pro': i % 2,
+            'fan_count': i * 3, 'fan_of_count': i * 2, 'friend_count': i,
+            'max_upload_mb': 10,
+            'profile_photo_urls': {
+                'tiny_photo_url': 'http://pownce.com/profile_photos/%d_t.jpg' % i,
+                'small_photo_url': 'http://pownce.com/profile_photos/%d_s.jpg' % i,
+                'medium_photo_url': 'http://pownce.com/profile_photos/%d_m.jpg' % i,
+                'large_photo_url': 'http://pownce.com/profile_photos/%d_l.jpg' % i,
+                'smedium_photo_url': 'http://pownce.com/profile_photos/%d_sm.jpg' % i}}
+
+def make_reply(i, note_id):
+    return {'id': note_id * 1000 + i, 'type': 'reply',
+            'body': 'Reply %d, with some words to make it look real.' % i,
+            'display_since': '%d minutes ago' % i, 'seconds_since': i * 60,
+            'timestamp': 1200000000 + i, 'permalink': 'http://pownce.com/notes/%d/' % note_id,
+            'sender': make_user(i)}
+
+def make_note(i, note_type='message', replies=0, recipients=0):
+    note = {'id': 1000000 + i, 'type': note_type,
+            'body': 'Note %d, a message about something that happened today.' % i,
+            'display_since': '%d hours ago' % (i % 24), 'seconds_since': i * 3600,
+            'timestamp': 1200000000 + i * 3600, 'is_public': i % 2,
+            'num_recipients': recipients, 'num_replies': replies, 'stars': 4.5,
+            'permalink': 'http://pownce.com/user%d/notes/%d/' % (i, 1000000 + i),
+            'sender': make_user(i)}
+    if note_type == 'link':
+        note['link'] = {'url': 'http://example.com/articles/%d' % i}
+    elif note_type == 'event':
+        note['event'] = {'name': 'Meetup %d' % i, 'location': 'The usual place',
+                         'date': '2008-03-%02d 19:30:00' % (i % 28 + 1),
+                         'ical': 'http://pownce.com/ical/%d/' % i}
+    elif note_type == 'file':
+        note['file'] = {'name': 'picture%d.jpg' % i, 'type': 'image',
+                        'content_type': 'image/jpeg', 'content_length': 123456,
+                        'url': 'http://pownce.com/files/%d/picture.jpg' % i}
+    if replies:
+        note['replies'] = [make_reply(j, note['id']) for j in xrange(replies)]
+    if recipients:
+        note['recipients'] = [make_user(j) for j in xrange(recipients)]
+    return note
+
+def make_note_list(count=NOTES):
+    types = ('message', 'message', 'link', 'event', 'file')
+    return {'notes': [make_note(i, types[i % len(types)], replies=i % 4)
+                      for i in xrange(count)]}
+
+class FixtureApi(pownce.Api):
+    """
+    Answers note list requests with a JSON document, in chunks like a
+    streamed response, instead of asking Pownce.
+    """
+    def __init__(self, document):
+        pownce.Api.__init__(self, 'user0', 'secret', 'benchmark')
+        self.chunks = [document[i:i + CHUNK_SIZE]
+                       for i in xrange(0, len(document), CHUNK_SIZE)]
+
+    def _stream_response(self, url, postdata=None, user_agent=None, headers=None):
+        return 200, {}, iter(self.chunks)
+
+def touch_user(user):
+    return (user.username, user.first_name, user.fan_count, user.max_upload_mb)
+
+def touch_note(note):
+    touch_user(note.sender)
+    values = [note.id, note.body, note.type, note.timestamp, note.seconds_since]
+    if isinstance(note, pownce.Link):
+        values.append(note.link)
+    elif isinstance(note, pownce.Event):
+        values.append(note.event.date_parsed)
+    elif isinstance(note, pownce.File):
+        values.append(note.file_details.url)
+    return values
+
+def benchmarks():
+    """
+    Returns ``(name, function)`` pairs, each function building and
+    returning a result from the fixtures.
+    """
+    user = make_user(1)
+    message = make_note(1, 'message')
+    link = make_note(2, 'link')
+    event = make_note(3, 'event')
+    file_note = make_note(4, 'file')
+    with_replies = make_note(5, 'message', replies=REPLIES)
+    with_recipients = make_note(6, 'message', recipients=RECIPIENTS)
+    note_list = make_note_list()
+    document = simplejson.dumps(note_list)
+    api = FixtureApi(document)
+    notes_url = api._notes_url('user0', None, NOTES, None, None, None, None)
+
+    def build_user():
+        user_obj = pownce.User(user)
+        touch_user(user_obj)
+        return user_obj
+
+    def build(klass, note_dict):
+        def build_note():
+            note = klass(note_dict)
+            touch_note(note)
+            return note
+        return build_note
+
+    def build_replies():
+        note = pownce.Message(with_replies)
+        for reply in note.replies:
+            touch_note(reply)
+        return note
+
+    def build_recipients():
+        note = pownce.Message(with_recipients)
+        for recipient in note.recipients:
+            touch_user(recipient)
+        return note
+
+    def build_notes():
+        return api._build_notes(note_list)
+
+    def build_notes_touched():
+        notes = api._build_notes(note_list)
+        for note in notes:
+            touch_note(note)
+        return notes
+
+    def decode_and_build():
+        return api._build_notes(simplejson.loads(document))
+
+    return [
+        ('user', build_user),
+        ('message', build(pownce.Message, message)),
+        ('link', build(pownce.Link, link)),
+        ('event', build(pownce.Event, event)),
+        ('file', build(pownce.File, file_note)),
+        ('replies_%d' % REPLIES, build_replies),
+        ('recipients_%d' % RECIPIENTS, build_recipients),
+        ('build_notes_%d' % NOTES, build_notes),
+        ('build_notes_%d_touched' % NOTES, build_notes_touched),
+        ('decode_build_notes_%d' % NOTES, decode_and_build),
+        ('get_public_notes_%d' % NOTES, lambda: api.get_public_notes(limit=NOTES)),
+        ('get_notes_%d' % NOTES, lambda: api.get_notes('user0', limit=NOTES)),
+        ('stream_notes_%d' % NOTES, lambda: list(api._stream_notes(notes_url))),
+    ]
+
+def max_rss():
+    # kilobytes on Linux, bytes on Mac OS X
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run(func, number):
+    """
+    Returns the time per call of ``func``, the best of three rounds of
+    ``number`` calls, the gc tracked objects its result keeps alive and
+    the growth of the peak memory use while it was called. Meant to be
+    called once per process, see ``run_in_process``.
+    """
+    rss = max_rss()
+    # fill the caches of the modules used first
+    func()
+    gc.collect()
+    objects = len(gc.get_objects())
+    result = func()
+    retained = len(gc.get_objects()) - objects
+    del result
+    best = None
+    for i in xrange(3):
+        gc.collect()
+        start = time.time()
+        for j in xrange(number):
+            func()
+        seconds = (time.time() - start) / number
+        if best is None or seconds < best:
+            best = seconds
+    return {'seconds': best, 'objects': retained, 'max_rss_growth': max_rss() - rss}
+
+def run_in_process(name, number):
+    """
+    Runs the benchmark ``name`` in a new Python process and returns
+    its results.
+    """
+    child = subprocess.Popen([sys.executable, __file__, '--child', '-n', str(number), name],
+                             stdout=subprocess.PIPE)
+    output = child.communicate()[0]
+    if child.returncode:
+        raise SystemExit("Benchmark %s failed" % name)
+    return simplejson.loads(output)
+
+def main():
+    parser = OptionParser(usage="%prog [-n NUMBER] [-o FILE] [-c OLD_FILE] [BENCHMARK ...]")
+    parser.add_option('-n', '--number', type='int', default=200,
+                      help="calls per round")
+    parser.add_option('-o', '--output',
+                      default=os.path.join(tempfile.gettempdir(),
+                          'parsing-%s.json' % time.strftime('%Y%m%d-%H%M%S')),
+                      help="file to save the results to")
+    parser.add_option('-c', '--compare',
+                      help="results of an earlier run to compare with")
+    parser.add_option('--child', action='store_true', default=False,
+                      help="run the one benchmark given in this process")
+    options, names = parser.parse_args()
+
+    selected = benchmarks()
+    if options.child:
+        print simplejson.dumps(run(dict(selected)[names[0]], options.number))
+        return
+    if names:
+        selected = [(name, func) for (name, func) in selected if name in names]
+    old = {}
+    if options.compare:
+        old = simplejson.load(open(options.compare))['results']
+
+    results = {}
+    print "%-26s %12s %9s %10s %9s" % ('benchmark', 'usec/call', 'objects',
+                                       'rss growth', 'vs. old')
+    for (name, func) in selected:
+        result = results[name] = run_in_process(name, options.number)
+        change = ''
+        if name in old:
+            change = '%.2fx' % (result['seconds'] / old[name]['seconds'])
+        print "%-26s %12.1f %9d %10d %9s" % (name, result['seconds'] * 1e6,
+            result['objects'], result['max_rss_growth'], change)
+
+    output = open(options.output, 'w')
+    simplejson.dump({'time': time.time(), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'number': options.number,
+                     'results': results},
+                    output, indent=2, sort_keys=True)
+    output.close()
+    print "Saved to %s" % options.output
+
+if __name__ == '__main__':
+    main()
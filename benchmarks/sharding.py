@@ -0,0 +1,176 @@
+"""
+Measures how the throughput of a sharded deployment grows with the
+number of worker processes.
+
+For every worker count a ``shard.Supervisor`` is started against a
+local fake of the Pownce API (see loadtest.py), and ``--concurrency``
+chat messages from different JIDs are kept in flight for
+``--duration`` seconds: every reply is answered with the next message.
+The fake Pownce server and the routing share this process, so they
+limit the scaling at some point.
+
+Run from the top of the source tree::
+
+    python benchmarks/sharding.py [--workers 1,2,4] [--duration 10]
+        [--concurrency 64] [--mix refresh:3,ping:1] [--latency 0]
+        [--async] [--threads 4]
+
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from twisted.internet import defer, reactor, task
+from twisted.web import server
+from twisted.words.xish import domish
+
+from loadtest import FakePownce, MESSAGES, USERS, parse_mix, percentile
+
+class Replies(object):
+    """
+    Stands in for the supervisor's outbound queue: matches the replies
+    with the messages sent and sends the next message for every reply.
+    """
+    def __init__(self, supervisor_factory, mix, concurrency):
+        self.mix = mix
+        self.concurrency = concurrency
+        self.supervisor = supervisor_factory(self)
+        self.pending = {}
+        self.latencies = []
+        self.sent = 0
+        self.sending = False
+
+    def start(self):
+        self.sending = True
+        self.start_time = time.time()
+        for i in xrange(self.concurrency):
+            self.send_next()
+
+    def stop(self):
+        self.sending = False
+        self.elapsed = time.time() - self.start_time
+
+    def send_next(self):
+        self.sent += 1
+        text = MESSAGES[random.choice(self.mix)]
+        if '%d' in text:
+            text = text % self.sent
+        jid = 'bench%d@example.com/r%d' % (self.sent % USERS, self.sent)
+        self.pending[jid] = time.time()
+        self.supervisor.route(jid, text)
+
+    def send(self, obj, key=None):
+        if domish.IElement.providedBy(obj):
+            obj = obj.toXml()
+        to = obj.split("to='", 1)[1].split("'", 1)[0]
+        start = self.pending.pop(to, None)
+        if start is None:
+            return
+        if self.sending:
+            self.latencies.append(time.time() - start)
+            self.send_next()
+
+@defer.inlineCallbacks
+def wait_for(condition, timeout=60):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise RuntimeError("Timed out")
+        yield task.deferLater(reactor, 0.1, lambda: None)
+
+@defer.inlineCallbacks
+def measure(workers, options, mix, worker_settings):
+    from powncebot import shard
+
+    def make_supervisor(replies):
+        return shard.Supervisor(replies, workers, settings=worker_settings)
+
+    replies = Replies(make_supervisor, mix, options.concurrency)
+    supervisor = replies.supervisor
+    supervisor.startService()
+    yield wait_for(lambda: len(supervisor.ring.nodes) == workers)
+    replies.start()
+    yield task.deferLater(reactor, options.duration, replies.stop)
+    yield supervisor.stopService()
+    defer.returnValue(replies)
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--workers', default='1,2,4',
+                      help="worker counts to measure")
+    parser.add_option('--duration', type='float', default=10,
+                      help="seconds to measure for, per worker count")
+    parser.add_option('--concurrency', type='int', default=64,
+                      help="messages in flight")
+    parser.add_option('--mix', default='refresh:3,ping:1',
+                      help="commands and their weights")
+    parser.add_option('--latency', type='float', default=0.0,
+                      help="seconds the fake Pownce takes to answer")
+    parser.add_option('--async', action='store_true', default=False,
+                      help="use the non-blocking Pownce client")
+    parser.add_option('--threads', type='int', default=4,
+                      help="command threads of the blocking client")
+    options, args = parser.parse_args()
+    counts = [int(count) for count in options.workers.split(',')]
+    mix = parse_mix(options.mix)
+
+    fake = FakePownce(options.latency)
+    port = reactor.listenTCP(0, server.Site(fake), interface='127.0.0.1')
+
+    database = tempfile.mktemp(suffix='.db')
+    worker_settings = {
+        'DATABASE_URI': 'sqlite:///%s' % database,
+        'JABBER_ID': 'bot@example.com/bot',
+        'APPLICATION_KEY': 'benchmark',
+        'API_URL': 'http://127.0.0.1:%d/2.0/' % port.getHost().port,
+        'ASYNC_API': options.async,
+        'COMMAND_THREADS': options.threads,
+        'RATE_PER_JID': 0,
+        'RATE_GLOBAL': 0,
+        'TIMELINE_INTERVAL': 0,
+    }
+    from powncebot import settings
+    for (name, value) in worker_settings.items():
+        setattr(settings, name, value)
+    from powncebot import accounts
+    datastore = accounts.Datastore()
+    for i in xrange(USERS):
+        datastore.register('bench%d' % i, 'secret', 'bench%d@example.com' % i)
+
+    results = []
+
+    @defer.inlineCallbacks
+    def run():
+        try:
+            for workers in counts:
+                replies = yield measure(workers, options, mix, worker_settings)
+                results.append((workers, replies))
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    os.remove(database)
+
+    print "%-8s %10s %9s %9s %9s" % ('workers', 'replies/s', 'speedup',
+                                     'p50 ms', 'p99 ms')
+    base = None
+    for (workers, replies) in results:
+        latencies = sorted(replies.latencies)
+        if not latencies:
+            print "%-8d %10s" % (workers, 'no replies')
+            continue
+        throughput = len(latencies) / replies.elapsed
+        if base is None:
+            base = throughput
+        print "%-8d %10.1f %8.2fx %9.1f %9.1f" % (workers, throughput,
+            throughput / base, percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000)
+
+if __name__ == '__main__':
+    main()
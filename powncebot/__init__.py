@@ -1,14 +1,42 @@
+import time
 import inspect
+import random
+import tempfile
+import itertools
 
-from twisted.python import log
+from twisted.internet import reactor
+from twisted.python import log, threadable
+from twisted.words.protocols.jabber.jid import JID
 from twisted.words.xish import domish
-from twisted.words.xish.domish import Element as DomishElement
+from twisted.words.xish.domish import Element as DomishElement, escapeToXml
 
 from wokkel.xmppim import MessageProtocol
 
-from powncebot import commands, accounts
+from powncebot import commands, accounts, dispatch, outbound, outbox, profiler
+from powncebot import ratelimit, settings, stats, timeline, webclient
 
-HELP_COMMANDS = ('register', 'unregister', 'link', 'message', 'help', 'about')
+HELP_COMMANDS = ('register', 'unregister', 'link', 'message', 'refresh', 'help', 'about')
+
+SLOW_DOWN = "Slow down! Please wait a moment before sending more commands."
+
+STANZA = ("<message to='%%s' from='%s' type='chat' id='F_%%d'>"
+          "<body>%s</body></message>")
+
+def pool_size(name, default):
+    """
+    Returns the size of the thread pool set as ``name``, or 0 to run
+    the calls in the reactor thread: with the async client nothing
+    blocks, and with an in-memory database every thread would get its
+    own, empty one.
+    """
+    if getattr(settings, 'ASYNC_API', False):
+        return 0
+    size = getattr(settings, name, default)
+    uri = getattr(settings, 'DATABASE_URI', '')
+    if size and (uri.rstrip('/') == 'sqlite:' or uri.endswith(':memory:')):
+        log.msg("Not using threads for %s with the in-memory database %s" % (name, uri))
+        return 0
+    return size
 
 class PownceBot(MessageProtocol):
     """This is a Pownce jabber bot."""
@@ -28,19 +56,176 @@ class PownceBot(MessageProtocol):
                     if hasattr(klass, 'usage'):
                         self.help.append("%s %s" % (name, klass.usage))
         self.help = "\n".join(self.help)
-        self.session = accounts.Datastore().get_session()
+
+        # pre-serialized replies of the commands which don't need any
+        # state, used when they are sent without arguments, with the
+        # name their timings are recorded under (the same as for the
+        # command class, whichever alias was used)
+        self.ids = itertools.count()
+        self.templates = {}
+        for (name, klass) in self.commands.items():
+            if klass.__dict__.get('replies'):
+                replies = [self.template(text) for text in klass.replies]
+            elif klass is commands.help:
+                replies = [self.template(klass.intro % self.help)]
+            else:
+                continue
+            self.templates[name] = self.templates[name + ':'] = (
+                'command.%s' % klass.__name__, replies)
+        self.datastore = accounts.Datastore()
+        self.session = self.datastore.get_session()
+
+        # the part of the JIDs this bot is responsible for when it is a
+        # worker of a sharded deployment, see shard.Shard
+        self.shard = None
+
+        # the timeline polls and outbox deliveries get a pool of their
+        # own, so they can't hold up the users' commands
+        self.dispatcher = dispatch.Dispatcher(pool_size('COMMAND_THREADS', 4),
+                                              'powncebot-commands')
+        self.background = dispatch.Dispatcher(pool_size('BACKGROUND_THREADS', 4),
+                                              'powncebot-background')
+
+        self.limiter = ratelimit.RateLimiter(
+            getattr(settings, 'RATE_PER_JID', 1.0),
+            getattr(settings, 'BURST_PER_JID', 5),
+            getattr(settings, 'RATE_GLOBAL', 50.0),
+            getattr(settings, 'BURST_GLOBAL', 100))
+
+        self.outbound = outbound.OutboundQueue(
+            getattr(settings, 'OUTBOUND_HIGH_WATER', 500),
+            getattr(settings, 'OUTBOUND_LOW_WATER', 100),
+            getattr(settings, 'OUTBOUND_BATCH', 20),
+            getattr(settings, 'OUTBOUND_INTERVAL', 0.05))
+
+        self.outbox = outbox.Outbox(self,
+            getattr(settings, 'OUTBOX_INTERVAL', 5),
+            getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8),
+            getattr(settings, 'OUTBOX_RETRY_DELAY', 5),
+            getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 900))
+        reactor.callWhenRunning(self.outbox.start)
+
+        self.timeline = None
+        interval = getattr(settings, 'TIMELINE_INTERVAL', 300)
+        if interval:
+            quota = getattr(settings, 'API_QUOTA_PER_HOUR', 0)
+            share = getattr(settings, 'TIMELINE_QUOTA_SHARE', 0.5)
+            # a budget of 0 is no limit, so a small quota still allows a poll
+            budget = 0
+            if quota:
+                budget = max(1, int(quota * share / 60))
+            self.timeline = timeline.Timeline(self, interval,
+                getattr(settings, 'TIMELINE_CONCURRENCY', 4),
+                getattr(settings, 'TIMELINE_JITTER', 0.2),
+                getattr(settings, 'TIMELINE_CATCH_UP', 5),
+                getattr(settings, 'TIMELINE_MIN_INTERVAL', 30),
+                getattr(settings, 'TIMELINE_MAX_INTERVAL', 3600),
+                budget)
+            reactor.callWhenRunning(self.timeline.start)
+
+        self.profiler = profiler.Profiler(
+            getattr(settings, 'PROFILE_DIR', None) or tempfile.gettempdir())
+
+        self.monitor = stats.ReactorMonitor()
+        reactor.callWhenRunning(self.monitor.start)
+        self.addStatsSources()
+
+    def addStatsSources(self):
+        """
+        Makes the numbers of the bot's parts available in the stats.
+        """
+        registry = stats.registry
+        registry.add_source('dispatcher', self.dispatcher.stats)
+        registry.add_source('dispatcher.background', self.background.stats)
+        registry.add_source('limiter', self.limiter.stats)
+        registry.add_source('outbound', self.outbound.stats)
+        registry.add_source('outbox', self.outbox.stats)
+        if self.timeline is not None:
+            registry.add_source('timeline', self.timeline.stats)
+        registry.add_source('cache.responses', accounts.responses.stats)
+        registry.add_source('cache.validators', accounts.validators.stats)
+        registry.add_source('cache.user_ids', accounts.user_ids.stats)
+        registry.add_source('in_flight', accounts.in_flight.stats)
+        # only the blocking client pools its connections, the async one
+        # opens a connection per request
+        pool = accounts.Api.connection_pool
+        registry.add_source('http_pool', lambda: {'created': pool.created,
+                                                  'reused': pool.reused})
+        registry.add_source('http_async', lambda: {'connections': webclient.connections})
+
+    def owns(self, jid):
+        """
+        Returns whether this bot handles ``jid``'s timeline and outbox.
+        """
+        return self.shard is None or self.shard.owns(jid)
+
+    def presence(self, jid, available):
+        if self.timeline is not None:
+            self.timeline.presence(jid, available)
+
+    def connectionInitialized(self):
+        MessageProtocol.connectionInitialized(self)
+        self.outbound.attach(self.xmlstream)
+
+    def connectionLost(self, reason):
+        MessageProtocol.connectionLost(self, reason)
+        self.outbound.detach()
 
     def getCommand(self, command):
         return self.commands.get(command, commands.unknown)
 
+    def runCommand(self, klass, message, args):
+        """
+        Runs a command and returns its ``Deferred``, if any. The time
+        it takes is recorded in the stats.
+        """
+        return stats.measure('command.%s' % klass.__name__, self.makeCommand,
+                             (klass, message, args))
+
+    def makeCommand(self, klass, message, args):
+        return klass(self, message, *args).deferred
+
+    def template(self, content):
+        """
+        Returns a serialized chat message stanza with the given content,
+        with placeholders for the recipient and the stanza id.
+        """
+        return STANZA % (escapeToXml(self.jid.full(), 1).replace('%', '%%'),
+                         escapeToXml(content).replace('%', '%%'))
+
+    def replyTemplate(self, jid, templates):
+        """
+        Sends one of the given ``templates`` to ``jid``.
+        """
+        if len(templates) > 1:
+            template = random.choice(templates)
+        else:
+            template = templates[0]
+        self.outbound.send(template % (escapeToXml(jid, 1), self.ids.next()))
+
     def reply(self, jid, content):
+        if not threadable.isInIOThread():
+            return reactor.callFromThread(self.reply, jid, content)
         message = domish.Element((None, "message"))
         message['to'] = jid
         message['from'] = self.jid.full()
         message['type'] = 'chat'
         message.addUniqueId()
         message.addElement((None,'body'), content=content)
-        self.xmlstream.send(message)
+        self.outbound.send(message, (jid, content))
+
+    def admit(self, jid, sender):
+        """
+        Returns whether a command from ``jid`` may run, telling
+        ``sender`` to slow down if not.
+        """
+        if not self.limiter.allow(jid):
+            if self.limiter.throttle(jid):
+                self.reply(sender, SLOW_DOWN)
+            return False
+        if self.timeline is not None:
+            self.timeline.active(jid)
+        return True
 
     def onMessage(self, message):
         """Messages sent to the bot will arrive here. Command handling routing
@@ -48,10 +233,35 @@ class PownceBot(MessageProtocol):
         if not isinstance(message.body, DomishElement):
             return None
 
-        text = unicode(message.body).encode('utf-8').strip()
-        cmdargs = text.split()
+        # stateless commands without arguments are answered from the
+        # templates before the message is parsed any further
+        text = unicode(message.body).strip()
+        templates = self.templates.get(text.lower())
+        if templates is not None:
+            sender = message['from']
+            if self.admit(sender.split('/', 1)[0], sender):
+                name, templates = templates
+                start = time.time()
+                self.replyTemplate(sender, templates)
+                stats.registry.record(name, time.time() - start)
+            return None
+
+        jid = JID(message['from']).userhost()
+        if not self.admit(jid, message['from']):
+            return None
+
+        cmdargs = text.encode('utf-8').split()
         command = cmdargs[0].lower()
         args = cmdargs[1:]
         if command.endswith(':'):
             command = command[:-1]
-        self.getCommand(command)(self, message, *args)
+        klass = self.getCommand(command)
+        if klass.admin and jid not in getattr(settings, 'ADMIN_JIDS', ()):
+            klass = commands.unknown
+        if klass.blocking:
+            d = self.dispatcher.dispatch(jid, self.runCommand, klass, message, args)
+            d.addErrback(log.err)
+        else:
+            d = self.runCommand(klass, message, args)
+            if d is not None:
+                d.addErrback(log.err)
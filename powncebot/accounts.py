@@ -1,40 +1,347 @@
 import pownce
-import simplejson
+import time
+import hashlib
+import urlparse
 from urllib import urlencode
 from urllib2 import HTTPError
 
-from sqlalchemy import create_engine, MetaData, Table
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import sessionmaker, mapper
+from twisted.internet import defer, reactor
+from twisted.python import log
 
-from powncebot import settings
+from sqlalchemy import create_engine, exceptions, MetaData, Table
+from sqlalchemy import Column, Float, Index, Integer, String, Text
+from sqlalchemy.orm import sessionmaker, scoped_session, mapper
+
+from powncebot import settings, stats, webclient
+from powncebot.dispatch import SingleFlight
+from powncebot.cache import TTLCache, LRUCache, SQLiteCache
+from powncebot.responses import ResponseCache
+
+# Recently verified Pownce credentials, see credentials_key
+credentials = TTLCache(getattr(settings, 'CREDENTIALS_TTL', 900))
+
+# Default recipients by Pownce username, see Api.send_to_default
+send_to_defaults = TTLCache(getattr(settings, 'SEND_TO_TTL', 3600))
+
+# Fraction of SEND_TO_TTL after which a cached default recipient is
+# refreshed in the background
+SEND_TO_REFRESH = 0.8
+
+# Pownce user ids by username, unknown usernames are stored as
+# UNKNOWN_USER for USER_NOT_FOUND_TTL seconds
+user_ids = LRUCache(getattr(settings, 'USER_ID_CACHE_SIZE', 1000))
+UNKNOWN_USER = object()
+USER_NOT_FOUND_TTL = getattr(settings, 'USER_NOT_FOUND_TTL', 300)
+
+# Validators and decoded bodies of GET responses for conditional
+# requests, by a hash of the credentials and URL (like the responses
+# cache), weighed by their size in bytes
+validators = LRUCache(getattr(settings, 'VALIDATOR_CACHE_SIZE', 1000),
+                      max_weight=getattr(settings, 'VALIDATOR_CACHE_BYTES', 8 * 1024 * 1024))
+
+# Decoded responses of the read-only endpoints, see ResponseCache
+RESPONSE_TTLS = {'user': 300, 'note': 60, 'note_recipients': 120,
+                 'related_users': 600}
+RESPONSE_TTLS.update(getattr(settings, 'RESPONSE_TTLS', {}))
+if getattr(settings, 'RESPONSE_CACHE_PATH', None):
+    response_backend = SQLiteCache(settings.RESPONSE_CACHE_PATH,
+                                   getattr(settings, 'RESPONSE_CACHE_SIZE', 2000))
+else:
+    response_backend = LRUCache(getattr(settings, 'RESPONSE_CACHE_SIZE', 2000),
+        max_weight=getattr(settings, 'RESPONSE_CACHE_BYTES', 8 * 1024 * 1024))
+responses = ResponseCache(response_backend, RESPONSE_TTLS)
+
+# Seconds a request to Pownce may take before it fails
+HTTP_TIMEOUT = getattr(settings, 'HTTP_TIMEOUT', 30)
+
+# GET requests for the same URL and credentials running at the same time
+# are made only once
+in_flight = SingleFlight()
 
 class Api(pownce.Api):
-    def send_to_default(self):
+    # looked up for every request, so settings changed after this module
+    # is imported (by the benchmarks and the shard workers) take effect
+    @property
+    def API_URL(self):
+        return getattr(settings, 'API_URL', pownce.Api.API_URL)
+
+    connection_pool = pownce.ConnectionPool(
+        getattr(settings, 'HTTP_POOL_SIZE', 4),
+        getattr(settings, 'HTTP_IDLE_TIMEOUT', 30),
+        HTTP_TIMEOUT)
+
+    validator_cache = validators
+
+    def send_to_default(self, refresh=False):
         """
         Gets the default send_to for the authenticated user.
+
+        The result is cached per user. Shortly before it expires it is
+        refreshed in the background while the cached value is still
+        returned; ``refresh`` fetches it from Pownce right away, and
+        drops the responses cached for the user.
         """
+        if refresh:
+            responses.invalidate(self.encoded_auth)
+            return self._fetch_send_to_default()
+        cached = send_to_defaults.get(self.username)
+        if cached is None:
+            return self._fetch_send_to_default()
+        selected, refresh_at = cached
+        if refresh_at is not None and refresh_at <= time.time():
+            # keep the value while the refresh is running, but make
+            # sure nobody else starts one
+            send_to_defaults.set(self.username, (selected, None),
+                                 send_to_defaults.ttl * (1 - SEND_TO_REFRESH))
+            self._refresh_send_to_default()
+        return self._succeed(selected)
+
+    def _fetch_send_to_default(self):
         query_dict = {'app_key' : self.app_key}
         url = '%ssend/send_to.json?%s' % (self.API_URL, urlencode(query_dict))
-        json_obj = simplejson.loads(self._fetch(url))
+        return self._then(self._fetch_json(url), self._build_send_to_default)
+
+    def _refresh_send_to_default(self):
+        def refresh():
+            try:
+                self._fetch_send_to_default()
+            except:
+                log.err()
+        reactor.callFromThread(reactor.callInThread, refresh)
+
+    def _build_send_to_default(self, json_obj):
         if 'selected' in json_obj.keys():
-            return json_obj['selected']
-        elif 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            raise error_class("Error retrieving 'send_to' list: %s" % error['message'])
+            selected = json_obj['selected']
+            refresh_at = time.time() + send_to_defaults.ttl * SEND_TO_REFRESH
+            send_to_defaults.set(self.username, (selected, refresh_at))
+            return selected
+        self._raise_error(json_obj, "Error retrieving 'send_to' list: %s")
 
-    def send_to_list(self):
-        """
-        Gets the list of potential recipients for the authenticated user.
-        """
-        query_dict = {'app_key' : self.app_key}
-        url = '%ssend/send_to.json?%s' % (self.API_URL, urllib.urlencode(query_dict))
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'users' in json_obj.keys():
-            return [User(user_dict) for user_dict in json_obj]
-        elif 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            raise error_class("Error retrieving 'send_to' list: %s" % error['message'])
+    def _succeed(self, result):
+        return result
+
+    def _fetch_json(self, url, postdata=None):
+        if postdata is not None:
+            return pownce.Api._fetch_json(self, url, postdata)
+        endpoint = responses.endpoint(url)
+        if endpoint is not None:
+            json_obj = responses.get(self.encoded_auth, url)
+            if json_obj is not None:
+                return self._succeed(json_obj)
+        result = self._single_flight(url)
+        if endpoint is None:
+            return result
+        return self._then(result, self._cache_response, url, endpoint)
+
+    def _fetch_response(self, url, postdata=None, user_agent=None, headers=None):
+        return stats.measure(endpoint_name(url), self._send_request,
+                             (url, postdata, user_agent, headers), failed_response)
+
+    def _stream_response(self, url, postdata=None, user_agent=None, headers=None):
+        return stats.measure(endpoint_name(url), pownce.Api._stream_response,
+                             (self, url, postdata, user_agent, headers), failed_response)
+
+    def _send_request(self, url, postdata, user_agent, headers):
+        return pownce.Api._fetch_response(self, url, postdata, user_agent, headers)
+
+    def _single_flight(self, url):
+        return in_flight.call((self.encoded_auth, url),
+                              pownce.Api._fetch_json, self, url)
+
+    def _cache_response(self, json_obj, url, endpoint):
+        if 'error' not in json_obj:
+            responses.set(self.encoded_auth, url, endpoint, json_obj)
+        return json_obj
+
+    def _post_note(self, *args, **kwargs):
+        return self._then(pownce.Api._post_note(self, *args, **kwargs),
+                          self._invalidate_responses)
+
+    def _invalidate_responses(self, note):
+        responses.invalidate(self.encoded_auth)
+        return note
+
+class AsyncPaginator(pownce.Paginator):
+    """
+    A ``Paginator`` for ``AsyncApi``. It cannot be iterated over;
+    ``next_page`` returns a ``Deferred`` firing with the items on the
+    next page, or ``None`` at the end of the listing. The page after a
+    full one is requested as soon as that one has arrived.
+    """
+    def __iter__(self):
+        raise TypeError("AsyncPaginator pages are fetched with next_page")
+
+    def next_page(self):
+        if self.done:
+            return defer.succeed(None)
+        if self.pending is None:
+            self.pending = self._start(self.page)
+        d, self.pending = self.pending, None
+        return d.addCallback(self._received).addCallback(self._seen)
+
+    def _start(self, page):
+        d = defer.maybeDeferred(self.fetch, page)
+        return d.addErrback(self._no_page)
+
+    def _no_page(self, failure):
+        failure.trap(pownce.NotFound)
+        return None
+
+class AsyncApi(Api):
+    """
+    A non-blocking ``Api`` built on ``twisted.web``. Every endpoint
+    method returns a ``Deferred`` which fires with whatever the
+    blocking ``Api`` would have returned, or errbacks with the same
+    exceptions; the ``iter_*`` methods return an ``AsyncPaginator``.
+
+    Unlike the blocking ``Api`` it doesn't use ``connection_pool``:
+    every request opens a new connection, see ``webclient.fetch``.
+    """
+    paginator_class = AsyncPaginator
+
+    def _then(self, result, callback, *args):
+        if not isinstance(result, defer.Deferred):
+            result = defer.succeed(result)
+        return result.addCallback(callback, *args)
+
+    def _succeed(self, result):
+        return defer.succeed(result)
+
+    def _fetch_notes(self, url):
+        # twisted.web hands over complete bodies, so there is nothing
+        # to stream
+        return self._then(self._fetch_json(url), self._build_notes)
+
+    def _refresh_send_to_default(self):
+        self._fetch_send_to_default().addErrback(log.err)
+
+    def _single_flight(self, url):
+        return in_flight.defer((self.encoded_auth, url),
+                               pownce.Api._fetch_json, self, url)
+
+    def _send_request(self, url, postdata, user_agent, headers):
+        request_headers = {
+            'Accept-Encoding': 'gzip',
+            'Authorization': 'Basic %s' % self.encoded_auth,
+        }
+        if headers:
+            request_headers.update(headers)
+        method = 'GET'
+        if postdata is not None:
+            method = 'POST'
+            request_headers['Content-Type'], postdata = self._encode_postdata(postdata)
+        d = webclient.fetch(url, method, postdata, request_headers,
+                            user_agent or self.USER_AGENT, HTTP_TIMEOUT)
+        return d.addCallback(self._flatten_headers)
+
+    def _flatten_headers(self, response):
+        status, headers, body = response
+        headers = dict([(k, v[-1]) for (k, v) in headers.items()])
+        return status, headers, body
+
+def endpoint_name(url):
+    """
+    Returns the name the requests to ``url`` are measured under, the
+    API path with usernames and ids left out, e.g. "api.users/*/fans".
+    """
+    path = urlparse.urlsplit(url)[2]
+    parts = path.split('/')[2:]
+    if parts and parts[-1].endswith('.json'):
+        parts[-1] = parts[-1][:-5]
+    if len(parts) > 1 and parts[0] in ('users', 'notes', 'note_lists'):
+        parts[1] = '*'
+    return 'api.' + '/'.join(parts)
+
+def failed_response(response):
+    return response[0] >= 400
+
+def get_api(username, password):
+    """
+    Returns an API instance for the given credentials. The
+    non-blocking ``AsyncApi`` is used if ``settings.ASYNC_API`` is set.
+    """
+    if getattr(settings, 'ASYNC_API', False):
+        api_class = AsyncApi
+    else:
+        api_class = Api
+    return api_class(username, password, settings.APPLICATION_KEY)
+
+def credentials_key(username, password):
+    """
+    Returns the key of the given credentials in the ``credentials``
+    cache, which never holds plain text passwords.
+    """
+    return (username, hashlib.sha1(password).hexdigest())
+
+def login(username, password):
+    """
+    Checks the given credentials with Pownce and returns a ``Deferred``
+    firing with an api object if successful. Recently verified
+    credentials are not checked again.
+    """
+    api = get_api(username, password)
+    key = credentials_key(username, password)
+    if credentials.get(key):
+        return defer.succeed(api)
+
+    def verified(user):
+        credentials.set(key, True)
+        return api
+
+    def failed(failure):
+        failure.trap(pownce.AuthenticationRequired, pownce.NotFound,
+                     pownce.PrivacyViolation)
+        raise pownce.AuthenticationRequired
+
+    d = defer.maybeDeferred(api.get_user, username)
+    d.addCallbacks(verified, failed)
+    return d
+
+def logout(username, password):
+    """
+    Forgets that the given credentials were verified, and what Pownce
+    told them.
+    """
+    credentials.delete(credentials_key(username, password))
+    responses.invalidate(get_api(username, password).encoded_auth)
+
+def user_id(username, api):
+    """
+    Returns a ``Deferred`` firing with the Pownce id of the given
+    user. Ids are cached for good, unknown users for a short while.
+    """
+    cached = user_ids.get(username)
+    if cached is UNKNOWN_USER:
+        return defer.fail(pownce.NotFound("Unknown user '%s'" % username))
+    if cached is not None:
+        return defer.succeed(cached)
+
+    def found(user):
+        user_ids.set(username, user.raw_user_dict['id'])
+        return user.raw_user_dict['id']
+
+    def not_found(failure):
+        failure.trap(pownce.NotFound)
+        user_ids.set(username, UNKNOWN_USER, USER_NOT_FOUND_TTL)
+        return failure
+
+    d = defer.maybeDeferred(api.get_user, username)
+    d.addCallbacks(found, not_found)
+    return d
+
+def note_to(recipient, api):
+    """
+    Returns a ``Deferred`` firing with the Pownce ``note_to`` for the
+    given recipient, which is either a ``note_to`` already, a
+    ``@username`` or ``None`` for the user's default recipient.
+    """
+    if recipient is None:
+        return defer.maybeDeferred(api.send_to_default)
+    if recipient.startswith('@'):
+        d = user_id(recipient[1:], api)
+        d.addCallback(lambda friend_id: 'friend_%s' % friend_id)
+        return d
+    return defer.succeed(recipient)
 
 class Datastore(object):
     def __init__(self):
@@ -46,19 +353,195 @@ class Datastore(object):
             Column("username", String(64)),
             Column('password', String(32)),
             Column('jid', String(255)),
+            Column('since_id', Integer),
         )
+        jid_index = Index('ix_users_jid', users_table.c.jid, unique=True)
         mapper(User, users_table)
+        outbox_table = Table("outbox", self.metadata,
+            Column("id", Integer, primary_key=True),
+            Column("jid", String(255)),
+            Column("note_type", String(16)),
+            Column("note_to", String(255)),
+            Column("body", Text),
+            Column("url", String(1024)),
+            Column("attempts", Integer),
+            Column("next_attempt", Float, index=True),
+        )
+        mapper(OutboxEntry, outbox_table)
+        existed = users_table.exists()
         self.metadata.create_all()
-        self.session = sessionmaker(bind=self.engine)()
+        if existed:
+            self.migrate_column(users_table.c.since_id, 'INTEGER')
+            self.migrate_index(jid_index)
+        # commands may run in the dispatcher's thread pool, so every
+        # thread gets its own session
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+
+        # registered users by JID, detached from any session
+        self.users = {}
+        self.load_users()
+
+    def load_users(self, owns=None):
+        """
+        Reads the registered users from the database again, only those
+        whose JID ``owns`` returns true for if it is given.
+        """
+        users = {}
+        for user in self.session.query(User):
+            self.session.expunge(user)
+            if owns is None or owns(user.jid):
+                users[user.jid] = user
+        self.users = users
     
+    def migrate_index(self, index):
+        """
+        Adds ``index`` to a table created before the index existed.
+        """
+        try:
+            index.create()
+        except exceptions.DBAPIError, e:
+            # most likely it's there already
+            log.msg("Not creating index %s: %s" % (index.name, e))
+        else:
+            log.msg("Created index %s" % index.name)
+
+    def migrate_column(self, column, column_type):
+        """
+        Adds ``column`` to a table created before the column existed.
+        """
+        try:
+            self.engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                column.table.name, column.name, column_type))
+        except exceptions.DBAPIError, e:
+            # most likely it's there already
+            log.msg("Not adding column %s: %s" % (column, e))
+        else:
+            log.msg("Added column %s" % column)
+
     def get_session(self):
         return self.session
 
+    def detach(self, obj):
+        """
+        Removes ``obj`` from the session after a commit, loading its
+        attributes first: the commit may have expired them, and they
+        can't be loaded once ``obj`` is detached.
+        """
+        self.session.refresh(obj)
+        self.session.expunge(obj)
+
+    def get_user(self, jid):
+        """
+        Returns the registered ``User`` for ``jid`` or ``None``. Users
+        not known to this process are looked up in the database.
+        """
+        user = self.users.get(jid)
+        if user is None:
+            user = self.session.query(User).filter_by(jid=jid).first()
+            if user is not None:
+                self.session.expunge(user)
+                self.users[jid] = user
+        return user
+
+    def register(self, username, password, jid):
+        """
+        Stores a new ``User`` for the given Pownce account and JID.
+        """
+        user = User(username, password, jid)
+        self.session.save(user)
+        self.session.commit()
+        self.detach(user)
+        self.users[jid] = user
+        return user
+
+    def unregister(self, jid):
+        """
+        Deletes the ``User`` registered for ``jid``.
+        """
+        self.users.pop(jid, None)
+        user = self.session.query(User).filter_by(jid=jid).first()
+        if user is not None:
+            self.session.delete(user)
+            self.session.commit()
+
+    def set_since_id(self, jid, since_id):
+        """
+        Stores the id of the newest note of ``jid``'s timeline which has
+        been seen.
+        """
+        user = self.session.query(User).filter_by(jid=jid).first()
+        if user is not None:
+            user.since_id = since_id
+            self.session.commit()
+            self.detach(user)
+        cached = self.users.get(jid)
+        if cached is not None:
+            cached.since_id = since_id
+
+    def queue_note(self, jid, note_type, note_to, body, url=None):
+        """
+        Stores a note to be posted for ``jid`` in the outbox and
+        returns the ``OutboxEntry``.
+        """
+        entry = OutboxEntry(jid, note_type, note_to, body, url)
+        self.session.save(entry)
+        self.session.commit()
+        self.detach(entry)
+        return entry
+
+    def due_notes(self, now, limit=None):
+        """
+        Returns the outbox entries due to be posted at ``now``, oldest
+        first.
+        """
+        query = self.session.query(OutboxEntry).filter(
+            OutboxEntry.next_attempt <= now).order_by(OutboxEntry.id)
+        if limit is not None:
+            query = query.limit(limit)
+        entries = query.all()
+        for entry in entries:
+            self.session.expunge(entry)
+        return entries
+
+    def retry_note(self, entry_id, next_attempt):
+        """
+        Counts a failed attempt to post an outbox entry and postpones
+        the next one.
+        """
+        entry = self.session.query(OutboxEntry).get(entry_id)
+        if entry is not None:
+            entry.attempts += 1
+            entry.next_attempt = next_attempt
+            self.session.commit()
+
+    def remove_note(self, entry_id):
+        """
+        Removes an outbox entry once it has been posted or given up on.
+        """
+        entry = self.session.query(OutboxEntry).get(entry_id)
+        if entry is not None:
+            self.session.delete(entry)
+            self.session.commit()
+
 class User(object):
     def __init__(self, username, password, jid):
         self.username = username
         self.password = password
         self.jid = jid
+        self.since_id = None
 
     def __repr__(self):
         return "<User('%s, '%s')>" % (self.username, self.jid)
+
+class OutboxEntry(object):
+    def __init__(self, jid, note_type, note_to, body, url=None):
+        self.jid = jid
+        self.note_type = note_type
+        self.note_to = note_to
+        self.body = body
+        self.url = url
+        self.attempts = 0
+        self.next_attempt = time.time()
+
+    def __repr__(self):
+        return "<OutboxEntry('%s', '%s')>" % (self.jid, self.note_type)
@@ -0,0 +1,289 @@
+import time
+import sqlite3
+import threading
+
+import simplejson
+
+class TTLCache(object):
+    """
+    A thread-safe mapping whose entries expire ``ttl`` seconds after
+    they were set. A ``ttl`` of 0 disables caching.
+    """
+    def __init__(self, ttl, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """
+        Returns the value for ``key``, or ``default`` if there is none
+        or it has expired.
+        """
+        self.lock.acquire()
+        try:
+            entry = self.data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= self.clock():
+                del self.data[key]
+                return default
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores ``value`` for ``key``, expiring after ``ttl`` seconds
+        or the cache's default time-to-live.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        self.lock.acquire()
+        try:
+            self.data[key] = (value, self.clock() + ttl)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            self.data.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.data.clear()
+        finally:
+            self.lock.release()
+
+PREV, NEXT, KEY, VALUE, EXPIRES, WEIGHT = range(6)
+
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most ``size`` entries, evicting
+    the least recently used entry when full; with a ``size`` of 0
+    nothing is cached. Entries can optionally expire after a
+    time-to-live.
+
+    Entries can also be given a weight (such as their size in bytes),
+    in which case at most ``max_weight`` is held; entries heavier than
+    that are not stored at all.
+
+    The ``hits``, ``misses`` and ``evictions`` attributes count the
+    cache's effectiveness, see ``stats``.
+    """
+    def __init__(self, size, ttl=None, clock=time.time, max_weight=None):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.max_weight = max_weight
+        self.weight = 0
+        self.data = {}
+        # circular doubly linked list, least recently used first
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, None, 0]
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """
+        Returns the value for ``key`` and marks it as recently used,
+        or returns ``default`` if there is none or it has expired.
+        """
+        self.lock.acquire()
+        try:
+            link = self.data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            if link[EXPIRES] is not None and link[EXPIRES] <= self.clock():
+                self._remove(link)
+                self.misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[VALUE]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, ttl=None, weight=1):
+        """
+        Stores ``value`` for ``key``, expiring after ``ttl`` seconds
+        or the cache's default time-to-live, if any.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is None:
+            expires = None
+        else:
+            expires = self.clock() + ttl
+        self.lock.acquire()
+        try:
+            link = self.data.get(key)
+            if link is not None:
+                self._remove(link)
+            if self.size <= 0:
+                return
+            if self.max_weight is not None:
+                if weight > self.max_weight:
+                    return
+                while self.data and self.weight + weight > self.max_weight:
+                    self._evict()
+            if len(self.data) >= self.size:
+                self._evict()
+            link = [None, None, key, value, expires, weight]
+            self.data[key] = link
+            self.weight += weight
+            self._append(link)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            link = self.data.get(key)
+            if link is not None:
+                self._remove(link)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.data.clear()
+            self.weight = 0
+            self.root[:] = [self.root, self.root, None, None, None, 0]
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache's counters and current size.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self.data),
+                'weight': self.weight}
+
+    def _evict(self):
+        self._remove(self.root[NEXT])
+        self.evictions += 1
+
+    def _remove(self, link):
+        self._unlink(link)
+        del self.data[link[KEY]]
+        self.weight -= link[WEIGHT]
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def _append(self, link):
+        last = self.root[PREV]
+        last[NEXT] = self.root[PREV] = link
+        link[PREV], link[NEXT] = last, self.root
+
+class SQLiteCache(object):
+    """
+    A size-bounded cache like ``LRUCache`` kept in an SQLite database at
+    ``path``, so it survives restarts and can be shared by several
+    processes. Values are stored as JSON.
+
+    ``weight`` is accepted by ``set`` for compatibility with
+    ``LRUCache``, but only the number of entries is bounded.
+    """
+    def __init__(self, path, size, ttl=None, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # losing the cache in a crash doesn't matter
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache ("
+                        "key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ix_cache_used ON cache (used)")
+        self.db.commit()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        self.lock.acquire()
+        try:
+            return self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        finally:
+            self.lock.release()
+
+    def get(self, key, default=None):
+        now = self.clock()
+        self.lock.acquire()
+        try:
+            row = self.db.execute("SELECT value, expires FROM cache WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                self.misses += 1
+                return default
+            self.db.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+            return simplejson.loads(row[0])
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, ttl=None, weight=1):
+        if ttl is None:
+            ttl = self.ttl
+        now = self.clock()
+        if ttl is None:
+            expires = None
+        else:
+            expires = now + ttl
+        value = simplejson.dumps(value)
+        self.lock.acquire()
+        try:
+            self.db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                            (key, value, expires, now))
+            count = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.size:
+                # expired entries first, then the least recently used
+                self.db.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+                count = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.size:
+                self.db.execute("DELETE FROM cache WHERE key IN ("
+                                "SELECT key FROM cache ORDER BY used LIMIT ?)",
+                                (count - self.size,))
+                self.evictions += count - self.size
+            self.db.commit()
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.db.commit()
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.db.execute("DELETE FROM cache")
+            self.db.commit()
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self)}
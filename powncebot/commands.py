@@ -1,14 +1,18 @@
 import re
+import time
 import random
 
+from twisted.internet import defer
 from twisted.python import log
 from twisted.words.protocols.jabber.jid import JID
 
-from powncebot import accounts, settings
+from powncebot import accounts
+from powncebot.stats import registry
+from powncebot.profiler import format_hottest
 
 URL_RE = re.compile(r'^https?://\S+$')
 
-from pownce import PrivacyViolation, NotFound, AuthenticationRequired, ServerError
+from pownce import AuthenticationRequired, ServerError
 
 class GuidanceNeeded(Exception):
     pass
@@ -24,6 +28,21 @@ class Command(object):
 
     aliases = ()
 
+    # Blocking commands are run in the dispatcher's thread pool, one
+    # at a time per JID.
+    blocking = False
+
+    # Commands which always answer with one of these texts and need no
+    # other state are answered from pre-serialized stanzas by the bot.
+    replies = None
+
+    # Commands which talk to Pownce set this to the ``Deferred`` that
+    # fires once they are done.
+    deferred = None
+
+    # Admin commands are only run for the JIDs in settings.ADMIN_JIDS.
+    admin = False
+
     def __init__(self, parent, message):
         self.parent = parent
         self.message = message
@@ -47,10 +66,11 @@ class Command(object):
         """
         log.msg(text)
 
-    def handle_to(self, to, api):
+    def handle_to(self, to):
         """
-        Handles the recipient by looking for the allowed strings and loading
-        the user information if needed.
+        Handles the recipient by looking for the allowed strings. Returns
+        the Pownce note_to, "@<username>" for users to be looked up when
+        the note is posted, or None if ``to`` is no recipient.
         """
         for option in ('@public', '@all', '@friend_', '@set_'):
             if to.startswith(option):
@@ -58,27 +78,23 @@ class Command(object):
         # in case someone uses @<username> to send a direct message:
         if to.startswith('@'):
             if len(to) > 1:
-                try:
-                    user = api.get_user(to[1:])
-                except:
-                    raise
-                return 'friend_%s' % user.raw_user_dict['id']
+                return to
             else:
                 raise GuidanceNeeded
         return None
 
     def login(self, username, password):
         """
-        Tries to login to pownce.com with the given credentials and return
-        an api and a user object if successful.
+        Tries to login to pownce.com with the given credentials and
+        returns a ``Deferred`` firing with an api object if successful.
         """
-        api = accounts.Api(username, password, settings.APPLICATION_KEY)
-        try:
-            user = api.get_user(username)
-        except:
-            raise AuthenticationRequired
-        else:
-            return api
+        return accounts.login(username, password)
+
+    def logout(self, username, password):
+        """
+        Forgets that the given credentials were verified.
+        """
+        accounts.logout(username, password)
 
 
 class unknown(Command):
@@ -96,6 +112,8 @@ class help(Command):
     usage = "COMMAND [...]"
     aliases = ('wtf', 'howto')
 
+    intro = "This is a Pownce jabber bot. Available commands:\n\n%s"
+
     def __init__(self, parent, message, *commands):
         Command.__init__(self, parent, message)
 
@@ -112,9 +130,7 @@ class help(Command):
             usage_commands.reverse()
             self.send("\n".join(usage_commands))
         else:
-            self.send(
-                "This is a Pownce jabber bot. "
-                "Available commands:\n\n%s" % self.parent.help)
+            self.send(self.intro % self.parent.help)
 
 
 class register(Command):
@@ -122,22 +138,27 @@ class register(Command):
 
     usage = "USERNAME PASSWORD"
     aliases = ('signup', 'login', 'logon')
+    blocking = True
 
     def __init__(self, parent, message, *credentials):
         Command.__init__(self, parent, message)
 
         self.credentials = credentials
+        self.deferred = self.register()
 
+    @defer.inlineCallbacks
+    def register(self):
+        username = None
         try:
             if len(self.credentials) != 2:
                 raise GuidanceNeeded
 
             username, password = self.credentials[0:2]
 
-            if self.parent.session.query(accounts.User).filter_by(jid=self.jid).count():
+            if self.parent.datastore.get_user(self.jid) is not None:
                 raise UserAlreadyExists
 
-            api = self.login(username, password)
+            api = yield self.login(username, password)
 
         except AuthenticationRequired:
             self.send("Username and password do not match. Please try again.")
@@ -154,9 +175,7 @@ class register(Command):
             self.send("Something went wrong. Try again.")
 
         else:
-            user = accounts.User(username, password, self.jid)
-            self.parent.session.save(user)
-            self.parent.session.commit()
+            self.parent.datastore.register(username, password, self.jid)
             self.log("REGISTER: user %s (%s) created" % (username, self.jid))
             self.send("Your Jabber account %s and your Pownce account %s are "
                 "now registered at this Jabber bot." % (self.jid, username))
@@ -166,6 +185,7 @@ class unregister(Command):
 
     usage = "PASSWORD"
     aliases = ('logoff', 'signoff')
+    blocking = True
 
     def __init__(self, parent, message, *credentials):
         Command.__init__(self, parent, message)
@@ -176,7 +196,7 @@ class unregister(Command):
             if len(self.credentials) != 1:
                 raise GuidanceNeeded
 
-            user = self.parent.session.query(accounts.User).filter_by(jid=self.jid).first()
+            user = self.parent.datastore.get_user(self.jid)
             if not user:
                 raise UserDoesNotExist
 
@@ -185,8 +205,8 @@ class unregister(Command):
             if user.password != password:
                 raise AuthenticationRequired
 
-            self.parent.session.delete(user)
-            self.parent.session.commit()
+            self.parent.datastore.unregister(self.jid)
+            self.logout(user.username, user.password)
 
         except AuthenticationRequired:
             self.send("Supplied password is wrong.")
@@ -211,46 +231,31 @@ class message(Command):
 
     usage = "[SEND_TO] NOTE"
     aliases = ('note', 'msg')
+    blocking = True
 
     def __init__(self, parent, message, *text):
         Command.__init__(self, parent, message)
 
+        self.text = text
+
         try:
             if not text:
                 raise GuidanceNeeded
-            user = self.parent.session.query(accounts.User).filter_by(jid=self.jid).first()
+            user = self.parent.datastore.get_user(self.jid)
             if not user:
                 raise UserDoesNotExist
-            self.text = text
-            api = self.login(user.username, user.password)
-            to = self.handle_to(text[0], api)
-            if to is None:
-                to = api.send_to_default()
-            else:
+            to = self.handle_to(text[0])
+            if to is not None:
                 text = text[1:]
 
             if not text:
                 raise GuidanceNeeded
 
-            reply = api.post_message(to, " ".join(text))
+            self.parent.outbox.put(self.jid, 'message', to, " ".join(text))
 
         except UserDoesNotExist:
             self.send("Please register your Pownce account first.")
 
-        except PrivacyViolation:
-            self.send("You are not allowed to do this.")
-
-        except NotFound:
-            self.send("The recipient could not be found or the note "
-                "could not be handled. Try again.")
-
-        except AuthenticationRequired:
-            self.send("Username and password do not match (anymore). "
-                "Please re-register with this bot.")
-
-        except ServerError:
-            self.send("Pownce is having a nap. Try again later.")
-
         except GuidanceNeeded:
             self.guide()
 
@@ -260,7 +265,7 @@ class message(Command):
 
         else:
             self.log("MESSAGE: %s wrote '%s'" % (user.username, text))
-            self.send("You message has been posted.")
+            self.send("Your message has been queued.")
 
 
 class link(Command):
@@ -268,23 +273,22 @@ class link(Command):
 
     usage = "[SEND_TO] URL [NOTE]"
     aliases = ('url',)
+    blocking = True
 
     def __init__(self, parent, message, *text):
         Command.__init__(self, parent, message)
 
+        self.text = text
+
         try:
-            user = self.parent.session.query(accounts.User).filter_by(jid=self.jid).first()
+            user = self.parent.datastore.get_user(self.jid)
             if not user:
                 raise UserDoesNotExist
             if not text:
                 raise GuidanceNeeded
 
-            self.text = text
-            api = self.login(user.username, user.password)
-            to = self.handle_to(text[0], api)
-            if to is None:
-                to = api.send_to_default()
-            else:
+            to = self.handle_to(text[0])
+            if to is not None:
                 text = text[1:]
 
             if not text:
@@ -299,46 +303,165 @@ class link(Command):
                     body = body[1:]
             else:
                 body = ('',)
-            print body
-            reply = api.post_link(to, url, " ".join(body))
+            self.parent.outbox.put(self.jid, 'link', to, " ".join(body), url)
 
         except GuidanceNeeded:
             self.guide()
 
-        except PrivacyViolation:
-            self.send("You are not allowed to do this.")
+        except UserDoesNotExist:
+            self.send("Please register your Pownce account first.")
 
-        except NotFound:
-            self.send("The user or note could not be handled.")
+        except:
+            self.send("Something went wrong. Check if the URL is valid and "
+                "then try again.")
+
+        else:
+            self.log("LINK: %s queued '%s'" % (user.username, url))
+            self.send("Your link has been queued.")
+
+
+class refresh(Command):
+    "Reloads your default recipient from Pownce."
+
+    usage = ""
+    blocking = True
+
+    def __init__(self, parent, message, *args):
+        Command.__init__(self, parent, message)
+
+        self.deferred = self.refresh()
+
+    @defer.inlineCallbacks
+    def refresh(self):
+        try:
+            user = self.parent.datastore.get_user(self.jid)
+            if not user:
+                raise UserDoesNotExist
+            api = yield self.login(user.username, user.password)
+            to = yield api.send_to_default(refresh=True)
+
+        except UserDoesNotExist:
+            self.send("Please register your Pownce account first.")
 
         except AuthenticationRequired:
+            self.logout(user.username, user.password)
             self.send("Username and password do not match (anymore). "
                 "Please re-register with this bot.")
 
         except ServerError:
-            self.send("ServerError")
-
-        except UserDoesNotExist:
-            self.send("Please register your Pownce account first.")
+            self.send("Pownce is having a nap. Try again later.")
 
         except:
-            self.send("Something went wrong. Check if the URL is valid and "
-                "then try again.")
+            self.log("FAILED: refreshing the default recipient of %s" % self.jid)
+            self.send("Something went wrong. Try again.")
+
+        else:
+            self.send("Your notes are sent to %s by default." % to)
+
+
+class timeline(Command):
+    "Shows how often timelines are polled, or the given user's."
+
+    usage = "[JID]"
+    admin = True
+
+    def __init__(self, parent, message, *args):
+        Command.__init__(self, parent, message)
 
+        timeline = self.parent.timeline
+        if timeline is None:
+            return self.send("Timelines are not pushed.")
+        if not args:
+            stats = timeline.stats()
+            if stats['budget']:
+                budget = "%d per minute" % stats['budget']
+            else:
+                budget = "unlimited"
+            return self.send("Polling %d users, %d at the moment. "
+                "%d polls this minute, %d in the last one (budget: %s)." % (
+                stats['users'], stats['inflight'], stats['polls_this_minute'],
+                stats['polls_last_minute'], budget))
+
+        jid = args[0]
+        state = timeline.states.get(jid)
+        user = self.parent.datastore.get_user(jid)
+        if state is None or user is None:
+            return self.send("%s is not polled." % jid)
+        if state.active_until > time.time():
+            presence = "active"
+        elif state.available is None:
+            presence = "presence unknown"
+        elif state.available:
+            presence = "online"
         else:
-            self.log("LINK: %s posted '%s'" % (user.username, url))
-            self.send("Your link has been posted.")
+            presence = "offline"
+        if state.due is None:
+            due = "being polled now"
+        else:
+            due = "next poll in %ds" % max(0, state.due - time.time())
+        self.send("%s (%s): every %ds, %s. %d polls found %d notes, "
+            "newest note seen: %s." % (jid, presence, state.interval, due,
+            state.polls, state.notes, user.since_id))
+
+
+class stats(Command):
+    "Shows the bot's numbers, only those starting with PREFIX if given."
+
+    usage = "[PREFIX]"
+    admin = True
+
+    def __init__(self, parent, message, *args):
+        Command.__init__(self, parent, message)
+
+        prefix = ''
+        if args:
+            prefix = args[0]
+        report = registry.report(prefix).strip()
+        if not report:
+            return self.send("Nothing starts with '%s'." % prefix)
+        self.send(report)
+
+
+class profile(Command):
+    "Profiles the bot for SECONDS (by default 30) and names the hottest functions."
+
+    usage = "[SECONDS]"
+    admin = True
+
+    def __init__(self, parent, message, seconds='30', *args):
+        Command.__init__(self, parent, message)
+
+        try:
+            seconds = int(seconds)
+        except ValueError:
+            seconds = 0
+        if seconds <= 0:
+            return self.guide()
+        if self.parent.profiler.running():
+            return self.send("The profiler is running already.")
+        self.send("Profiling for %d seconds." % min(seconds, self.parent.profiler.MAX_SECONDS))
+        self.deferred = self.parent.profiler.start(seconds)
+        self.deferred.addCallbacks(self.profiled, self.failed)
+
+    def profiled(self, (path, hottest)):
+        self.send("Profile written to %s. Hottest functions: %s" % (
+            path, format_hottest(hottest)))
+
+    def failed(self, failure):
+        self.log("FAILED: profiling: %s" % failure.getErrorMessage())
+        self.send("Profiling failed: %s" % failure.getErrorMessage())
 
 
 class about(Command):
     "Sends an about message."
 
     aliases = ('author', 'contact')
+    replies = ("I'm a jabber bot. My creator is jezdez.",)
 
     def __init__(self, parent, message, *text):
         Command.__init__(self, parent, message)
 
-        return self.send("I'm a jabber bot. My creator is jezdez.")
+        return self.send(self.replies[0])
 
 
 class greeting(Command):
@@ -368,16 +491,19 @@ class greeting(Command):
         "namaste",
         "moinmoin",
     )
+    replies = tuple([alias.capitalize()+"!" for alias in aliases])
 
     def __init__(self, parent, message, *text):
         Command.__init__(self, parent, message)
-        return self.send(random.choice(greeting.aliases).capitalize()+"!")
+        return self.send(random.choice(self.replies))
 
 
 class ping(Command):
     "Sends an answer as fast as possible. a.k.a. ping."
 
+    replies = ("pong",)
+
     def __init__(self, parent, message, *args):
         Command.__init__(self, parent, message)
 
-        return self.send("pong")
+        return self.send(self.replies[0])
@@ -0,0 +1,164 @@
+import sys
+import threading
+
+from twisted.internet import defer, reactor
+from twisted.python import failure, threadpool
+
+class Dispatcher(object):
+    """
+    Runs calls in a bounded thread pool while keeping the calls for the
+    same key (usually a JID) in the order they were dispatched. Calls
+    for different keys run in parallel.
+
+    With a pool size of 0 the calls are run in the reactor thread.
+    Either way, a call returning a ``Deferred`` holds up the calls for
+    its key until the ``Deferred`` fires. ``name`` names the pool's
+    threads.
+    """
+    def __init__(self, size=4, name='powncebot-commands'):
+        self.size = size
+        self.pending = {}
+        self.pool = None
+        if size:
+            self.pool = threadpool.ThreadPool(0, size, name)
+            reactor.callWhenRunning(self.pool.start)
+            reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+
+    def dispatch(self, key, func, *args, **kwargs):
+        """
+        Runs ``func`` once every call dispatched earlier for ``key`` has
+        finished. Returns a ``Deferred`` firing with the result.
+        """
+        d = defer.Deferred()
+        call = (d, func, args, kwargs)
+        if key in self.pending:
+            self.pending[key].append(call)
+        else:
+            self.pending[key] = []
+            self._run(key, call)
+        return d
+
+    def queued(self):
+        """
+        Returns the number of calls waiting behind a running call.
+        """
+        return sum([len(calls) for calls in self.pending.values()])
+
+    def stats(self):
+        return {'keys': len(self.pending), 'queued': self.queued()}
+
+    def _run(self, key, call):
+        d, func, args, kwargs = call
+        if self.pool is None:
+            result = defer.maybeDeferred(func, *args, **kwargs)
+        else:
+            result = self._defer_to_pool(func, *args, **kwargs)
+        result.addBoth(self._finished, key, d)
+
+    def _finished(self, result, key, d):
+        calls = self.pending[key]
+        if calls:
+            self._run(key, calls.pop(0))
+        else:
+            del self.pending[key]
+        if isinstance(result, failure.Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    def _defer_to_pool(self, func, *args, **kwargs):
+        d = defer.Deferred()
+
+        def finished(result):
+            # ``func`` may return a Deferred, whose result is passed on
+            defer.maybeDeferred(lambda: result).chainDeferred(d)
+
+        def run():
+            try:
+                result = func(*args, **kwargs)
+            except:
+                reactor.callFromThread(d.errback, failure.Failure())
+            else:
+                reactor.callFromThread(finished, result)
+
+        self.pool.callInThread(run)
+        return d
+
+class SingleFlight(object):
+    """
+    Merges identical calls which are running at the same time: while a
+    call for a key is running, further calls for that key wait for it
+    and get its result, or its exception, instead of running again.
+
+    ``call`` is for blocking functions called from several threads,
+    ``defer`` for functions returning ``Deferred``s in the reactor
+    thread. ``saved`` counts the calls which were merged.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.waiting = {}
+        self.saved = 0
+
+    def call(self, key, func, *args, **kwargs):
+        """
+        Returns ``func(*args, **kwargs)``, or the result of the same
+        call running in another thread.
+        """
+        self.lock.acquire()
+        try:
+            flight = self.running.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.running[key] = {'done': threading.Event()}
+            else:
+                self.saved += 1
+        finally:
+            self.lock.release()
+
+        if not leader:
+            flight['done'].wait()
+            if 'error' in flight:
+                error_class, error, traceback = flight['error']
+                raise error_class, error, traceback
+            return flight['result']
+
+        try:
+            try:
+                flight['result'] = func(*args, **kwargs)
+            except:
+                flight['error'] = sys.exc_info()
+                raise
+        finally:
+            self.lock.acquire()
+            try:
+                del self.running[key]
+            finally:
+                self.lock.release()
+            flight['done'].set()
+        return flight['result']
+
+    def defer(self, key, func, *args, **kwargs):
+        """
+        Returns a ``Deferred`` firing with the result of ``func(*args,
+        **kwargs)``, or with that of the same call already running.
+        """
+        if key in self.waiting:
+            self.saved += 1
+            d = defer.Deferred()
+            self.waiting[key].append(d)
+            return d
+        self.waiting[key] = []
+
+        def finished(result):
+            for d in self.waiting.pop(key):
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+            return result
+
+        return defer.maybeDeferred(func, *args, **kwargs).addBoth(finished)
+
+    def stats(self):
+        return {'saved': self.saved, 'running': len(self.running) + len(self.waiting)}
@@ -0,0 +1,175 @@
+import time
+from collections import deque
+
+from zope.interface import implements
+
+from twisted.internet import interfaces, reactor
+
+class OutboundQueue(object):
+    """
+    Queues the stanzas sent to the XML stream.
+
+    Stanzas are written as soon as they are queued, but only while the
+    transport wants more data (the queue registers itself as a
+    producer). Once the transport has asked to pause, or while more
+    than ``high`` stanzas are waiting, they are written in batches of
+    ``batch`` every ``interval`` seconds until the queue is empty. Once
+    ``high`` stanzas are waiting, reading from the stream is paused
+    until the queue is down to ``low`` again.
+
+    While there is no connection stanzas are kept for ``max_age``
+    seconds, identical ones are coalesced and at most ``max_size`` are
+    kept, dropping the oldest ones first.
+    """
+    implements(interfaces.IPushProducer)
+
+    def __init__(self, high=500, low=100, batch=20, interval=0.05,
+                 max_size=5000, max_age=300, clock=time.time):
+        self.high = high
+        self.low = low
+        self.batch = batch
+        self.interval = interval
+        self.max_size = max_size
+        self.max_age = max_age
+        self.clock = clock
+        self.queue = deque()
+        # the number of queued stanzas by key
+        self.keys = {}
+        self.xmlstream = None
+        self.paused = False
+        # whether the queue is drained in batches
+        self.batched = False
+        self.intake_paused = False
+        self.call = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # average and maximum seconds between queueing and sending
+        self.drain_time = 0.0
+        self.max_drain_time = 0.0
+
+    def attach(self, xmlstream):
+        """
+        Starts sending the queued stanzas to ``xmlstream``.
+        """
+        self.xmlstream = xmlstream
+        self.paused = False
+        self.intake_paused = False
+        xmlstream.transport.registerProducer(self, True)
+        self.expire()
+        self.drain()
+
+    def detach(self):
+        """
+        Stops sending, the stanzas are kept until the next ``attach``.
+        """
+        self.xmlstream = None
+        self.intake_paused = False
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def send(self, element, key=None):
+        """
+        Queues ``element`` for sending. While disconnected, a stanza
+        with the same ``key`` as one already waiting is dropped.
+        """
+        if self.xmlstream is None:
+            self.expire()
+            if key is not None and key in self.keys:
+                self.coalesced += 1
+                return
+        if len(self.queue) >= self.max_size:
+            self.pop()
+            self.dropped += 1
+        self.queue.append((self.clock(), key, element))
+        if key is not None:
+            self.keys[key] = self.keys.get(key, 0) + 1
+        if (len(self.queue) >= self.high and not self.intake_paused
+                and self.xmlstream is not None):
+            self.pause_intake()
+        if self.call is None:
+            self.drain()
+
+    def drain(self):
+        """
+        Sends the queued stanzas, or the next batch of them and
+        schedules the one after.
+        """
+        self.call = None
+        if self.xmlstream is None or self.paused:
+            return
+        if len(self.queue) > self.high:
+            self.batched = True
+        now = self.clock()
+        count = len(self.queue)
+        if self.batched:
+            count = min(self.batch, count)
+        for i in xrange(count):
+            queued, key, element = self.pop()
+            self.xmlstream.send(element)
+            self.sent += 1
+            waited = now - queued
+            self.drain_time += (waited - self.drain_time) * 0.1
+            self.max_drain_time = max(self.max_drain_time, waited)
+            if self.paused:
+                # the transport's buffer filled up while writing
+                break
+        if self.intake_paused and len(self.queue) <= self.low:
+            self.resume_intake()
+        if not self.queue:
+            self.batched = False
+        elif not self.paused:
+            self.call = reactor.callLater(self.interval, self.drain)
+
+    def pop(self):
+        """
+        Removes and returns the oldest queued ``(time, key, stanza)``.
+        """
+        entry = self.queue.popleft()
+        key = entry[1]
+        if key is not None:
+            if self.keys[key] == 1:
+                del self.keys[key]
+            else:
+                self.keys[key] -= 1
+        return entry
+
+    def expire(self):
+        """
+        Drops the stanzas which have been waiting for too long.
+        """
+        deadline = self.clock() - self.max_age
+        while self.queue and self.queue[0][0] < deadline:
+            self.pop()
+            self.dropped += 1
+
+    def pause_intake(self):
+        self.intake_paused = True
+        self.xmlstream.transport.pauseProducing()
+
+    def resume_intake(self):
+        self.intake_paused = False
+        self.xmlstream.transport.resumeProducing()
+
+    def stats(self):
+        return {'depth': len(self.queue), 'sent': self.sent,
+                'dropped': self.dropped, 'coalesced': self.coalesced,
+                'drain_time': self.drain_time,
+                'max_drain_time': self.max_drain_time,
+                'paused': self.paused, 'intake_paused': self.intake_paused}
+
+    # IPushProducer, called by the transport when its buffer is full
+    # or has been written
+
+    def pauseProducing(self):
+        self.paused = True
+        self.batched = True
+
+    def resumeProducing(self):
+        self.paused = False
+        if self.call is None:
+            self.drain()
+
+    def stopProducing(self):
+        self.detach()
@@ -0,0 +1,135 @@
+import time
+import random
+
+from twisted.internet import defer, reactor, task
+from twisted.python import log
+
+from powncebot import accounts
+from pownce import PrivacyViolation, NotFound, AuthenticationRequired
+
+# Failures which won't go away by trying again, and what to tell the user
+PERMANENT_FAILURES = (
+    (AuthenticationRequired, "Username and password do not match (anymore). "
+        "Please re-register with this bot."),
+    (PrivacyViolation, "You are not allowed to do this."),
+    (NotFound, "The recipient could not be found."),
+    (ValueError, "The recipient or note could not be handled."),
+)
+
+class Outbox(object):
+    """
+    Posts the notes queued in the ``Datastore``'s outbox.
+
+    Due entries are picked up every ``interval`` seconds, or right
+    after a note has been queued, and posted through the bot's
+    background dispatcher so the notes of one JID are posted in
+    order. Failed attempts are retried with exponential back-off
+    (starting at ``delay`` seconds, at most ``max_delay``) and jitter;
+    after ``max_attempts`` attempts, or a permanent failure, the note
+    is given up on. The user is told about the outcome in either case.
+    """
+    # entries picked up at once
+    BATCH = 50
+
+    def __init__(self, bot, interval=5, max_attempts=8, delay=5, max_delay=900):
+        self.bot = bot
+        self.datastore = bot.datastore
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.inflight = set()
+        self.loop = task.LoopingCall(self.deliver_due)
+        self.posted = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        self.loop.start(self.interval)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def put(self, jid, note_type, note_to, body, url=None):
+        """
+        Queues a note to be posted for ``jid``; see ``accounts.note_to``
+        for the possible values of ``note_to``.
+        """
+        entry = self.datastore.queue_note(jid, note_type, note_to, body, url)
+        reactor.callFromThread(self.deliver_due)
+        return entry
+
+    def deliver_due(self):
+        """
+        Starts posting the entries which are due and not being posted
+        already, of the JIDs the bot is responsible for.
+        """
+        batch = self.BATCH
+        if self.bot.shard is not None:
+            # the entries of the other workers are in the way
+            batch *= max(1, self.bot.shard.size())
+        for entry in self.datastore.due_notes(time.time(), batch):
+            if entry.id in self.inflight or not self.bot.owns(entry.jid):
+                continue
+            self.inflight.add(entry.id)
+            d = self.bot.background.dispatch(entry.jid, self.deliver, entry)
+            d.addCallbacks(self.posted_note, self.failed_note,
+                           callbackArgs=(entry,), errbackArgs=(entry,))
+            d.addErrback(log.err)
+            d.addBoth(self.done, entry)
+
+    @defer.inlineCallbacks
+    def deliver(self, entry):
+        user = self.datastore.get_user(entry.jid)
+        if user is None:
+            # unregistered in the meantime
+            defer.returnValue(None)
+        try:
+            api = yield accounts.login(user.username, user.password)
+            note_to = yield accounts.note_to(entry.note_to, api)
+            if entry.note_type == 'link':
+                note = yield api.post_link(note_to, entry.url, entry.body)
+            else:
+                note = yield api.post_message(note_to, entry.body)
+        except AuthenticationRequired:
+            accounts.logout(user.username, user.password)
+            raise
+        defer.returnValue(note)
+
+    def posted_note(self, note, entry):
+        self.datastore.remove_note(entry.id)
+        if note is None:
+            return
+        self.posted += 1
+        log.msg("OUTBOX: posted %s %s for %s" % (entry.note_type, entry.id, entry.jid))
+        self.bot.reply(entry.jid, "Your %s has been posted." % entry.note_type)
+
+    def failed_note(self, failure, entry):
+        for (error_class, reason) in PERMANENT_FAILURES:
+            if failure.check(error_class):
+                return self.give_up(entry, reason)
+        if entry.attempts + 1 >= self.max_attempts:
+            return self.give_up(entry, "Pownce is having a nap. Try again later.")
+        log.msg("OUTBOX: attempt %d for %s %s failed: %s" % (
+            entry.attempts + 1, entry.note_type, entry.id,
+            failure.getErrorMessage()))
+        self.retried += 1
+        delay = min(self.max_delay, self.delay * 2 ** entry.attempts)
+        delay = random.uniform(delay / 2.0, delay)
+        self.datastore.retry_note(entry.id, time.time() + delay)
+
+    def give_up(self, entry, reason):
+        self.failed += 1
+        self.datastore.remove_note(entry.id)
+        log.msg("OUTBOX: giving up on %s %s for %s: %s" % (
+            entry.note_type, entry.id, entry.jid, reason))
+        self.bot.reply(entry.jid, "Your %s '%s' could not be posted. %s" % (
+            entry.note_type, entry.url or entry.body, reason))
+
+    def done(self, result, entry):
+        self.inflight.discard(entry.id)
+
+    def stats(self):
+        return {'inflight': len(self.inflight), 'posted': self.posted,
+                'retried': self.retried, 'failed': self.failed}
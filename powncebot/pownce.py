@@ -40,17 +40,19 @@ detected and used.
 
 import datetime
 import time
+import re
+import sys
 import urllib
-import urllib2
-import gzip
+import urlparse
+import httplib
+import socket
+import threading
+import zlib
 import base64
+import hashlib
 import mimetools, mimetypes
 import os, stat
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
 try:
     import simplejson
 except ImportError:
@@ -89,6 +91,81 @@ class ServerError(Exception):
     """
     pass
 
+
+class _lazy(object):
+    """
+    Descriptor for a model attribute which is computed by ``func`` on
+    first access and then kept in a slot of the instance, named after
+    the attribute with a leading underscore (see ``_ModelType``).
+
+    """
+    slot = None
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.compute(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+    def compute(self, obj):
+        return self.func(obj)
+
+
+class _field(_lazy):
+    """
+    A lazy attribute read from the key of the same name in the raw
+    dictionary and passed through ``convert``. Missing keys give
+    ``None``, unless the field is ``required``.
+
+    """
+    name = None
+
+    def __init__(self, convert=None, required=False):
+        self.convert = convert
+        self.required = required
+
+    def compute(self, obj):
+        if self.required:
+            value = obj._data[self.name]
+        else:
+            value = obj._data.get(self.name)
+            if value is None:
+                return None
+        if self.convert is not None:
+            value = self.convert(value)
+        return value
+
+
+class _ModelType(type):
+    """
+    Metaclass of the model classes, which gives every lazy attribute
+    its slot. Instances keep the raw dictionary in ``_data`` and have
+    no ``__dict__``.
+
+    """
+    def __new__(meta, name, bases, attrs):
+        slots = list(attrs.get('__slots__', ()))
+        for key, value in attrs.items():
+            if isinstance(value, _lazy):
+                value.slot = '_' + key
+                if isinstance(value, _field):
+                    value.name = key
+                slots.append(value.slot)
+        attrs['__slots__'] = tuple(slots)
+        return type.__new__(meta, name, bases, attrs)
+
+
 class User(object):
     """
     A Pownce user.
@@ -142,21 +219,23 @@ class User(object):
         The user's username, as a string.
     
     """
-    _string_keys = ['blurb',
-                    'country',
-                    'first_name',
-                    'gender',
-                    'location',
-                    'permalink',
-                    'short_name',
-                    'username',
-                    ]
-    
-    _int_keys = ['fan_count',
-                 'fan_of_count',
-                 'friend_count',
-                 'max_upload_mb']
-    
+    __metaclass__ = _ModelType
+    __slots__ = ('_data',)
+
+    blurb = _field()
+    country = _field()
+    first_name = _field()
+    gender = _field()
+    location = _field()
+    permalink = _field()
+    short_name = _field()
+    username = _field()
+
+    fan_count = _field(long)
+    fan_of_count = _field(long)
+    friend_count = _field(long)
+    max_upload_mb = _field(long)
+
     MALE_GENDER_OPTIONS = ['Bloke',
                            'Gentleman',
                            'Guy',
@@ -170,20 +249,25 @@ class User(object):
                              'Lady']
     
     def __init__(self, raw_user_dict):
-        self.raw_user_dict = raw_user_dict
-        for k in self._string_keys:
-            setattr(self, k, raw_user_dict.get(k, None))
-        for k in self._int_keys:
-            try:
-                setattr(self, k, long(raw_user_dict[k]))
-            except KeyError:
-                setattr(self, k, None)
-        if raw_user_dict.get('age'):
-            self.age = int(raw_user_dict['age'])
-        else:
-            self.age = None
-        self.is_pro = bool(raw_user_dict['is_pro'])
-        self.profile_photo_urls = raw_user_dict.get('profile_photo_urls', {})
+        self._data = raw_user_dict
+
+    def raw_user_dict(self):
+        return self._data
+    raw_user_dict = property(raw_user_dict)
+
+    def age(self):
+        if self._data.get('age'):
+            return int(self._data['age'])
+        return None
+    age = _lazy(age)
+
+    def is_pro(self):
+        return bool(self._data['is_pro'])
+    is_pro = _lazy(is_pro)
+
+    def profile_photo_urls(self):
+        return self._data.get('profile_photo_urls', {})
+    profile_photo_urls = _lazy(profile_photo_urls)
 
     def __repr__(self):
         return '<pownce.User: %s>' % self
@@ -308,47 +392,64 @@ class Note(object):
     ``MESSAGE_TYPE``
         The string representing the message type.
     
+    Attributes are parsed from the raw note dictionary when they are
+    first accessed, so the users and replies of a note are only built
+    if they are looked at.
+    
     """
     EVENT_TYPE = 'event'
     LINK_TYPE = 'link'
     MESSAGE_TYPE = 'message'
-    _float_keys = ['stars']
-    _int_keys = ['id',
-                 'num_recipients',
-                 'num_replies',
-                 'seconds_since',
-                 'timestamp']
-    _string_keys = ['body',
-                    'display_since',
-                    'permalink',
-                    'type']
+    __metaclass__ = _ModelType
+    __slots__ = ('_data',)
+
+    id = _field(long)
+    num_recipients = _field(long)
+    num_replies = _field(long)
+    seconds_since = _field(long)
+    timestamp = _field(long)
+
+    stars = _field(float)
+
+    body = _field(required=True)
+    display_since = _field(required=True)
+    permalink = _field(required=True)
+    type = _field(required=True)
 
     def __init__(self, raw_note_dict):
-        self.raw_note_dict = raw_note_dict
-        for k in self._int_keys:
-            try:
-                setattr(self, k, float(raw_note_dict[k]))
-            except KeyError:
-                setattr(self, k, None)
-        for k in self._int_keys:
-            try:
-                setattr(self, k, long(raw_note_dict[k]))
-            except KeyError:
-                setattr(self, k, None)
-        for k in self._string_keys:
-            setattr(self, k, raw_note_dict[k])
-        self.is_public = bool(raw_note_dict['is_public'])
-        self.seconds_since_delta = datetime.timedelta(seconds=self.seconds_since)
-        self.sender = User(self.raw_note_dict['sender'])
-        self.timestamp_parsed = datetime.datetime.fromtimestamp(self.timestamp)
-        if 'recipients' in self.raw_note_dict.keys():
-            self.recipients = [User(user_dict) for user_dict in self.raw_note_dict['recipients']]
-        else:
-            self.recipients = None
-        if 'replies' in self.raw_note_dict.keys():
-            self.replies = [Reply(message_dict, self) for message_dict in self.raw_note_dict['replies']]
-        else:
-            self.replies = None
+        self._data = raw_note_dict
+
+    def raw_note_dict(self):
+        return self._data
+    raw_note_dict = property(raw_note_dict)
+
+    def is_public(self):
+        return bool(self._data['is_public'])
+    is_public = _lazy(is_public)
+
+    def seconds_since_delta(self):
+        return datetime.timedelta(seconds=self.seconds_since)
+    seconds_since_delta = _lazy(seconds_since_delta)
+
+    def sender(self):
+        return User(self._data['sender'])
+    sender = _lazy(sender)
+
+    def timestamp_parsed(self):
+        return datetime.datetime.fromtimestamp(self.timestamp)
+    timestamp_parsed = _lazy(timestamp_parsed)
+
+    def recipients(self):
+        if 'recipients' in self._data:
+            return [User(user_dict) for user_dict in self._data['recipients']]
+        return None
+    recipients = _lazy(recipients)
+
+    def replies(self):
+        if 'replies' in self._data:
+            return [Reply(message_dict, self) for message_dict in self._data['replies']]
+        return None
+    replies = _lazy(replies)
     
     def __repr__(self):
         return '<pownce.%s: %s>' % (self.type.capitalize(), self)
@@ -378,23 +479,13 @@ class Reply(Note):
         The ``Note`` to which this reply is attached.
     
     """
-    _int_keys = ['id',
-                 'seconds_since',
-                 'timestamp']
-    _string_keys = ['body',
-                    'display_since']
-    
+    __slots__ = ('parent',)
+
+    type = 'reply'
+
     def __init__(self, raw_note_dict, parent):
-        self.raw_note_dict = raw_note_dict
+        self._data = raw_note_dict
         self.parent = parent
-        for k in self._int_keys:
-            setattr(self, k, long(raw_note_dict[k]))
-        for k in self._string_keys:
-            setattr(self, k, raw_note_dict[k])
-        self.seconds_since_delta = datetime.timedelta(seconds=self.seconds_since)
-        self.sender = User(self.raw_note_dict['sender'])
-        self.timestamp_parsed = datetime.datetime.fromtimestamp(self.timestamp)
-        self.type = 'reply'
 
     def __str__(self):
         return '"%s" sent by %s in response to %s' % (self.body, self.sender, self.parent)
@@ -426,13 +517,9 @@ class Link(Note):
     "link".
     
     """
-    _string_keys = ['body',
-                   'display_since',
-                   'permalink',
-                   'type']
-    def __init__(self, raw_note_dict):
-        super(Link, self).__init__(raw_note_dict)
-        self.link = self.raw_note_dict['link']['url']
+    def link(self):
+        return self._data['link']['url']
+    link = _lazy(link)
 
 
 class EventDetails(object):
@@ -535,9 +622,9 @@ class Event(Note):
     "event".
     
     """
-    def __init__(self, raw_note_dict):
-        super(Event, self).__init__(raw_note_dict)
-        self.event = EventDetails(self.raw_note_dict['event'], self)
+    def event(self):
+        return EventDetails(self._data['event'], self)
+    event = _lazy(event)
 
 
 class FileDetails(object):
@@ -594,9 +681,476 @@ class File(Note):
     ``file_details``
         The file details, as a ``FileDetails`` object (see above).
     """
-    def __init__(self, raw_note_dict):
-        super(File, self).__init__(raw_note_dict)
-        self.file_details = FileDetails(self.raw_note_dict['file'], self)
+    def file_details(self):
+        return FileDetails(self._data['file'], self)
+    file_details = _lazy(file_details)
+
+class MultipartBody(object):
+    """
+    A multipart/form-data request body which streams files instead of
+    reading them into memory.
+
+    Takes a list of ``(name, value)`` pairs, where ``value`` is either
+    a string or a ``(file, filename)`` tuple for file fields.
+
+    ``parts`` is the list of strings and open files making up the
+    body, ``length`` its total size and ``content_type`` the matching
+    Content-Type header. Iterating over the body yields it in chunks
+    of at most ``CHUNK_SIZE`` bytes. ``close`` closes the files, which
+    is up to whoever sends the body.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fields, boundary=None):
+        if boundary is None:
+            boundary = mimetools.choose_boundary()
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+        self.parts = []
+        self.length = 0
+        for (key, value) in fields:
+            if isinstance(value, tuple):
+                (f, filename) = value
+                mime = mimetypes.guess_type(filename)[0]
+                if mime is None:
+                    mime = 'application/octet-stream'
+                self._add('--%s\r\nContent-Disposition: form-data; '
+                          'name="%s"; filename="%s"\r\n'
+                          'Content-Type: %s\r\n\r\n' % (boundary, key, filename, mime))
+                self.parts.append(f)
+                self.length += os.fstat(f.fileno())[stat.ST_SIZE] - f.tell()
+                self._add('\r\n')
+            else:
+                self._add('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (boundary, key, value))
+        self._add('--%s--\r\n\r\n' % boundary)
+
+    def _add(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.parts.append(data)
+        self.length += len(data)
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, str):
+                yield part
+                continue
+            while True:
+                chunk = part.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def close(self):
+        for part in self.parts:
+            if not isinstance(part, str):
+                part.close()
+
+
+class NoteListParser(object):
+    """
+    Incrementally decodes a JSON note list document, as returned by the
+    ``note_lists`` API, into its notes.
+
+    ``feed`` takes the next chunk of the document and returns the note
+    dictionaries completed by it. The document is only scanned for the
+    structure around the notes; every note (and every other value) is
+    decoded by ``simplejson`` in one call once it is complete, so this
+    costs about as much as decoding the whole document at once. Once
+    the whole document has been fed, ``close`` returns the rest of it
+    (with an empty ``notes`` list), to check for errors.
+    """
+    _whitespace = re.compile(r'[ \t\n\r]*')
+    _decoder = simplejson.JSONDecoder()
+
+    def __init__(self):
+        self.data = ''
+        self.pos = 0
+        # what comes next: 'start', 'key', 'colon', 'value', 'note',
+        # 'after_note', 'after_value', 'end', or 'invalid' for a
+        # document which isn't a JSON object
+        self.state = 'start'
+        self.key = None
+        self.value = None
+        self.head = {}
+
+    def feed(self, data, final=False):
+        self.data = self.data[self.pos:] + data
+        self.pos = 0
+        notes = []
+        while self._step(notes, final):
+            pass
+        return notes
+
+    def close(self):
+        """
+        Returns the decoded document apart from the notes; raises
+        ``ValueError`` if it isn't a valid JSON document.
+        """
+        self.feed('', final=True)
+        if self.state != 'end':
+            raise ValueError("Invalid note list document")
+        return self.head
+
+    def _step(self, notes, final):
+        """
+        Takes the next token or value from the data, returning ``False``
+        if more data is needed.
+        """
+        self.pos = self._whitespace.match(self.data, self.pos).end()
+        if self.pos == len(self.data) or self.state == 'invalid':
+            return False
+        char = self.data[self.pos]
+        state = self.state
+        if state == 'note':
+            if char == ']':
+                return self._token('after_value')
+            if not self._decode(final):
+                return False
+            notes.append(self.value)
+            self.state = 'after_note'
+        elif state == 'after_note':
+            if char == ',':
+                return self._token('note')
+            if char == ']':
+                return self._token('after_value')
+            self.state = 'invalid'
+        elif state == 'start':
+            if char == '{':
+                return self._token('key')
+            self.state = 'invalid'
+        elif state == 'key':
+            if char == '}' and not self.head:
+                return self._token('end')
+            if char != '"':
+                self.state = 'invalid'
+            elif not self._decode(final):
+                return False
+            else:
+                self.key = self.value
+                self.state = 'colon'
+        elif state == 'colon':
+            if char == ':':
+                return self._token('value')
+            self.state = 'invalid'
+        elif state == 'value':
+            if self.key == 'notes' and char == '[':
+                self.head['notes'] = []
+                return self._token('note')
+            if not self._decode(final):
+                return False
+            self.head[self.key] = self.value
+            self.state = 'after_value'
+        elif state == 'after_value':
+            if char == ',':
+                return self._token('key')
+            if char == '}':
+                return self._token('end')
+            self.state = 'invalid'
+        else:
+            # anything after the end of the document
+            self.state = 'invalid'
+        return True
+
+    def _token(self, state):
+        self.pos += 1
+        self.state = state
+        return True
+
+    def _decode(self, final):
+        """
+        Decodes the value at the current position into ``value``,
+        returning ``False`` if it isn't complete yet.
+        """
+        try:
+            self.value, end = self._decoder.raw_decode(self.data, idx=self.pos)
+        except ValueError:
+            # incomplete, or invalid; which one is told by close
+            return False
+        if end == len(self.data) and not final:
+            # a number might go on in the next chunk
+            return False
+        self.pos = end
+        return True
+
+
+class Paginator(object):
+    """
+    Iterates over the items of a paged API listing, one page after the
+    other.
+
+    ``fetch`` is called with the (zero-indexed) page number and returns
+    the items on that page, ``limit`` items at most. While a full page
+    is being consumed, the next one is already fetched in a background
+    thread. The listing ends after the first page with fewer than
+    ``limit`` items, or when Pownce answers ``NotFound`` because there
+    are no more pages.
+
+    If ``stream`` is given, it is called like ``fetch`` but returns an
+    iterator over the items of the page. Iterating over the paginator
+    then yields the items of a page which hasn't been fetched ahead as
+    they arrive, and the next page is fetched as soon as ``limit`` items
+    have.
+
+    Besides iterating over the items, ``next_page`` returns them a page
+    at a time, or ``None`` at the end of the listing.
+
+    ``since_id`` is the highest note id seen so far (starting with the
+    one the listing was asked for); saving it and passing it to a later
+    listing resumes from where this one left off.
+    """
+    def __init__(self, fetch, limit, since_id=None, stream=None):
+        self.fetch = fetch
+        self.limit = limit
+        self.since_id = since_id
+        self.stream = stream
+        self.page = 0
+        self.pending = None
+        self.done = False
+
+    def __iter__(self):
+        while not self.done:
+            if self.stream is not None and self.pending is None:
+                items = self._streamed()
+            else:
+                items = self._next()
+                if items is None:
+                    return
+            for item in items:
+                self._seen([item])
+                yield item
+
+    def _streamed(self):
+        """
+        Yields the items of the next page from ``stream``.
+        """
+        page = self.page
+        count = 0
+        try:
+            for item in self.stream(page):
+                count += 1
+                if count == self.limit:
+                    self.pending = self._start(page + 1)
+                yield item
+        except NotFound:
+            self.done = True
+            return
+        self.page = page + 1
+        if count < self.limit:
+            self.done = True
+
+    def next_page(self):
+        return self._seen(self._next())
+
+    def _next(self):
+        if self.done:
+            return None
+        if self.pending is None:
+            self.pending = self._start(self.page)
+        pending, self.pending = self.pending, None
+        return self._received(self._finish(pending))
+
+    def _received(self, items):
+        if items is None:
+            self.done = True
+            return None
+        self.page += 1
+        if len(items) < self.limit:
+            self.done = True
+        else:
+            self.pending = self._start(self.page)
+        return items
+
+    def _seen(self, items):
+        for item in items or ():
+            item_id = getattr(item, 'id', None)
+            if item_id is not None and (self.since_id is None or
+                                        item_id > self.since_id):
+                self.since_id = item_id
+        return items
+
+    def _start(self, page):
+        pending = {}
+        def run():
+            try:
+                pending['items'] = self.fetch(page)
+            except NotFound:
+                pending['items'] = None
+            except Exception:
+                pending['error'] = sys.exc_info()
+        pending['thread'] = thread = threading.Thread(target=run)
+        thread.setDaemon(True)
+        thread.start()
+        return pending
+
+    def _finish(self, pending):
+        pending['thread'].join()
+        if 'error' in pending:
+            error_class, error, traceback = pending['error']
+            raise error_class, error, traceback
+        return pending['items']
+
+
+class ConnectionPool(object):
+    """
+    A pool of persistent HTTP/1.1 connections, keyed by host and shared
+    by all ``Api`` instances.
+
+    Takes two optional arguments:
+
+    ``max_size``
+        The maximum number of idle connections kept per host.
+        Defaults to 4.
+
+    ``idle_timeout``
+        The number of seconds after which an idle connection is
+        discarded instead of being reused. Defaults to 30.
+
+    ``timeout``
+        The number of seconds to wait for the server when connecting
+        or reading, after which ``socket.timeout`` is raised. Defaults
+        to ``None``, waiting forever.
+
+    The ``created`` and ``reused`` attributes count how many
+    connections were opened and how often an idle one was reused.
+    """
+    def __init__(self, max_size=4, idle_timeout=30, timeout=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    # bytes read from a response at once
+    CHUNK_SIZE = 64 * 1024
+
+    def request(self, host, method, path, body=None, headers={}):
+        """
+        Performs a request on a pooled connection to ``host`` and
+        returns a tuple of the response status, a dictionary of the
+        (lower-cased) response headers and the response body.
+
+        A GET request failing on a reused connection, which the
+        server may have closed in the meantime, is retried once on a
+        new connection.
+        """
+        status, headers, chunks = self.stream(host, method, path, body, headers)
+        return status, headers, ''.join(chunks)
+
+    def stream(self, host, method, path, body=None, headers={}):
+        """
+        Like ``request``, but returns an iterator over the chunks of
+        the response body as they arrive instead of the body. The
+        connection goes back to the pool once the body has been read.
+        """
+        conn, reused = self.get(host)
+        try:
+            response = self._send(conn, method, path, body, headers)
+        except (httplib.HTTPException, socket.error):
+            if not reused or method != 'GET':
+                raise
+            conn, reused = self.get(host, fresh=True)
+            response = self._send(conn, method, path, body, headers)
+        return (response.status, dict(response.getheaders()),
+                self._read(host, conn, response))
+
+    def _send(self, conn, method, path, body, headers):
+        try:
+            if body is None or isinstance(body, str):
+                conn.request(method, path, body, headers)
+            else:
+                # a streamed body like MultipartBody
+                conn.putrequest(method, path, skip_accept_encoding=1)
+                for (key, value) in headers.items():
+                    conn.putheader(key, value)
+                conn.putheader('Content-Length', str(body.length))
+                conn.endheaders()
+                for chunk in body:
+                    conn.send(chunk)
+            return conn.getresponse()
+        except:
+            conn.close()
+            raise
+
+    def _read(self, host, conn, response):
+        try:
+            while True:
+                chunk = response.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        except:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self.put(host, conn)
+
+    def get(self, host, fresh=False):
+        """
+        Returns a tuple of a connection to ``host`` and whether it is
+        a reused one. With ``fresh`` a new connection is always made.
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            conns = self.idle.get(host, [])
+            while conns and not fresh:
+                conn, last_used = conns.pop()
+                if now - last_used < self.idle_timeout:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+            self.created += 1
+        finally:
+            self.lock.release()
+        if self.timeout is None:
+            return httplib.HTTPConnection(host), False
+        return httplib.HTTPConnection(host, timeout=self.timeout), False
+
+    def put(self, host, conn):
+        """
+        Returns an idle connection to the pool.
+        """
+        self.lock.acquire()
+        try:
+            conns = self.idle.setdefault(host, [])
+            if len(conns) < self.max_size:
+                conns.append((conn, time.time()))
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        self.lock.acquire()
+        try:
+            idle, self.idle = self.idle, {}
+        finally:
+            self.lock.release()
+        for conns in idle.values():
+            for conn, last_used in conns:
+                conn.close()
+
+
+def gunzip(chunks):
+    """
+    Decompresses an iterator over the chunks of a gzip stream.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
 
 class Api(object):
     """
@@ -618,6 +1172,18 @@ class Api(object):
     .. _`Pownce API Page`: http://pownce.com/api/apps/
     """
     API_URL = 'http://api.pownce.com/2.0/'
+    USER_AGENT = 'python-pownce-api'
+    # items per page fetched by the iter_* methods
+    PAGE_LIMIT = 100
+    paginator_class = Paginator
+
+    # Optional store for conditional GETs, mapping a hash of the
+    # credentials and the URL of a request to the validators and decoded body of the last
+    # response. Anything with ``get(key)`` and ``set(key, value,
+    # weight=size)`` will do; see ``_fetch_json``.
+    validator_cache = None
+
+    connection_pool = ConnectionPool()
 
     OBJECT_TYPE_MAPPING = { 'event': Event,
                             'link': Link,
@@ -715,7 +1281,9 @@ class Api(object):
         
         """
         self._note_validation(limit, note_type)
-        
+        return self._fetch_notes(self._public_notes_url(limit, page, note_type, since_id))
+
+    def _public_notes_url(self, limit, page, note_type, since_id):
         query_dict = {'app_key' : self.app_key}
         if limit is not None:
             query_dict['limit'] = limit
@@ -726,17 +1294,23 @@ class Api(object):
         if since_id is not None:
             query_dict['since_id'] = since_id
         
-        url = '%snote_lists.json?%s' % (self.API_URL, urllib.urlencode(query_dict))
-        
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'notes' in json_obj.keys():
-            object_list = []
-            for pownce_obj in json_obj['notes']:
-                obj_type = self.OBJECT_TYPE_MAPPING[pownce_obj['type']]
-                object_list.append(obj_type(pownce_obj))
-            return object_list
-        else:
-            raise NotFound("Error retrieving notes: %s" % json_obj['error']['message'])
+        return '%snote_lists.json?%s' % (self.API_URL, urllib.urlencode(query_dict))
+
+    def iter_public_notes(self, note_type=None, since_id=None, limit=None):
+        """
+        Iterates over all public notes, as ``Note`` objects, fetching
+        ``limit`` (by default 100) notes at a time. Returns a
+        ``Paginator``; see ``get_public_notes`` for the arguments.
+        """
+        limit = limit or self.PAGE_LIMIT
+        self._note_validation(limit, note_type)
+        def fetch(page):
+            return self.get_public_notes(limit=limit, page=page,
+                                         note_type=note_type, since_id=since_id)
+        def stream(page):
+            return self._stream_notes(self._public_notes_url(limit, page, note_type,
+                                                             since_id))
+        return self.paginator_class(fetch, limit, since_id, stream)
     
     def get_notes(self, username, note_type=None, limit=None, page=None, since_id=None,
                   note_filter=None, note_set=None):
@@ -790,13 +1364,19 @@ class Api(object):
         page, ``NotFound`` will be raised.
         """
         self._note_validation(limit, note_type)
+        self._filter_validation(username, note_filter, note_set)
+        return self._fetch_notes(self._notes_url(username, note_type, limit, page, since_id,
+                                                 note_filter, note_set))
+
+    def _filter_validation(self, username, note_filter, note_set):
         filter_types = ('notes', 'replies','sent', 'public', 'private', 'nonpublic', 'all')
         if note_filter is not None and note_filter not in filter_types:
             raise ValueError("'%s' is not a valid filter type. Valid note types are: %s." 
-                % (note_type, ', '.join(filter_types)))
+                % (note_filter, ', '.join(filter_types)))
         if note_set and not (self.username == username):
             raise ValueError("Set filtering is only available on the authenticated user's own notes.")
-        
+
+    def _notes_url(self, username, note_type, limit, page, since_id, note_filter, note_set):
         query_dict = {'app_key' : self.app_key}
         if note_type is not None:
             query_dict['type'] = note_type
@@ -811,19 +1391,28 @@ class Api(object):
         if note_set is not None:
             query_dict['set'] = note_set
         
-        url = '%snote_lists/%s.json?%s' % (self.API_URL, 
-                                           username, 
-                                           urllib.urlencode(query_dict))
-        
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'notes' in json_obj.keys():
-            object_list = []
-            for pownce_obj in json_obj['notes']:
-                obj_type = self.OBJECT_TYPE_MAPPING[pownce_obj['type']]
-                object_list.append(obj_type(pownce_obj))
-            return object_list
-        else:
-            raise NotFound("Error retrieving notes: %s" % json_obj['error']['message'])
+        return '%snote_lists/%s.json?%s' % (self.API_URL, 
+                                            username, 
+                                            urllib.urlencode(query_dict))
+
+    def iter_notes(self, username, note_type=None, since_id=None, note_filter=None,
+                   note_set=None, limit=None):
+        """
+        Iterates over all notes for the given username, as ``Note``
+        objects, fetching ``limit`` (by default 100) notes at a time.
+        Returns a ``Paginator``; see ``get_notes`` for the arguments.
+        """
+        limit = limit or self.PAGE_LIMIT
+        self._note_validation(limit, note_type)
+        self._filter_validation(username, note_filter, note_set)
+        def fetch(page):
+            return self.get_notes(username, note_type=note_type, limit=limit,
+                                  page=page, since_id=since_id,
+                                  note_filter=note_filter, note_set=note_set)
+        def stream(page):
+            return self._stream_notes(self._notes_url(username, note_type, limit, page,
+                                                      since_id, note_filter, note_set))
+        return self.paginator_class(fetch, limit, since_id, stream)
     
     def get_note(self, note_id, show_replies=False, recipient_limit=None):
         """
@@ -862,14 +1451,8 @@ class Api(object):
 
         url = '%snotes/%s.json?%s' % (self.API_URL, note_id, urllib.urlencode(query_dict))
         
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'type' in json_obj.keys():
-            obj_type = self.OBJECT_TYPE_MAPPING[json_obj['type']]
-            return obj_type(json_obj)
-        elif 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            error_list = (note_id, error['message'])
-            raise error_class("Error retrieving note %s: %s" % error_list)
+        return self._then(self._fetch_json(url), self._build_note,
+                          "Error retrieving note %s: %%s" % note_id)
 
     def get_note_recipients(self, note_id, limit=None, page=None):
         """
@@ -910,12 +1493,19 @@ class Api(object):
                                                  note_id, 
                                                  urllib.urlencode(query_dict))
         
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'users' in json_obj.keys():
-            return [User(user_dict) for user_dict in json_obj]
-        elif 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            raise error_class("Error retrieving note recipients: %s" % error['message'])
+        return self._then(self._fetch_json(url), self._build_users,
+                          "Error retrieving note recipients: %s")
+
+    def iter_note_recipients(self, note_id, limit=None):
+        """
+        Iterates over all users who have received the specified note,
+        as ``User`` objects, fetching ``limit`` (by default 100) users
+        at a time. Returns a ``Paginator``.
+        """
+        limit = limit or self.PAGE_LIMIT
+        def fetch(page):
+            return self.get_note_recipients(note_id, limit=limit, page=page)
+        return self.paginator_class(fetch, limit)
 
     def get_user(self, username):
         """
@@ -927,12 +1517,8 @@ class Api(object):
         """
         query_dict = {'app_key' : self.app_key}
         url = '%susers/%s.json?%s' % (self.API_URL, username, urllib.urlencode(query_dict))
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            error_list = (username, error['message'])
-            raise error_class("Error retrieving user '%s': %s" % error_list)
-        return User(json_obj)
+        return self._then(self._fetch_json(url), self._build_user,
+                          "Error retrieving user '%s': %%s" % username)
 
     def get_related_users(self, username, relationship, limit=None, page=None):
         """
@@ -985,13 +1571,22 @@ class Api(object):
                                          relationship, 
                                          urllib.urlencode(query_dict))
         
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'users' in json_obj.keys():
-            return [User(user_dict) for user_dict in json_obj]
-        elif 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            error_list = (username, error['message'])
-            raise error_class("Error retrieving related users for '%s': %s" % error_list)
+        return self._then(self._fetch_json(url), self._build_users,
+                          "Error retrieving related users for '%s': %%s" % username)
+
+    def iter_related_users(self, username, relationship, limit=None):
+        """
+        Iterates over all users related to a particular user, as
+        ``User`` objects, fetching ``limit`` (by default 100) users at
+        a time. Returns a ``Paginator``; see ``get_related_users`` for
+        the arguments.
+        """
+        limit = limit or self.PAGE_LIMIT
+        if relationship not in ('friends', 'fans', 'fan_of'):
+            raise ValueError("'%s' is not a valid relationship type. Valid relationship types are: friends, fans, fan_of")
+        def fetch(page):
+            return self.get_related_users(username, relationship, limit=limit, page=page)
+        return self.paginator_class(fetch, limit)
     
     def send_to_list(self):
         """
@@ -999,12 +1594,8 @@ class Api(object):
         """
         query_dict = {'app_key' : self.app_key}
         url = '%ssend/send_to.json?%s' % (self.API_URL, urllib.urlencode(query_dict))
-        json_obj = simplejson.loads(self._fetch(url))
-        if 'users' in json_obj.keys():
-            return [User(user_dict) for user_dict in json_obj]
-        elif 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            raise error_class("Error retrieving 'send_to' list: %s" % error['message'])
+        return self._then(self._fetch_json(url), self._build_users,
+                          "Error retrieving 'send_to' list: %s")
 
     def post_message(self, note_to, note_body):
         """
@@ -1130,65 +1721,278 @@ class Api(object):
             postdata['event_location'] = event_location
             postdata['event_date'] = event_date.strftime('%Y-%m-%d %H:%M:%S')
         elif note_type == 'file':
-            postdata['media_file'] = (open(media_filename, 'r'), media_filename)
-            user = self.get_user(self.username)
-            if user.is_pro:
-                note_type = 'file_pro'
+            postdata['media_file'] = (open(media_filename, 'rb'), media_filename)
+            return self._then(self.get_user(self.username), self._send_file,
+                              query_dict, postdata)
+
+        return self._send_note(note_type, query_dict, postdata)
 
+    def _send_file(self, user, query_dict, postdata):
+        """
+        Posts a file note, using the pro upload limits if ``user`` is
+        a pro user.
+        """
+        if user.is_pro:
+            return self._send_note('file_pro', query_dict, postdata)
+        return self._send_note('file', query_dict, postdata)
+
+    def _send_note(self, note_type, query_dict, postdata):
+        """
+        Sends the prepared ``postdata`` to the endpoint for
+        ``note_type``.
+        """
         api_url = '%ssend/%s.json?%s' % (self.API_URL, 
                                          note_type, 
                                          urllib.urlencode(query_dict))
-        json_obj = simplejson.loads(self._fetch(api_url, postdata=postdata))
+        return self._then(self._fetch_json(api_url, postdata=postdata),
+                          self._build_note, "Error posting note: %s")
+
+    def _then(self, result, callback, *args):
+        """
+        Hands ``result`` to ``callback`` (with any extra ``args``) and
+        returns what the callback returns. Non-blocking subclasses
+        override this to chain the callback onto a ``Deferred``.
+        """
+        return callback(result, *args)
+
+    def _raise_error(self, json_obj, message):
+        """
+        Raises the exception from ``ERROR_MAPPING`` matching the error
+        in ``json_obj``; ``message`` is formatted with the error
+        message returned by Pownce.
+        """
+        error = json_obj['error']
+        error_class = self.ERROR_MAPPING.get(error.get('status_code'), NotFound)
+        raise error_class(message % error.get('message'))
+
+    def _build_user(self, json_obj, message):
+        if 'error' in json_obj.keys():
+            self._raise_error(json_obj, message)
+        return User(json_obj)
+
+    def _build_users(self, json_obj, message):
+        if 'users' in json_obj.keys():
+            return [User(user_dict) for user_dict in json_obj['users']]
+        self._raise_error(json_obj, message)
+
+    def _build_note(self, json_obj, message):
         if 'type' in json_obj.keys():
             obj_type = self.OBJECT_TYPE_MAPPING[json_obj['type']]
             return obj_type(json_obj)
-        elif 'error' in json_obj.keys():
-            error_class = self.ERROR_MAPPING[json_obj['error']]
-            raise error_class("Error posting note: %s" % error['message'])
-        
+        self._raise_error(json_obj, message)
 
-    def _fetch(self, url, postdata=None, user_agent="python-pownce-api"):
+    def _build_notes(self, json_obj):
+        if 'notes' in json_obj.keys():
+            object_list = []
+            for pownce_obj in json_obj['notes']:
+                obj_type = self.OBJECT_TYPE_MAPPING[pownce_obj['type']]
+                object_list.append(obj_type(pownce_obj))
+            return object_list
+        else:
+            raise NotFound("Error retrieving notes: %s" % json_obj['error']['message'])
+
+    def _fetch_notes(self, url):
+        """
+        Fetches a note list, returning a list of ``Note`` objects. The
+        response is decompressed as it arrives and decoded in one go,
+        the fastest way to get all of its notes; ``_stream_notes``
+        yields them one at a time instead.
+        """
+        key, cached = self._cached_response(url)
+        status, headers, chunks = self._stream_response(
+            url, headers=self._validator_headers(cached))
+        if status == 304 and cached is not None:
+            return self._build_notes(cached[2])
+        if headers.get('content-encoding', '') == 'gzip':
+            chunks = gunzip(chunks)
+        body = ''.join(chunks)
+        # the body is already decompressed
+        json_obj = self._decode_response((status, {}, body))
+        notes = self._build_notes(json_obj)
+        if key is not None and status == 200:
+            self._remember_response(key, headers, json_obj, len(body))
+        return notes
+
+    def _stream_notes(self, url):
+        """
+        Fetches a note list and yields its notes one at a time while
+        the response is decompressed and decoded as it arrives.
+        """
+        key, cached = self._cached_response(url)
+        status, headers, chunks = self._stream_response(
+            url, headers=self._validator_headers(cached))
+        if status == 304 and cached is not None:
+            for note in self._build_notes(cached[2]):
+                yield note
+            return
+        if headers.get('content-encoding', '') == 'gzip':
+            chunks = gunzip(chunks)
+        # keep the note dictionaries if the response can be cached
+        raw_notes = None
+        if key is not None and status == 200 and any(self._validators(headers)):
+            raw_notes = []
+        size = 0
+        parser = NoteListParser()
+        for chunk in chunks:
+            size += len(chunk)
+            for pownce_obj in parser.feed(chunk):
+                if raw_notes is not None:
+                    raw_notes.append(pownce_obj)
+                obj_type = self.OBJECT_TYPE_MAPPING[pownce_obj['type']]
+                yield obj_type(pownce_obj)
+        try:
+            json_obj = parser.close()
+        except ValueError:
+            error_class = self.ERROR_MAPPING.get(status, ServerError)
+            raise error_class("Unexpected response with status %s" % status)
+        if 'notes' not in json_obj.keys():
+            raise NotFound("Error retrieving notes: %s" % json_obj['error']['message'])
+        if raw_notes is not None:
+            json_obj['notes'] = raw_notes
+            self._remember_response(key, headers, json_obj, size)
+
+    def _fetch_json(self, url, postdata=None):
+        """
+        Fetches ``url`` and returns the decoded JSON response.
+
+        If there is a ``validator_cache``, GET requests send the
+        ``ETag`` and ``Last-Modified`` validators of the last response
+        for the URL, and a 304 Not Modified answer returns that
+        response's decoded body again, which is shared by all callers.
+        """
+        key, cached = None, None
+        if postdata is None:
+            key, cached = self._cached_response(url)
+        if key is None:
+            return self._then(self._fetch_response(url, postdata=postdata),
+                              self._decode_response)
+        return self._then(self._fetch_response(url, headers=self._validator_headers(cached)),
+                          self._decode_conditional, key, cached)
+
+    def _cached_response(self, url):
+        """
+        Returns the ``validator_cache`` key for ``url`` and the cached
+        tuple of the ETag, last modification date and decoded body, or
+        ``None``. The key is ``None`` without a ``validator_cache``.
+        """
+        if self.validator_cache is None:
+            return None, None
+        key = (hashlib.sha1(self.encoded_auth).hexdigest(), url)
+        return key, self.validator_cache.get(key)
+
+    def _validators(self, headers):
+        return headers.get('etag'), headers.get('last-modified')
+
+    def _validator_headers(self, cached):
+        """
+        Returns the request headers making a GET conditional on the
+        ``cached`` response.
+        """
+        headers = {}
+        if cached is not None:
+            etag, last_modified, json_obj = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _remember_response(self, key, headers, json_obj, size):
+        etag, last_modified = self._validators(headers)
+        if etag or last_modified:
+            self.validator_cache.set(key, (etag, last_modified, json_obj),
+                                     weight=size)
+
+    def _decode_conditional(self, response, key, cached):
+        """
+        Like ``_decode_response``, but returns the cached body for a 304
+        response and remembers the validators of a new one.
+        """
+        status, headers, body = response
+        if status == 304 and cached is not None:
+            return cached[2]
+        json_obj = self._decode_response(response)
+        if status == 200:
+            self._remember_response(key, headers, json_obj, len(body))
+        return json_obj
+
+    def _decode_response(self, response):
+        """
+        Decodes the JSON body of a ``(status, headers, body)`` response
+        tuple. Responses which aren't JSON raise the exception from
+        ``ERROR_MAPPING`` matching the status.
+        """
+        status, headers, body = response
+        if headers.get('content-encoding', '') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        try:
+            return simplejson.loads(body)
+        except ValueError:
+            error_class = self.ERROR_MAPPING.get(status, ServerError)
+            raise error_class("Unexpected response with status %s" % status)
+
+    def _encode_postdata(self, postdata):
         """
-        Fetches results from the Pownce API, using basic
-        authentication and accepting gzip encoding.  Also, this will
-        POST form data as multipart if there is any POST data to
-        post.
+        Encodes ``postdata`` for a POST request, returning a tuple of
+        the content type and the request body. Data containing a
+        ``media_file`` is encoded as a streamed ``MultipartBody``.
         """
-        request = urllib2.Request(url)
-        request.add_header('User-Agent', user_agent)
-        request.add_header('Accept-Encoding', 'gzip')
-        request.add_header('Authorization', 'Basic %s' % self.encoded_auth)
+        if 'media_file' not in postdata.keys():
+            return ('application/x-www-form-urlencoded',
+                    urllib.urlencode(postdata.items(), 1))
+        body = MultipartBody(postdata.items())
+        return body.content_type, body
+
+    def _fetch_response(self, url, postdata=None, user_agent=None, headers=None):
+        """
+        Fetches results from the Pownce API over a pooled keep-alive
+        connection, using basic authentication and accepting gzip
+        encoding.  Also, this will POST form data as multipart if
+        there is any POST data to post.
+
+        ``headers`` are sent in addition to the default ones.
+
+        Returns a tuple of the response status, headers and (still
+        encoded) body.
+        """
+        return self._request(url, postdata, user_agent, headers, stream=False)
+
+    def _stream_response(self, url, postdata=None, user_agent=None, headers=None):
+        """
+        Like ``_fetch_response``, but returns an iterator over the
+        chunks of the body as they arrive instead of the body.
+        """
+        return self._request(url, postdata, user_agent, headers, stream=True)
+
+    def _request(self, url, postdata, user_agent, extra_headers, stream):
+        scheme, host, path, query, fragment = urlparse.urlsplit(url)
+        if query:
+            path = '%s?%s' % (path, query)
+        headers = {
+            'User-Agent': user_agent or self.USER_AGENT,
+            'Accept-Encoding': 'gzip',
+            'Authorization': 'Basic %s' % self.encoded_auth,
+        }
+        if extra_headers:
+            headers.update(extra_headers)
+        method, data = 'GET', None
         if postdata is not None:
-            if 'media_file' in postdata.keys():
-                bound = mimetools.choose_boundary()
-                ctype = 'multipart/form-data; boundary=%s' % bound
-                if hasattr(request, 'add_undirected_header'):
-                    header_method = request.add_undirected_header
-                else:
-                    header_method = request.add_header
-                header_method('Content-Type', ctype)
-                data = StringIO()
-                for (key, value) in postdata.items():
-                    if key == 'media_file':
-                        (f, filename) = value
-                        mime = mimetypes.guess_type(filename)[0]
-                        if mime is None:
-                            mime = 'application/octet-stream'
-                        data.write('--%s\r\nContent-Disposition: form-data; ' % bound)
-                        data.write('name="%s"; filename="%s"\r\n' % (key, filename))
-                        data.write('Content-Type: %s\r\n\r\n' % mime)
-                        data.write('%s\r\n' % f.read())
-                    else:
-                        data.write('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (bound, key, value))
-                data.write('--%s--\r\n\r\n' % bound)
-                data = data.getvalue()
-            else:
-                data = urllib.urlencode(postdata.items(), 1)
-            request.add_data(data)
-        opener = urllib2.build_opener()
-        f = opener.open(request)
-        result = f.read()
-        if f.headers.get('content-encoding', '') == 'gzip':
-            result = gzip.GzipFile(fileobj=StringIO(result)).read()
-        f.close()
-        return result
+            method = 'POST'
+            headers['Content-Type'], data = self._encode_postdata(postdata)
+        try:
+            if stream:
+                return self.connection_pool.stream(host, method, path, data, headers)
+            return self.connection_pool.request(host, method, path, data, headers)
+        finally:
+            if isinstance(data, MultipartBody):
+                data.close()
+
+    def _fetch(self, url, postdata=None, user_agent="python-pownce-api"):
+        """
+        Fetches results from the Pownce API and returns the decoded
+        response body.
+        """
+        status, headers, body = self._fetch_response(url, postdata, user_agent)
+        if headers.get('content-encoding', '') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body
@@ -0,0 +1,99 @@
+import os
+import time
+import signal
+import pstats
+import cProfile
+
+from twisted.internet import defer, reactor
+from twisted.python import log
+
+class Profiler(object):
+    """
+    Profiles the reactor thread with ``cProfile`` for a while on
+    request. Nothing is hooked in while it isn't running.
+
+    The collected stats are written to a pstats file in ``directory``,
+    which can be looked at with the ``pstats`` module or tools reading
+    its format.
+    """
+    # longest a profile may run, in seconds
+    MAX_SECONDS = 300
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.profile = None
+        self.deferred = None
+
+    def running(self):
+        return self.profile is not None
+
+    def start(self, seconds):
+        """
+        Starts profiling for ``seconds`` seconds. Returns a ``Deferred``
+        firing with the path of the pstats file and a list of the
+        hottest functions, see ``hottest``.
+        """
+        if self.running():
+            return defer.fail(ValueError("The profiler is running already."))
+        if seconds <= 0:
+            return defer.fail(ValueError("Can't profile for %s seconds." % seconds))
+        seconds = min(seconds, self.MAX_SECONDS)
+        # the stop is scheduled first, so a profile can't be left running
+        call = reactor.callLater(seconds, self.stop)
+        self.deferred = defer.Deferred()
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except:
+            call.cancel()
+            self.profile = self.deferred = None
+            return defer.fail()
+        log.msg("PROFILER: profiling for %d seconds" % seconds)
+        return self.deferred
+
+    def stop(self):
+        profile, self.profile = self.profile, None
+        d, self.deferred = self.deferred, None
+        profile.disable()
+        path = os.path.join(self.directory, 'powncebot-%s.pstats' %
+                            time.strftime('%Y%m%d-%H%M%S'))
+        try:
+            profile.dump_stats(path)
+            hottest = self.hottest(pstats.Stats(profile))
+        except:
+            d.errback()
+        else:
+            log.msg("PROFILER: wrote %s" % path)
+            d.callback((path, hottest))
+
+    def hottest(self, stats, count=5):
+        """
+        Returns ``(name, seconds)`` of the ``count`` functions which took
+        the most time themselves, without the functions they called.
+        """
+        functions = []
+        for ((filename, line, name), entry) in stats.stats.items():
+            own_time = entry[2]
+            functions.append((own_time, '%s (%s:%d)' % (
+                name, os.path.basename(filename), line)))
+        functions.sort(reverse=True)
+        return [(name, seconds) for (seconds, name) in functions[:count]]
+
+def format_hottest(hottest):
+    return ', '.join(['%s %.3fs' % (name, seconds) for (name, seconds) in hottest])
+
+def install_signal(profiler, seconds, signum=signal.SIGUSR2):
+    """
+    Makes signal ``signum`` start a profile of ``seconds`` seconds,
+    whose results are logged.
+    """
+    def profiled((path, hottest)):
+        log.msg("PROFILER: hottest functions: %s" % format_hottest(hottest))
+
+    def start():
+        profiler.start(seconds).addCallbacks(profiled, log.err)
+
+    def handler(signum, frame):
+        reactor.callFromThread(start)
+
+    signal.signal(signum, handler)
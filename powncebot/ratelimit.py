@@ -0,0 +1,131 @@
+import time
+
+class TokenBucket(object):
+    """
+    A token bucket refilled with ``rate`` tokens per second, holding at
+    most ``burst`` tokens.
+    """
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, tokens=1):
+        """
+        Returns ``True`` if the bucket holds ``tokens``, without taking
+        them.
+        """
+        self.refill()
+        return self.tokens >= tokens
+
+    def consume(self, tokens=1):
+        """
+        Takes ``tokens`` from the bucket, returning ``False`` if there
+        are not enough.
+        """
+        if not self.available(tokens):
+            return False
+        self.tokens -= tokens
+        return True
+
+    def full(self):
+        self.refill()
+        return self.tokens >= self.burst
+
+class RateLimiter(object):
+    """
+    Admission control with a token bucket per key (usually a JID) and
+    an optional global bucket shared by all keys. A rate of 0 disables
+    the respective bucket.
+
+    A request is admitted only if both its key's and the global bucket
+    have a token, and then takes one from each. ``throttle`` tells
+    whether a rejected key has been told so already.
+
+    ``rejected`` and ``rejected_global`` count the requests turned
+    away by the per-key and the global limit.
+    """
+    # drop idle buckets every this many requests
+    PRUNE_INTERVAL = 1000
+    # seconds after which a key still being rejected is told again
+    THROTTLE_TIME = 60
+
+    def __init__(self, rate, burst, global_rate=0, global_burst=0,
+                 clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.buckets = {}
+        self.global_bucket = None
+        if global_rate:
+            self.global_bucket = TokenBucket(global_rate, global_burst, clock)
+        # the time each rejected key was last told so, until it's
+        # admitted again
+        self.throttled = {}
+        self.requests = 0
+        self.rejected = 0
+        self.rejected_global = 0
+
+    def allow(self, key):
+        """
+        Returns ``True`` if a request for ``key`` may pass.
+        """
+        self.requests += 1
+        if self.requests % self.PRUNE_INTERVAL == 0:
+            self.prune()
+        bucket = None
+        if self.rate:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, self.clock)
+            if not bucket.available():
+                self.rejected += 1
+                return False
+        if self.global_bucket is not None and not self.global_bucket.available():
+            self.rejected_global += 1
+            return False
+        if bucket is not None:
+            bucket.consume()
+        if self.global_bucket is not None:
+            self.global_bucket.consume()
+        if self.throttled:
+            self.throttled.pop(key, None)
+        return True
+
+    def throttle(self, key):
+        """
+        Returns ``True`` if ``key``, whose request was just rejected,
+        should be told so: if it hasn't been since it was last admitted,
+        or not for ``THROTTLE_TIME`` seconds.
+        """
+        now = self.clock()
+        told = self.throttled.get(key)
+        if told is not None and now - told < self.THROTTLE_TIME:
+            return False
+        self.throttled[key] = now
+        return True
+
+    def prune(self):
+        """
+        Forgets the buckets which have refilled completely, and the
+        keys told about their rejection long ago.
+        """
+        for key, bucket in self.buckets.items():
+            if bucket.full():
+                del self.buckets[key]
+        now = self.clock()
+        for key, told in self.throttled.items():
+            if now - told >= self.THROTTLE_TIME:
+                del self.throttled[key]
+
+    def stats(self):
+        return {'requests': self.requests, 'rejected': self.rejected,
+                'rejected_global': self.rejected_global,
+                'buckets': len(self.buckets), 'throttled': len(self.throttled)}
@@ -0,0 +1,104 @@
+import re
+import random
+import hashlib
+import threading
+import urlparse
+
+import simplejson
+
+# The cached endpoints, by the path of their URLs
+ENDPOINTS = (
+    ('user', re.compile(r'/users/[^/]+\.json$')),
+    ('related_users', re.compile(r'/users/[^/]+/(friends|fans|fan_of)\.json$')),
+    ('note', re.compile(r'/notes/\d+\.json$')),
+    ('note_recipients', re.compile(r'/notes/\d+/recipients\.json$')),
+)
+
+class ResponseCache(object):
+    """
+    Caches the decoded responses of the read-only Pownce endpoints in
+    ``backend``, an ``LRUCache`` or ``SQLiteCache``.
+
+    ``ttls`` maps the endpoint names of ``ENDPOINTS`` to the seconds
+    their responses are kept; endpoints without a TTL aren't cached.
+    Responses are cached per set of credentials, as what Pownce returns
+    depends on who is asking. ``invalidate`` drops everything cached
+    for a set of credentials; the generation it bumps is kept in the
+    backend too, so other processes sharing an ``SQLiteCache`` (and
+    this one after a restart) don't return the dropped responses.
+
+    ``stats`` reports the hit ratio and the bytes of response bodies
+    which didn't need to be downloaded.
+    """
+    def __init__(self, backend, ttls):
+        self.backend = backend
+        self.ttls = ttls
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def endpoint(self, url):
+        """
+        Returns the name of the cached endpoint ``url`` belongs to, or
+        ``None``.
+        """
+        path = urlparse.urlsplit(url)[2]
+        for (name, pattern) in ENDPOINTS:
+            if self.ttls.get(name) and pattern.search(path):
+                return name
+        return None
+
+    def scope(self, encoded_auth):
+        return hashlib.sha1(encoded_auth).hexdigest()
+
+    def generation(self, scope):
+        return self.backend.get('generation:%s' % scope, '0')
+
+    def key(self, scope, url):
+        return '%s:%s:%s' % (scope, self.generation(scope), url)
+
+    def get(self, encoded_auth, url):
+        """
+        Returns the cached response for ``url`` or ``None``.
+        """
+        entry = self.backend.get(self.key(self.scope(encoded_auth), url))
+        self.lock.acquire()
+        try:
+            if entry is None:
+                self.misses += 1
+                return None
+            size, json_obj = entry
+            self.hits += 1
+            self.bytes_saved += size
+            return json_obj
+        finally:
+            self.lock.release()
+
+    def set(self, encoded_auth, url, endpoint, json_obj):
+        size = len(simplejson.dumps(json_obj))
+        self.backend.set(self.key(self.scope(encoded_auth), url), (size, json_obj),
+                         self.ttls[endpoint], weight=size)
+
+    def invalidate(self, encoded_auth):
+        """
+        Makes the responses cached for ``encoded_auth`` unreachable, by
+        keying the ones cached from now on with a new generation.
+        """
+        # A random generation can't come back, unlike a counter whose
+        # entry was lost. It is kept as long as the longest TTL: by then
+        # the responses cached before the first invalidation have
+        # expired, and it's touched with every lookup, so it's evicted
+        # after them.
+        self.backend.set('generation:%s' % self.scope(encoded_auth),
+                         '%016x' % random.getrandbits(64), max([0] + self.ttls.values()))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        ratio = 0.0
+        if lookups:
+            ratio = float(self.hits) / lookups
+        stats = self.backend.stats()
+        stats.update({'hits': self.hits, 'misses': self.misses,
+                      'hit_ratio': ratio, 'bytes_saved': self.bytes_saved})
+        return stats
@@ -3,8 +3,115 @@
 #JABBER_RESOURCE = 'bot'
 #APPLICATION_KEY = ''
 
+# Base URL of the Pownce API
+#API_URL = 'http://api.pownce.com/2.0/'
+
 # DATABASE_URI = 'sqlite:///:memory:'
 
+# Use the non-blocking twisted.web based Pownce client
+#ASYNC_API = False
+
+# Size of the thread pool running blocking commands and of the one
+# running the timeline polls and outbox deliveries, 0 runs them inline.
+# Both are 0 with the async client or an in-memory database.
+#COMMAND_THREADS = 4
+#BACKGROUND_THREADS = 4
+
+# Idle keep-alive connections kept per host and their idle timeout, for
+# the blocking client only (the async one connects for every request)
+#HTTP_POOL_SIZE = 4
+#HTTP_IDLE_TIMEOUT = 30
+
+# Seconds a request to Pownce may hang before it fails
+#HTTP_TIMEOUT = 30
+
+# Seconds verified Pownce credentials are trusted without asking Pownce
+#CREDENTIALS_TTL = 900
+
+# Seconds the default recipient of a user is cached
+#SEND_TO_TTL = 3600
+
+# Number of user ids cached (0 caches none) and seconds unknown usernames are remembered
+#USER_ID_CACHE_SIZE = 1000
+#USER_NOT_FOUND_TTL = 300
+
+# Responses remembered for conditional GET requests (0 remembers none),
+# and the bytes of response bodies they may add up to
+#VALIDATOR_CACHE_SIZE = 1000
+#VALIDATOR_CACHE_BYTES = 8388608
+
+# Seconds the responses of the read-only endpoints are cached, by
+# endpoint (0 disables caching an endpoint), the number of responses
+# and bytes of responses cached, and a file to cache them in instead of
+# memory, shared across restarts
+#RESPONSE_TTLS = {'user': 300, 'note': 60, 'note_recipients': 120, 'related_users': 600}
+#RESPONSE_CACHE_SIZE = 2000
+#RESPONSE_CACHE_BYTES = 8388608
+#RESPONSE_CACHE_PATH = None
+
+# Messages per second and burst size admitted per JID and in total,
+# 0 disables the limit
+#RATE_PER_JID = 1.0
+#BURST_PER_JID = 5
+#RATE_GLOBAL = 50.0
+#BURST_GLOBAL = 100
+
+# Queued outgoing stanzas at which reading from the server is paused
+# and resumed again
+#OUTBOUND_HIGH_WATER = 500
+#OUTBOUND_LOW_WATER = 100
+
+# Stanzas sent at once, and seconds between sending them, once the
+# connection has been congested or the queue is above the high water mark
+#OUTBOUND_BATCH = 20
+#OUTBOUND_INTERVAL = 0.05
+
+# Seconds between outbox runs, attempts to post a note and the first
+# and longest delay between attempts
+#OUTBOX_INTERVAL = 5
+#OUTBOX_MAX_ATTEMPTS = 8
+#OUTBOX_RETRY_DELAY = 5
+#OUTBOX_MAX_RETRY_DELAY = 900
+
+# Initial seconds between polls of a user's notes to push new ones (0
+# disables pushing), polls running at once, the fraction by which the
+# interval varies, and new notes pushed at most, with a summary of the rest
+#TIMELINE_INTERVAL = 300
+#TIMELINE_CONCURRENCY = 4
+#TIMELINE_JITTER = 0.2
+#TIMELINE_CATCH_UP = 5
+
+# Shortest poll interval, used while a user talks to the bot, and the
+# longest one, used for idle and offline users
+#TIMELINE_MIN_INTERVAL = 30
+#TIMELINE_MAX_INTERVAL = 3600
+
+# API requests per hour allowed for the application key (0 for no limit)
+# and the share of them polling may use. The share is enforced as polls
+# per minute (at least one): a poll usually costs one request, or two
+# when a full page of new notes gets the next page prefetched
+#API_QUOTA_PER_HOUR = 0
+#TIMELINE_QUOTA_SHARE = 0.5
+
+# JIDs allowed to use the admin commands
+#ADMIN_JIDS = ()
+
+# Local port serving the bot's stats as plain text (0 disables it)
+#STATS_PORT = 0
+
+# Directory for the profiles taken with the profile command (defaults to
+# the temporary directory), and seconds profiled on SIGUSR2
+#PROFILE_DIR = None
+#PROFILE_SECONDS = 30
+
+# Worker processes the chats are spread over by the hash of the sender's
+# JID, 0 runs the whole bot in one process. All workers use DATABASE_URI,
+# so it must not be an in-memory database.
+#SHARD_WORKERS = 0
+
+# Points per worker on the hash ring; more spread the JIDs more evenly
+#SHARD_REPLICAS = 100
+
 try:
     from local_settings import *
 except ImportError:
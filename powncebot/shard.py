@@ -0,0 +1,506 @@
+import os
+import sys
+import time
+import bisect
+import hashlib
+
+import simplejson
+
+from twisted.application import service
+from twisted.internet import defer, protocol, reactor, stdio, task
+from twisted.protocols.basic import NetstringReceiver
+from twisted.python import log
+from twisted.words.protocols.jabber.jid import JID
+from twisted.words.xish import domish
+from twisted.words.xish.domish import Element as DomishElement
+
+from wokkel.xmppim import MessageProtocol
+
+from powncebot import outbound, settings, stats
+
+UNAVAILABLE = "The bot is restarting. Please try again in a minute."
+
+# runs a worker process, see run_worker
+WORKER_SCRIPT = 'import sys; from powncebot import shard; shard.run_worker(*sys.argv[1:])'
+
+class HashRing(object):
+    """
+    A consistent hash ring: keys are mapped to nodes so that adding or
+    removing a node only moves the keys of that node.
+
+    Every node is put on the ring ``replicas`` times, a key belongs to
+    the node of the next point on the ring after the key's hash.
+    """
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes = set()
+        # sorted (hash, node) pairs
+        self.points = []
+        for node in nodes:
+            self.add(node)
+
+    def hash(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return long(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in xrange(self.replicas):
+            bisect.insort(self.points, (self.hash('%s-%d' % (node, i)), node))
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self.points = [point for point in self.points if point[1] != node]
+
+    def node(self, key):
+        """
+        Returns the node ``key`` belongs to, ``None`` for an empty ring.
+        """
+        if not self.points:
+            return None
+        i = bisect.bisect_left(self.points, (self.hash(key),))
+        if i == len(self.points):
+            i = 0
+        return self.points[i][1]
+
+    def shares(self):
+        """
+        Returns the fraction of the keys belonging to each node.
+        """
+        shares = dict([(node, 0.0) for node in self.nodes])
+        previous = self.points and self.points[-1][0] - 2 ** 32
+        for (point, node) in self.points:
+            shares[node] += (point - previous) / float(2 ** 32)
+            previous = point
+        return shares
+
+class Shard(object):
+    """
+    The JIDs one worker is responsible for.
+    """
+    def __init__(self, ring, node):
+        self.ring = ring
+        self.node = node
+
+    def owns(self, jid):
+        return self.ring.node(jid) == self.node
+
+    def size(self):
+        return len(self.ring.nodes)
+
+class Channel(NetstringReceiver):
+    """
+    Exchanges JSON messages with the other end of a pipe, calling
+    ``received`` with every decoded message.
+    """
+    MAX_LENGTH = 1024 * 1024
+
+    def __init__(self, received):
+        self.received = received
+
+    def stringReceived(self, data):
+        try:
+            message = simplejson.loads(data)
+        except ValueError:
+            log.err()
+        else:
+            self.received(message)
+
+    def send(self, message):
+        self.sendString(simplejson.dumps(message))
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """
+    The supervisor's end of a worker process and what is known about
+    its health.
+    """
+    def __init__(self, supervisor, index):
+        self.supervisor = supervisor
+        self.index = index
+        self.channel = Channel(self.received)
+        self.pid = None
+        self.state = 'starting'
+        self.started = time.time()
+        self.last_pong = None
+        self.routed = 0
+        # the worker's own stats, as of its last heartbeat
+        self.stats = {}
+        self.ended = defer.Deferred()
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+        self.channel.makeConnection(self.transport)
+
+    def childDataReceived(self, fd, data):
+        if fd == 1:
+            self.channel.dataReceived(data)
+        else:
+            for line in data.splitlines():
+                log.msg("WORKER %d: %s" % (self.index, line))
+
+    def received(self, message):
+        self.supervisor.received(self, message)
+
+    def send(self, message):
+        self.channel.send(message)
+
+    def kill(self):
+        try:
+            self.transport.signalProcess('KILL')
+        except Exception:
+            pass
+
+    def processEnded(self, reason):
+        self.state = 'down'
+        self.supervisor.worker_ended(self, reason)
+        self.ended.callback(None)
+
+class Supervisor(service.Service):
+    """
+    Runs ``workers`` bot processes and routes the chats to them by a
+    consistent hash of the sender's bare JID, see ``HashRing``.
+
+    Workers join the ring once they are ready. A worker which exits,
+    or misses ``MISSED_HEARTBEATS`` heartbeats in a row and is killed,
+    leaves the ring, so its JIDs move to the remaining workers, and is
+    restarted after a delay growing with its restarts. Every change of
+    the ring is sent to the workers, which only poll the timelines and
+    post the queued notes of their own JIDs. Messages sent to a worker
+    which dies before answering are lost.
+
+    The stanzas the workers send are queued in ``outbound``. The
+    ``settings`` dictionary overrides settings of the workers.
+    ``stats`` shows the health of the workers and the rebalancing of
+    the ring, ``worker_stats`` the stats a worker reported with its
+    last heartbeat.
+    """
+    # seconds between heartbeats, and heartbeats a worker may miss
+    HEARTBEAT = 5
+    MISSED_HEARTBEATS = 3
+    # seconds before restarting a worker for the first time and at most,
+    # and how long it has to run for its restarts to be forgotten
+    RESTART_DELAY = 1
+    MAX_RESTART_DELAY = 60
+    STABLE_TIME = 60
+    # seconds a worker may take to get ready
+    START_TIMEOUT = 60
+
+    def __init__(self, outbound, workers, replicas=100, settings=None):
+        self.outbound = outbound
+        self.count = workers
+        self.ring = HashRing(replicas=replicas)
+        self.settings = settings or {}
+        self.workers = [None] * workers
+        self.restarts = [0] * workers
+        self.heartbeat = task.LoopingCall(self.beat)
+        self.stopping = False
+        self.rebalances = 0
+        # fraction of the JIDs which changed workers in the last rebalance
+        self.moved = 0.0
+        self.unroutable = 0
+
+    def startService(self):
+        service.Service.startService(self)
+        self.stopping = False
+        for index in xrange(self.count):
+            self.spawn(index)
+        self.heartbeat.start(self.HEARTBEAT, now=False)
+
+    def stopService(self):
+        """
+        Stops the workers; returns a ``Deferred`` firing once they have
+        exited.
+        """
+        service.Service.stopService(self)
+        self.stopping = True
+        if self.heartbeat.running:
+            self.heartbeat.stop()
+        ended = []
+        for worker in self.workers:
+            if worker is not None and worker.state != 'down':
+                ended.append(worker.ended)
+                try:
+                    worker.transport.signalProcess('TERM')
+                except Exception:
+                    pass
+        return defer.DeferredList(ended)
+
+    def spawn(self, index):
+        if self.stopping:
+            return
+        worker = self.workers[index] = WorkerProcess(self, index)
+        path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [path] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+        reactor.spawnProcess(worker, sys.executable,
+            [sys.executable, '-c', WORKER_SCRIPT, str(index), str(self.count),
+             simplejson.dumps(self.settings)], env=env, path=path)
+        log.msg("SHARD: started worker %d, pid %s" % (index, worker.pid))
+
+    def received(self, worker, message):
+        kind = message.get('type')
+        if kind == 'stanza':
+            self.outbound.send(message['xml'])
+        elif kind == 'pong':
+            worker.last_pong = time.time()
+            worker.stats = message['stats']
+        elif kind == 'ready':
+            worker.state = 'up'
+            worker.last_pong = time.time()
+            log.msg("SHARD: worker %d is ready" % worker.index)
+            self.rebalance(add=worker.index)
+
+    def worker_ended(self, worker, reason):
+        log.msg("SHARD: worker %d (pid %s) exited: %s" % (
+            worker.index, worker.pid, reason.getErrorMessage()))
+        if worker.index in self.ring.nodes:
+            self.rebalance(remove=worker.index)
+        if self.stopping or self.workers[worker.index] is not worker:
+            return
+        if time.time() - worker.started > self.STABLE_TIME:
+            self.restarts[worker.index] = 0
+        delay = min(self.MAX_RESTART_DELAY,
+                    self.RESTART_DELAY * 2 ** self.restarts[worker.index])
+        self.restarts[worker.index] += 1
+        reactor.callLater(delay, self.spawn, worker.index)
+
+    def rebalance(self, add=None, remove=None):
+        """
+        Adds a worker to or removes one from the ring and tells the
+        workers about it.
+        """
+        before = self.ring.shares()
+        if add is not None:
+            self.ring.add(add)
+        if remove is not None:
+            self.ring.remove(remove)
+        after = self.ring.shares()
+        self.moved = sum([max(0.0, share - before.get(node, 0.0))
+                          for (node, share) in after.items()])
+        self.rebalances += 1
+        nodes = sorted(self.ring.nodes)
+        log.msg("SHARD: workers %s in the ring, %.0f%% of the JIDs moved" % (
+            nodes, self.moved * 100))
+        for worker in self.workers:
+            if worker is not None and worker.state == 'up':
+                worker.send({'type': 'ring', 'nodes': nodes,
+                             'replicas': self.ring.replicas})
+
+    def beat(self):
+        now = time.time()
+        deadline = now - self.HEARTBEAT * self.MISSED_HEARTBEATS
+        for worker in self.workers:
+            if worker is None:
+                continue
+            if worker.state == 'starting' and worker.started < now - self.START_TIMEOUT:
+                log.msg("SHARD: worker %d did not start, killing it" % worker.index)
+                worker.kill()
+                continue
+            if worker.state != 'up':
+                continue
+            if worker.last_pong < deadline:
+                log.msg("SHARD: worker %d stopped answering, killing it" % worker.index)
+                worker.state = 'hung'
+                worker.kill()
+                continue
+            worker.send({'type': 'ping'})
+
+    def worker_for(self, jid):
+        index = self.ring.node(JID(jid).userhost())
+        if index is None:
+            return None
+        return self.workers[index]
+
+    def route(self, jid, body):
+        """
+        Hands a chat message from ``jid`` to its worker. Returns false
+        if there is no worker to take it.
+        """
+        worker = self.worker_for(jid)
+        if worker is None:
+            self.unroutable += 1
+            return False
+        worker.routed += 1
+        worker.send({'type': 'message', 'from': jid, 'body': body})
+        return True
+
+    def presence(self, jid, available):
+        worker = self.worker_for(jid)
+        if worker is not None:
+            worker.send({'type': 'presence', 'jid': jid, 'available': available})
+
+    def worker_stats(self, index):
+        def worker_stats():
+            worker = self.workers[index]
+            if worker is None:
+                return {}
+            return worker.stats
+        return worker_stats
+
+    def stats(self):
+        shares = self.ring.shares()
+        values = {'workers': self.count, 'up': len(self.ring.nodes),
+                  'rebalances': self.rebalances, 'moved': self.moved,
+                  'unroutable': self.unroutable}
+        for (index, worker) in enumerate(self.workers):
+            if worker is None:
+                continue
+            prefix = 'worker%d.' % index
+            values[prefix + 'state'] = worker.state
+            values[prefix + 'pid'] = worker.pid
+            values[prefix + 'share'] = shares.get(index, 0.0)
+            values[prefix + 'routed'] = worker.routed
+            values[prefix + 'restarts'] = self.restarts[index]
+            values[prefix + 'uptime'] = time.time() - worker.started
+        return values
+
+    def report(self):
+        """
+        Returns one line about the health of every worker.
+        """
+        shares = self.ring.shares()
+        lines = []
+        for (index, worker) in enumerate(self.workers):
+            if worker is None:
+                continue
+            lines.append("worker %d: %s, pid %s, %.0f%% of the JIDs, %d messages, "
+                         "%d restarts" % (index, worker.state, worker.pid,
+                                          shares.get(index, 0.0) * 100,
+                                          worker.routed, self.restarts[index]))
+        lines.append("%d rebalances, %.0f%% of the JIDs moved in the last one" % (
+            self.rebalances, self.moved * 100))
+        return "\n".join(lines)
+
+class FrontEnd(MessageProtocol):
+    """
+    Takes the place of ``PownceBot`` on the XMPP connection of a
+    sharded deployment: passes the chats to the ``Supervisor``'s
+    workers and sends their replies.
+    """
+    def __init__(self, jid, workers):
+        MessageProtocol.__init__(self)
+        self.jid = jid
+        self.outbound = outbound.OutboundQueue(
+            getattr(settings, 'OUTBOUND_HIGH_WATER', 500),
+            getattr(settings, 'OUTBOUND_LOW_WATER', 100),
+            getattr(settings, 'OUTBOUND_BATCH', 20),
+            getattr(settings, 'OUTBOUND_INTERVAL', 0.05))
+        # the API quota and the global rate limit are shared by the workers;
+        # a quota of 0 is no limit, so a worker's share is at least 1
+        quota = getattr(settings, 'API_QUOTA_PER_HOUR', 0)
+        if quota:
+            quota = max(1, quota / workers)
+        worker_settings = {
+            'API_QUOTA_PER_HOUR': quota,
+            'RATE_GLOBAL': getattr(settings, 'RATE_GLOBAL', 50.0) / workers,
+            'BURST_GLOBAL': max(1, getattr(settings, 'BURST_GLOBAL', 100) / workers),
+        }
+        self.supervisor = Supervisor(self.outbound, workers,
+            getattr(settings, 'SHARD_REPLICAS', 100), worker_settings)
+        stats.registry.add_source('shards', self.supervisor.stats)
+        for index in xrange(workers):
+            stats.registry.add_source('worker%d' % index,
+                                      self.supervisor.worker_stats(index))
+        stats.registry.add_source('outbound', self.outbound.stats)
+
+    def connectionInitialized(self):
+        MessageProtocol.connectionInitialized(self)
+        self.outbound.attach(self.xmlstream)
+
+    def connectionLost(self, reason):
+        MessageProtocol.connectionLost(self, reason)
+        self.outbound.detach()
+
+    def reply(self, jid, content):
+        message = domish.Element((None, "message"))
+        message['to'] = jid
+        message['from'] = self.jid.full()
+        message['type'] = 'chat'
+        message.addUniqueId()
+        message.addElement((None, 'body'), content=content)
+        self.outbound.send(message, (jid, content))
+
+    def presence(self, jid, available):
+        self.supervisor.presence(jid, available)
+
+    def onMessage(self, message):
+        if not isinstance(message.body, DomishElement):
+            return None
+        body = unicode(message.body)
+        if (body.strip().lower() == 'shards' and JID(message['from']).userhost()
+                in getattr(settings, 'ADMIN_JIDS', ())):
+            return self.reply(message['from'], self.supervisor.report())
+        if not self.supervisor.route(message['from'], body):
+            self.reply(message['from'], UNAVAILABLE)
+
+class Worker(Channel):
+    """
+    Runs a ``PownceBot`` on the chats the supervisor passes through
+    standard input, and writes the stanzas the bot sends to standard
+    output.
+    """
+    def __init__(self, bot, index):
+        Channel.__init__(self, self.dispatch)
+        self.bot = bot
+        self.index = index
+        self.bot.shard = Shard(HashRing(), index)
+        # replies go straight to the supervisor, whose outbound queue
+        # paces them
+        self.bot.outbound = self
+
+    def connectionMade(self):
+        Channel.send(self, {'type': 'ready', 'pid': os.getpid()})
+
+    def connectionLost(self, reason):
+        if reactor.running:
+            reactor.stop()
+
+    def send(self, element, key=None):
+        if domish.IElement.providedBy(element):
+            element = element.toXml()
+        Channel.send(self, {'type': 'stanza', 'xml': element})
+
+    def dispatch(self, message):
+        kind = message.get('type')
+        if kind == 'message':
+            self.bot.onMessage(make_message(message['from'], self.bot.jid.full(),
+                                            message['body']))
+        elif kind == 'presence':
+            self.bot.presence(JID(message['jid']).userhost(), message['available'])
+        elif kind == 'ring':
+            self.set_ring(message['nodes'], message['replicas'])
+        elif kind == 'ping':
+            Channel.send(self, {'type': 'pong', 'stats': dict(stats.registry.values())})
+
+    def set_ring(self, nodes, replicas):
+        self.bot.shard.ring = HashRing(nodes, replicas)
+        # users which moved here may have changed on another worker
+        self.bot.datastore.load_users(self.bot.shard.owns)
+
+def make_message(sender, recipient, body):
+    message = domish.Element((None, 'message'))
+    message['from'] = sender
+    message['to'] = recipient
+    message['type'] = 'chat'
+    message.addElement('body', content=body)
+    return message
+
+def run_worker(index, count, overrides='{}'):
+    """
+    The main function of a worker process.
+    """
+    log.startLogging(sys.stderr)
+    for (name, value) in simplejson.loads(overrides).items():
+        setattr(settings, str(name), value)
+
+    from powncebot import PownceBot, profiler
+    bot = PownceBot(JID(settings.JABBER_ID))
+    profiler.install_signal(bot.profiler, getattr(settings, 'PROFILE_SECONDS', 30))
+    stdio.StandardIO(Worker(bot, int(index)))
+    reactor.run()
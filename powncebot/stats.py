@@ -0,0 +1,179 @@
+import time
+import bisect
+import threading
+
+from twisted.internet import defer, task
+from twisted.python import failure
+from twisted.web import resource, server
+
+# upper bounds of the histogram buckets in seconds, 0.5ms to about a
+# minute in powers of two
+BUCKETS = [0.0005 * 2 ** i for i in range(18)]
+
+class Histogram(object):
+    """
+    Counts durations in exponentially growing buckets, which is cheap
+    to record and precise enough for percentiles.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket holding the given
+        ``fraction`` of the durations.
+        """
+        rank = fraction * self.count
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if i < len(BUCKETS):
+                    return min(BUCKETS[i], self.max)
+                return self.max
+        return 0.0
+
+    def values(self):
+        mean = 0.0
+        if self.count:
+            mean = self.total / self.count
+        return [('count', self.count), ('errors', self.errors),
+                ('mean', mean), ('p50', self.percentile(0.5)),
+                ('p95', self.percentile(0.95)), ('p99', self.percentile(0.99)),
+                ('max', self.max)]
+
+class Registry(object):
+    """
+    Collects the bot's numbers: latency histograms by name, and
+    sources, functions returning a dictionary of current values
+    (usually some component's ``stats`` method).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.sources = {}
+
+    def record(self, name, seconds, error=False):
+        self.lock.acquire()
+        try:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds, error)
+        finally:
+            self.lock.release()
+
+    def add_source(self, name, source):
+        self.sources[name] = source
+
+    def values(self):
+        """
+        Returns a sorted list of ``(name, value)`` pairs of everything
+        collected.
+        """
+        values = []
+        self.lock.acquire()
+        try:
+            for (name, histogram) in self.histograms.items():
+                for (key, value) in histogram.values():
+                    values.append(('%s.%s' % (name, key), value))
+        finally:
+            self.lock.release()
+        for (name, source) in self.sources.items():
+            for (key, value) in source().items():
+                values.append(('%s.%s' % (name, key), value))
+        values.sort()
+        return values
+
+    def report(self, prefix=''):
+        """
+        Returns the values starting with ``prefix`` as plain text, one
+        ``name value`` pair per line.
+        """
+        lines = []
+        for (name, value) in self.values():
+            if not name.startswith(prefix):
+                continue
+            if isinstance(value, float):
+                value = '%.6f' % value
+            elif isinstance(value, bool):
+                value = int(value)
+            lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def measure(name, func, args=(), failed=None):
+    """
+    Calls ``func(*args)`` and records how long it took, until the
+    ``Deferred`` it returns fires if it returns one. Exceptions, and
+    results for which ``failed`` returns true, count as errors.
+    """
+    start = time.time()
+    try:
+        result = func(*args)
+    except:
+        registry.record(name, time.time() - start, True)
+        raise
+
+    def done(result):
+        error = isinstance(result, failure.Failure)
+        if not error and failed is not None:
+            error = failed(result)
+        registry.record(name, time.time() - start, error)
+        return result
+
+    if isinstance(result, defer.Deferred):
+        return result.addBoth(done)
+    return done(result)
+
+class ReactorMonitor(object):
+    """
+    Measures how late the reactor runs a call scheduled every
+    ``interval`` seconds, that is how long it was blocked.
+    """
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.loop = task.LoopingCall(self.tick)
+        self.last = None
+
+    def start(self):
+        self.last = time.time()
+        self.loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def tick(self):
+        now = time.time()
+        registry.record('reactor.lag', max(0.0, now - self.last - self.interval))
+        self.last = now
+
+class StatsPage(resource.Resource):
+    """
+    Serves ``registry.report()`` as plain text; the ``prefix`` query
+    argument selects some of the values.
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'text/plain')
+        prefix = request.args.get('prefix', [''])[0]
+        return registry.report(prefix)
+
+def site():
+    return server.Site(StatsPage())
@@ -0,0 +1,331 @@
+import os
+import sqlite3
+
+import simplejson
+
+from sqlalchemy.orm import clear_mappers
+
+from twisted.internet import defer
+from twisted.trial import unittest
+from twisted.words.xish import domish
+
+from powncebot import accounts, commands, outbox, pownce, settings
+from powncebot.cache import LRUCache, TTLCache
+from powncebot.responses import ResponseCache
+
+class DatastoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database_uri = getattr(settings, 'DATABASE_URI', None)
+        settings.DATABASE_URI = 'sqlite://'
+        self.datastore = accounts.Datastore()
+
+    def tearDown(self):
+        self.datastore.session.remove()
+        # the model classes are mapped again by the next Datastore
+        clear_mappers()
+        if self.database_uri is None:
+            del settings.DATABASE_URI
+        else:
+            settings.DATABASE_URI = self.database_uri
+
+    def test_register_get_user_queue_note(self):
+        """
+        A newly registered user can be used right away, without the
+        session it was stored with.
+        """
+        self.datastore.register('user', 'secret', 'user@example.com')
+        user = self.datastore.get_user('user@example.com')
+        self.assertEqual((user.username, user.password, user.since_id),
+                         ('user', 'secret', None))
+        entry = self.datastore.queue_note(user.jid, 'message', 'public', 'Hello')
+        self.assertEqual((entry.jid, entry.note_type, entry.note_to, entry.body),
+                         ('user@example.com', 'message', 'public', 'Hello'))
+        due = self.datastore.due_notes(entry.next_attempt)
+        self.assertEqual([note.id for note in due], [entry.id])
+
+    def test_set_since_id(self):
+        self.datastore.register('user', 'secret', 'user@example.com')
+        self.datastore.set_since_id('user@example.com', 42)
+        self.assertEqual(self.datastore.get_user('user@example.com').since_id, 42)
+        self.datastore.users.clear()
+        self.assertEqual(self.datastore.get_user('user@example.com').since_id, 42)
+
+    def test_jid_index(self):
+        """
+        Users are looked up in the index, which is written through to
+        the database; users registered by another process are found in
+        the database and indexed.
+        """
+        user = self.datastore.register('user', 'secret', 'user@example.com')
+        self.assertTrue(self.datastore.get_user('user@example.com') is user)
+        self.datastore.engine.execute(
+            "INSERT INTO users (username, password, jid) "
+            "VALUES ('other', 'secret', 'other@example.com')")
+        self.assertEqual(self.datastore.users.keys(), ['user@example.com'])
+        other = self.datastore.get_user('other@example.com')
+        self.assertEqual(other.username, 'other')
+        self.assertTrue(self.datastore.users['other@example.com'] is other)
+        self.datastore.unregister('user@example.com')
+        self.assertEqual(self.datastore.get_user('user@example.com'), None)
+        self.assertEqual(self.datastore.users.keys(), ['other@example.com'])
+
+    def test_load_users(self):
+        self.datastore.register('user', 'secret', 'user@example.com')
+        self.datastore.register('other', 'secret', 'other@example.com')
+        self.datastore.load_users(lambda jid: jid.startswith('other'))
+        self.assertEqual(self.datastore.users.keys(), ['other@example.com'])
+        self.datastore.load_users()
+        self.assertEqual(sorted(self.datastore.users.keys()),
+                         ['other@example.com', 'user@example.com'])
+
+class MigrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database_uri = getattr(settings, 'DATABASE_URI', None)
+        self.path = os.path.abspath(self.mktemp())
+        settings.DATABASE_URI = 'sqlite:///%s' % self.path
+        # the users table before the since_id column and the JID index
+        db = sqlite3.connect(self.path)
+        db.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, "
+                   "username VARCHAR(64), password VARCHAR(32), jid VARCHAR(255))")
+        db.execute("INSERT INTO users (username, password, jid) "
+                   "VALUES ('user', 'secret', 'user@example.com')")
+        db.commit()
+        db.close()
+        self.datastore = None
+
+    def tearDown(self):
+        if self.datastore is not None:
+            self.datastore.session.remove()
+        clear_mappers()
+        if self.database_uri is None:
+            del settings.DATABASE_URI
+        else:
+            settings.DATABASE_URI = self.database_uri
+
+    def test_migrated(self):
+        self.datastore = accounts.Datastore()
+        user = self.datastore.users['user@example.com']
+        self.assertEqual((user.username, user.since_id), ('user', None))
+        self.datastore.set_since_id('user@example.com', 42)
+        db = sqlite3.connect(self.path)
+        self.assertEqual(db.execute("SELECT since_id FROM users").fetchall(), [(42,)])
+        indexes = db.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                             "AND tbl_name = 'users'").fetchall()
+        self.assertEqual(indexes, [('ix_users_jid',)])
+        db.close()
+
+    def test_migrated_again(self):
+        """
+        Nothing happens to a database which has been migrated already.
+        """
+        self.datastore = accounts.Datastore()
+        self.datastore.session.remove()
+        clear_mappers()
+        self.datastore = accounts.Datastore()
+        self.assertEqual(self.datastore.users.keys(), ['user@example.com'])
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+class FakeApi(object):
+    """
+    Knows the user with the password ``secret``, and fails to post.
+    """
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.encoded_auth = '%s:%s' % (username, password)
+        self.user_requests = 0
+
+    def get_user(self, username):
+        self.user_requests += 1
+        if self.password != 'secret':
+            raise pownce.NotFound("No such user")
+        return 'user'
+
+    def post_message(self, note_to, body):
+        raise pownce.AuthenticationRequired("Changed the password")
+
+class CredentialsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.patch(accounts, 'credentials', TTLCache(900, self.clock))
+        self.patch(accounts, 'responses', ResponseCache(LRUCache(10), {}))
+        self.apis = {}
+        self.patch(accounts, 'get_api', self.get_api)
+
+    def get_api(self, username, password):
+        return self.apis.setdefault(password, FakeApi(username, password))
+
+    @defer.inlineCallbacks
+    def test_verified_once(self):
+        """
+        Verified credentials aren't checked again for ``CREDENTIALS_TTL``
+        seconds.
+        """
+        api = yield accounts.login('user', 'secret')
+        yield accounts.login('user', 'secret')
+        self.assertEqual(api.user_requests, 1)
+        self.clock.now += 899
+        yield accounts.login('user', 'secret')
+        self.assertEqual(api.user_requests, 1)
+        self.clock.now += 1
+        yield accounts.login('user', 'secret')
+        self.assertEqual(api.user_requests, 2)
+
+    @defer.inlineCallbacks
+    def test_wrong_password(self):
+        for i in range(2):
+            yield self.assertFailure(accounts.login('user', 'wrong'),
+                                     pownce.AuthenticationRequired)
+        self.assertEqual(self.apis['wrong'].user_requests, 2)
+        self.assertEqual(len(accounts.credentials), 0)
+
+    @defer.inlineCallbacks
+    def test_invalidated(self):
+        """
+        Credentials Pownce rejects when posting are checked again the
+        next time.
+        """
+        class User(object):
+            username = 'user'
+            password = 'secret'
+        class Datastore(object):
+            def get_user(self, jid):
+                return User()
+        class Bot(object):
+            datastore = Datastore()
+        entry = accounts.OutboxEntry('user@example.com', 'message', 'public', 'Hello')
+        yield accounts.login('user', 'secret')
+        yield self.assertFailure(outbox.Outbox(Bot()).deliver(entry),
+                                 pownce.AuthenticationRequired)
+        self.assertEqual(len(accounts.credentials), 0)
+        yield accounts.login('user', 'secret')
+        self.assertEqual(self.apis['secret'].user_requests, 2)
+
+class FakeReactor(object):
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+    def callInThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+class SendToApi(accounts.Api):
+    """
+    Answers the send_to list with ``selected`` as the default.
+    """
+    validator_cache = None
+
+    def __init__(self):
+        accounts.Api.__init__(self, 'user', 'secret', 'key')
+        self.selected = 'public'
+        self.requests = 0
+
+    def _send_request(self, url, postdata, user_agent, headers):
+        self.requests += 1
+        return 200, {}, simplejson.dumps({'selected': self.selected, 'options': []})
+
+class FakeUser(object):
+    username = 'user'
+    password = 'secret'
+
+class FakeParent(object):
+    def __init__(self):
+        self.datastore = self
+        self.replies = []
+
+    def get_user(self, jid):
+        return FakeUser()
+
+    def reply(self, jid, content):
+        self.replies.append(content)
+
+class SendToTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.patch(accounts, 'time', self.clock)
+        self.patch(accounts, 'reactor', FakeReactor())
+        self.patch(accounts, 'send_to_defaults', TTLCache(100, self.clock))
+        self.patch(accounts, 'responses', ResponseCache(LRUCache(10), {}))
+        self.api = SendToApi()
+
+    def test_cached(self):
+        self.assertEqual(self.api.send_to_default(), 'public')
+        self.api.selected = 'all'
+        self.assertEqual(self.api.send_to_default(), 'public')
+        self.assertEqual(SendToApi().send_to_default(), 'public')
+        self.assertEqual(self.api.requests, 1)
+
+    def test_refresh_before_expiry(self):
+        """
+        A default about to expire is refreshed in the background, while
+        the cached one is returned.
+        """
+        self.api.send_to_default()
+        self.api.selected = 'all'
+        self.clock.now += 79
+        self.assertEqual(self.api.send_to_default(), 'public')
+        self.assertEqual(self.api.requests, 1)
+        self.clock.now += 1
+        self.assertEqual(self.api.send_to_default(), 'public')
+        self.assertEqual(self.api.send_to_default(), 'all')
+        self.assertEqual(self.api.requests, 2)
+
+    def test_expired(self):
+        self.api.send_to_default()
+        self.api.selected = 'all'
+        accounts.send_to_defaults.set('user', ('public', None))
+        self.clock.now += 100
+        self.assertEqual(self.api.send_to_default(), 'all')
+        self.assertEqual(self.api.requests, 2)
+
+    @defer.inlineCallbacks
+    def test_refresh_command(self):
+        """
+        The ``refresh`` command fetches the default from Pownce right
+        away, and it is cached for the following notes.
+        """
+        self.patch(accounts, 'login', lambda username, password: defer.succeed(self.api))
+        self.api.send_to_default()
+        self.api.selected = 'all'
+        message = domish.Element((None, 'message'))
+        message['from'] = 'user@example.com/home'
+        parent = FakeParent()
+        yield commands.refresh(parent, message).deferred
+        self.assertEqual(parent.replies, ["Your notes are sent to all by default."])
+        self.assertEqual(self.api.send_to_default(), 'all')
+        self.assertEqual(self.api.requests, 2)
+
+class AsyncPaginatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fetched = []
+
+    def fetch(self, page):
+        self.fetched.append(page)
+        if page >= 2:
+            return defer.fail(pownce.NotFound("No more notes"))
+        return defer.succeed([page * 2, page * 2 + 1])
+
+    @defer.inlineCallbacks
+    def test_pages(self):
+        """
+        The page after a full one is requested as soon as that one has
+        arrived, and the listing ends when it isn't found.
+        """
+        paginator = accounts.AsyncPaginator(self.fetch, 2)
+        self.assertEqual((yield paginator.next_page()), [0, 1])
+        self.assertEqual(self.fetched, [0, 1])
+        self.assertEqual((yield paginator.next_page()), [2, 3])
+        self.assertEqual((yield paginator.next_page()), None)
+        self.assertEqual((yield paginator.next_page()), None)
+        self.assertEqual(self.fetched, [0, 1, 2])
+
+    def test_not_iterable(self):
+        self.assertRaises(TypeError, iter, accounts.AsyncPaginator(self.fetch, 2))
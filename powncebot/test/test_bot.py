@@ -0,0 +1,89 @@
+from sqlalchemy.orm import clear_mappers
+
+from twisted.python import threadable
+from twisted.trial import unittest
+from twisted.words.protocols.jabber.jid import JID
+from twisted.words.xish import domish
+
+import powncebot
+from powncebot import settings, stats
+
+class FakeReactor(object):
+    def callWhenRunning(self, f, *args, **kwargs):
+        pass
+
+class FakeOutbound(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, obj, key=None):
+        if domish.IElement.providedBy(obj):
+            obj = obj.toXml()
+        self.sent.append(obj)
+
+def make_message(text, sender='user@example.com/home'):
+    message = domish.Element((None, 'message'))
+    message['from'] = sender
+    message['to'] = 'bot@example.com'
+    message['type'] = 'chat'
+    message.addElement('body', content=text)
+    return message
+
+class FastPathTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database_uri = getattr(settings, 'DATABASE_URI', None)
+        settings.DATABASE_URI = 'sqlite://'
+        self.patch(powncebot, 'reactor', FakeReactor())
+        self.patch(threadable, 'isInIOThread', lambda: True)
+        self.patch(stats, 'registry', stats.Registry())
+        self.bot = powncebot.PownceBot(JID('bot@example.com/bot'))
+        self.bot.outbound = FakeOutbound()
+
+    def tearDown(self):
+        self.bot.session.remove()
+        clear_mappers()
+        if self.database_uri is None:
+            del settings.DATABASE_URI
+        else:
+            settings.DATABASE_URI = self.database_uri
+
+    def test_recorded_by_class(self):
+        """
+        The replies sent for an alias are recorded under the name of the
+        command class, like those answered by the class.
+        """
+        self.bot.onMessage(make_message('about'))
+        self.bot.onMessage(make_message('Author:'))
+        self.bot.onMessage(make_message('contact'))
+        self.assertEqual(stats.registry.histograms.keys(), ['command.about'])
+        self.assertEqual(stats.registry.histograms['command.about'].count, 3)
+        self.assertEqual(len(self.bot.outbound.sent), 3)
+        for stanza in self.bot.outbound.sent:
+            self.assertTrue(stanza.startswith("<message to='user@example.com/home'"))
+            self.assertTrue('My creator is jezdez.' in stanza)
+
+    def test_no_parsing(self):
+        """
+        Stateless commands are answered without building a JID.
+        """
+        def JID(jid):
+            raise AssertionError("a JID was built for %s" % jid)
+        self.patch(powncebot, 'JID', JID)
+        for text in ('ping', ' Ping: ', 'ni hao'):
+            self.bot.onMessage(make_message(text))
+        self.assertEqual(len(self.bot.outbound.sent), 3)
+        self.assertEqual(sorted(stats.registry.histograms.keys()),
+                         ['command.greeting', 'command.ping'])
+
+    def test_rate_limited(self):
+        """
+        The fast path is rate limited like the commands, by the bare JID.
+        """
+        self.bot.limiter.rate = 0.001
+        self.bot.limiter.burst = 2
+        self.bot.onMessage(make_message('ping', 'user@example.com/home'))
+        self.bot.onMessage(make_message('ping', 'user@example.com/work'))
+        self.bot.onMessage(make_message('ping', 'user@example.com/home'))
+        self.assertEqual(len(self.bot.outbound.sent), 3)
+        self.assertTrue('Slow down!' in self.bot.outbound.sent[-1])
+        self.assertEqual(stats.registry.histograms['command.ping'].count, 2)
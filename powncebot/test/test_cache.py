@@ -0,0 +1,25 @@
+from twisted.trial import unittest
+
+from powncebot.cache import LRUCache
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')),
+                         (1, None, 3))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_size_zero(self):
+        """
+        A cache of size 0 stores nothing.
+        """
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        cache.set('a', 2, weight=5)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 1, 'evictions': 0,
+                                         'size': 0, 'weight': 0})
@@ -0,0 +1,180 @@
+import time
+import threading
+
+from twisted.internet import defer, reactor, threads
+from twisted.trial import unittest
+
+import powncebot
+from powncebot import settings
+from powncebot.dispatch import Dispatcher, SingleFlight
+
+class DispatcherTestCase(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        self.dispatcher = Dispatcher(2)
+        self.dispatcher.pool.start()
+
+    def tearDown(self):
+        self.dispatcher.pool.stop()
+
+    @defer.inlineCallbacks
+    def test_deferred_result(self):
+        """
+        A Deferred returned in the pool is waited for, and the next call
+        for the key runs after it has fired.
+        """
+        fired = defer.succeed('fired')
+        later = defer.Deferred()
+        first = self.dispatcher.dispatch('jid', lambda: fired)
+        second = self.dispatcher.dispatch('jid', lambda: later)
+        third = self.dispatcher.dispatch('jid', lambda: 'third')
+        self.assertEqual((yield first), 'fired')
+        # wait for the pool thread to hand the second Deferred over
+        yield threads.deferToThread(lambda: None)
+        self.assertFalse(third.called)
+        reactor.callLater(0, later.callback, 'later')
+        self.assertEqual((yield second), 'later')
+        self.assertEqual((yield third), 'third')
+        self.assertEqual(self.dispatcher.pending, {})
+
+    @defer.inlineCallbacks
+    def test_deferred_failure(self):
+        """
+        A failing Deferred returned in the pool fails the dispatched
+        call and frees the key.
+        """
+        d = self.dispatcher.dispatch('jid', lambda: defer.fail(ValueError()))
+        yield self.assertFailure(d, ValueError)
+        self.assertEqual((yield self.dispatcher.dispatch('jid', lambda: 1)), 1)
+        self.assertEqual(self.dispatcher.pending, {})
+
+    @defer.inlineCallbacks
+    def test_inline_callbacks(self):
+        """
+        Commands written with inlineCallbacks return a Deferred which
+        has fired already when run in the pool.
+        """
+        @defer.inlineCallbacks
+        def command():
+            value = yield 1
+            defer.returnValue(value + 1)
+        self.assertEqual((yield self.dispatcher.dispatch('jid', command)), 2)
+        self.assertEqual((yield self.dispatcher.dispatch('jid', command)), 2)
+        self.assertEqual(self.dispatcher.pending, {})
+
+class SingleFlightTestCase(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = []
+
+    def wait_for(self, condition):
+        """
+        Returns a ``Deferred`` firing once ``condition`` is true,
+        checked in a thread.
+        """
+        def wait():
+            while not condition():
+                time.sleep(0.001)
+        return threads.deferToThread(wait)
+
+    @defer.inlineCallbacks
+    def test_call_error(self):
+        """
+        The calls merged into one which fails raise its exception, and
+        the next call runs again.
+        """
+        release = threading.Event()
+        def fail(name):
+            self.calls.append(name)
+            release.wait()
+            raise ValueError(name)
+        first = threads.deferToThread(self.flight.call, 'key', fail, 'first')
+        yield self.wait_for(lambda: self.calls)
+        others = [threads.deferToThread(self.flight.call, 'key', fail, name)
+                  for name in ('second', 'third')]
+        yield self.wait_for(lambda: self.flight.saved == 2)
+        release.set()
+        for d in [first] + others:
+            error = yield self.assertFailure(d, ValueError)
+            self.assertEqual(str(error), 'first')
+        self.assertEqual(self.calls, ['first'])
+        self.assertEqual(self.flight.stats(), {'saved': 2, 'running': 0})
+        self.assertEqual((yield threads.deferToThread(
+            self.flight.call, 'key', lambda: 'again')), 'again')
+
+    @defer.inlineCallbacks
+    def test_call_keys(self):
+        release = threading.Event()
+        def call(name):
+            self.calls.append(name)
+            release.wait()
+            return name
+        first = threads.deferToThread(self.flight.call, 'key', call, 'first')
+        yield self.wait_for(lambda: self.calls)
+        other = threads.deferToThread(self.flight.call, 'other', call, 'other')
+        yield self.wait_for(lambda: len(self.calls) == 2)
+        release.set()
+        self.assertEqual([(yield first), (yield other)], ['first', 'other'])
+        self.assertEqual(self.flight.saved, 0)
+
+    @defer.inlineCallbacks
+    def test_defer_error(self):
+        running = defer.Deferred()
+        def call(name):
+            self.calls.append(name)
+            return running
+        first = self.flight.defer('key', call, 'first')
+        second = self.flight.defer('key', call, 'second')
+        running.errback(ValueError('first'))
+        for d in (first, second):
+            error = yield self.assertFailure(d, ValueError)
+            self.assertEqual(str(error), 'first')
+        self.assertEqual(self.calls, ['first'])
+        self.assertEqual(self.flight.stats(), {'saved': 1, 'running': 0})
+        self.assertEqual((yield self.flight.defer('key', lambda: 'again')), 'again')
+
+    @defer.inlineCallbacks
+    def test_defer_raises(self):
+        """
+        A function raising instead of returning a failing ``Deferred``
+        frees the key too.
+        """
+        def call():
+            raise ValueError()
+        yield self.assertFailure(self.flight.defer('key', call), ValueError)
+        self.assertEqual(self.flight.waiting, {})
+
+class PoolSizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict([(name, getattr(settings, name))
+                           for name in ('DATABASE_URI', 'ASYNC_API', 'COMMAND_THREADS')
+                           if hasattr(settings, name)])
+        settings.ASYNC_API = False
+        settings.COMMAND_THREADS = 3
+
+    def tearDown(self):
+        for name in ('DATABASE_URI', 'ASYNC_API', 'COMMAND_THREADS'):
+            if name in self.saved:
+                setattr(settings, name, self.saved[name])
+            elif hasattr(settings, name):
+                delattr(settings, name)
+
+    def test_file_database(self):
+        settings.DATABASE_URI = 'sqlite:////var/lib/powncebot.db'
+        self.assertEqual(powncebot.pool_size('COMMAND_THREADS', 4), 3)
+
+    def test_in_memory_database(self):
+        """
+        Threads would each get their own in-memory database.
+        """
+        for uri in ('sqlite://', 'sqlite:///:memory:'):
+            settings.DATABASE_URI = uri
+            self.assertEqual(powncebot.pool_size('COMMAND_THREADS', 4), 0)
+
+    def test_async(self):
+        settings.DATABASE_URI = 'sqlite:////var/lib/powncebot.db'
+        settings.ASYNC_API = True
+        self.assertEqual(powncebot.pool_size('COMMAND_THREADS', 4), 0)
@@ -0,0 +1,97 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+from powncebot import outbound
+
+class FakeTransport(object):
+    def __init__(self):
+        self.producer = None
+        self.reading = True
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def pauseProducing(self):
+        self.reading = False
+
+    def resumeProducing(self):
+        self.reading = True
+
+class FakeXmlStream(object):
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.sent = []
+
+    def send(self, element):
+        self.sent.append(element)
+
+class OutboundQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(outbound, 'reactor', self.clock)
+        self.queue = outbound.OutboundQueue(high=50, low=10, batch=5, interval=1,
+                                            clock=self.clock.seconds)
+        self.xmlstream = FakeXmlStream()
+
+    def test_send_right_away(self):
+        """
+        While the transport takes them, stanzas are sent as they come,
+        however many there are.
+        """
+        self.queue.attach(self.xmlstream)
+        for i in xrange(200):
+            self.queue.send(i)
+        self.assertEqual(self.xmlstream.sent, range(200))
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_batches_after_pause(self):
+        """
+        After the transport has asked to pause, the queue is sent in
+        batches until it's empty, and right away again after that.
+        """
+        self.queue.attach(self.xmlstream)
+        self.queue.pauseProducing()
+        for i in xrange(12):
+            self.queue.send(i)
+        self.assertEqual(self.xmlstream.sent, [])
+        self.queue.resumeProducing()
+        self.assertEqual(self.xmlstream.sent, range(5))
+        self.clock.advance(1)
+        self.assertEqual(self.xmlstream.sent, range(10))
+        self.clock.advance(1)
+        self.assertEqual(self.xmlstream.sent, range(12))
+        self.queue.send(12)
+        self.assertEqual(self.xmlstream.sent, range(13))
+
+    def test_high_water(self):
+        """
+        A backlog above ``high`` is sent in batches and pauses reading
+        until it's down to ``low``.
+        """
+        for i in xrange(60):
+            self.queue.send(i)
+        self.queue.attach(self.xmlstream)
+        self.assertEqual(len(self.xmlstream.sent), 5)
+        self.queue.send(60)
+        self.assertFalse(self.xmlstream.transport.reading)
+        self.clock.pump([1] * 10)
+        self.assertEqual(len(self.xmlstream.sent), 55)
+        self.assertTrue(self.xmlstream.transport.reading)
+        self.clock.pump([1] * 2)
+        self.assertEqual(self.xmlstream.sent, range(61))
+
+    def test_coalesce_disconnected(self):
+        """
+        While disconnected, a stanza with the key of a queued one is
+        dropped; once it has been sent the key may be queued again.
+        """
+        self.queue.send('a', 'key')
+        self.queue.send('b', 'key')
+        self.queue.send('c', 'other')
+        self.assertEqual(self.queue.coalesced, 1)
+        self.queue.attach(self.xmlstream)
+        self.assertEqual(self.xmlstream.sent, ['a', 'c'])
+        self.assertEqual(self.queue.keys, {})
+        self.queue.detach()
+        self.queue.send('d', 'key')
+        self.assertEqual(self.queue.keys, {'key': 1})
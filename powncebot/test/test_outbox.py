@@ -0,0 +1,89 @@
+from twisted.internet import defer, threads
+from twisted.trial import unittest
+
+from powncebot import outbox
+from powncebot.accounts import OutboxEntry
+from powncebot.dispatch import Dispatcher
+
+class FakeApi(object):
+    def __init__(self):
+        self.posted = []
+
+    def post_message(self, note_to, body):
+        self.posted.append((note_to, body))
+        return 'note'
+
+class FakeAccounts(object):
+    """
+    Stands in for the accounts module, logging in to a ``FakeApi``.
+    """
+    def __init__(self):
+        self.api = FakeApi()
+
+    @defer.inlineCallbacks
+    def login(self, username, password):
+        defer.returnValue((yield self.api))
+
+    def note_to(self, recipient, api):
+        return defer.succeed('public')
+
+class FakeUser(object):
+    username = 'user'
+    password = 'secret'
+
+class FakeDatastore(object):
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_user(self, jid):
+        return FakeUser()
+
+    def due_notes(self, now, limit=None):
+        return list(self.entries)
+
+    def remove_note(self, entry_id):
+        self.entries = [entry for entry in self.entries if entry.id != entry_id]
+
+class FakeBot(object):
+    shard = None
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+        self.background = Dispatcher(2)
+        self.replies = []
+
+    def owns(self, jid):
+        return True
+
+    def reply(self, jid, content):
+        self.replies.append((jid, content))
+
+class OutboxTestCase(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        self.accounts = outbox.accounts
+        outbox.accounts = FakeAccounts()
+        entry = OutboxEntry('user@example.com', 'message', None, 'Hello')
+        entry.id = 1
+        self.bot = FakeBot(FakeDatastore([entry]))
+        self.bot.background.pool.start()
+        self.outbox = outbox.Outbox(self.bot)
+
+    def tearDown(self):
+        outbox.accounts = self.accounts
+        self.bot.background.pool.stop()
+
+    @defer.inlineCallbacks
+    def test_deliver_in_pool(self):
+        """
+        A note posted in the command pool is removed from the outbox
+        and the user is told.
+        """
+        self.outbox.deliver_due()
+        while self.outbox.inflight:
+            yield threads.deferToThread(lambda: None)
+        self.assertEqual(outbox.accounts.api.posted, [('public', 'Hello')])
+        self.assertEqual(self.bot.datastore.entries, [])
+        self.assertEqual(self.bot.replies,
+                         [('user@example.com', "Your message has been posted.")])
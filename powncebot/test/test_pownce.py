@@ -0,0 +1,467 @@
+import socket
+import httplib
+import datetime
+
+import simplejson
+
+from twisted.trial import unittest
+
+from powncebot import pownce
+from powncebot.cache import LRUCache
+
+def make_note(i):
+    return {'id': i, 'type': 'message', 'body': 'Note {%d} "quoted" \\ [1]' % i,
+            'display_since': 'now', 'permalink': 'http://pownce.com/notes/%d/' % i,
+            'seconds_since': 0, 'timestamp': 1200000000, 'is_public': 1,
+            'num_recipients': 0, 'num_replies': 0,
+            'sender': {'id': 1, 'username': 'user', 'first_name': 'User',
+                       'short_name': 'User', 'permalink': 'http://pownce.com/user/'}}
+
+class ChunkedApi(pownce.Api):
+    """
+    Answers every request with ``document``, in chunks of ``chunk_size``
+    bytes, and the ``response_headers``.
+    """
+    def __init__(self, document, chunk_size, password='secret', response_headers=None):
+        pownce.Api.__init__(self, 'user', password, 'key')
+        self.chunks = [document[i:i + chunk_size]
+                       for i in xrange(0, len(document), chunk_size)]
+        self.response_headers = response_headers or {}
+        self.request_headers = []
+
+    def _stream_response(self, url, postdata=None, user_agent=None, headers=None):
+        self.request_headers.append(headers)
+        return 200, self.response_headers, iter(self.chunks)
+
+class StreamNotesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.document = simplejson.dumps({'notes': [make_note(i) for i in xrange(20)]})
+        self.expected = [(i, 'Note {%d} "quoted" \\ [1]' % i) for i in xrange(20)]
+
+    def stream(self, chunk_size=7):
+        api = ChunkedApi(self.document, chunk_size)
+        url = api._notes_url('user', None, None, None, None, None, None)
+        return [(note.id, note.body) for note in api._stream_notes(url)]
+
+    def test_fetched(self):
+        api = ChunkedApi(self.document, 7)
+        self.assertEqual([(note.id, note.body) for note in api.get_notes('user')],
+                         self.expected)
+
+    def test_streamed(self):
+        """
+        The notes are the same however the document is split up.
+        """
+        for chunk_size in (1, 7, 100, len(self.document)):
+            self.assertEqual(self.stream(chunk_size), self.expected)
+
+    def test_one_at_a_time(self):
+        """
+        A note is yielded as soon as it has arrived.
+        """
+        api = ChunkedApi(self.document, 7)
+        arrived = []
+        chunks = api.chunks
+        def chunk_iter():
+            for chunk in chunks:
+                arrived.append(chunk)
+                yield chunk
+        api._stream_response = lambda *args, **kwargs: (200, {}, chunk_iter())
+        url = api._notes_url('user', None, None, None, None, None, None)
+        first = api._stream_notes(url).next()
+        self.assertEqual(first.id, 0)
+        self.assertTrue(len(arrived) < len(chunks) / 10)
+
+    def test_other_keys(self):
+        self.document = simplejson.dumps({'count': 20, 'notes': [make_note(1)],
+                                          'more': {'page': [1, 2]}})
+        self.assertEqual(self.stream(), [(1, 'Note {1} "quoted" \\ [1]')])
+
+    def test_error(self):
+        """
+        An error document raises ``NotFound``, a document which isn't
+        JSON the error for the status.
+        """
+        self.document = simplejson.dumps({'error': {'status_code': 404,
+                                                    'message': 'Not found'}})
+        self.assertRaises(pownce.NotFound, self.stream)
+        for document in ('<html>Oops</html>', self.document[:-1],
+                         '{"notes": [,]}', '{"notes": []} x'):
+            self.document = document
+            self.assertRaises(pownce.ServerError, self.stream)
+
+class PaginatorStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pages = [[1, 2], [3, 4], [5]]
+        self.fetched = []
+        self.streamed = []
+
+    def fetch(self, page):
+        self.fetched.append(page)
+        return self.pages[page]
+
+    def stream(self, page):
+        self.streamed.append(page)
+        for item in self.pages[page]:
+            yield item
+
+    def test_stream_first_page(self):
+        """
+        The first page is streamed, the following ones are fetched ahead
+        once the page before has turned out full.
+        """
+        paginator = pownce.Paginator(self.fetch, 2, stream=self.stream)
+        self.assertEqual(list(paginator), [1, 2, 3, 4, 5])
+        self.assertEqual(self.streamed, [0])
+        self.assertEqual(self.fetched, [1, 2])
+        self.assertEqual(paginator.since_id, None)
+
+    def test_stream_not_found(self):
+        def stream(page):
+            raise pownce.NotFound("No notes")
+            yield
+        paginator = pownce.Paginator(self.fetch, 2, stream=stream)
+        self.assertEqual(list(paginator), [])
+        self.assertTrue(paginator.done)
+
+class Item(object):
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return '<Item %d>' % self.id
+
+class PaginatorTestCase(unittest.TestCase):
+    def paginate(self, pages, limit=2, since_id=None):
+        """
+        Returns a paginator over ``pages``, lists of item ids; pages
+        beyond them are ``NotFound``, and the ones which are exceptions
+        are raised.
+        """
+        self.fetched = []
+        def fetch(page):
+            self.fetched.append(page)
+            if page >= len(pages):
+                raise pownce.NotFound("No more notes")
+            if isinstance(pages[page], Exception):
+                raise pages[page]
+            return [Item(i) for i in pages[page]]
+        return pownce.Paginator(fetch, limit, since_id)
+
+    def ids(self, paginator):
+        return [item.id for item in paginator]
+
+    def test_short_page(self):
+        """
+        A page with fewer than ``limit`` items is the last one.
+        """
+        paginator = self.paginate([[1, 2], [3, 4], [5]])
+        self.assertEqual(self.ids(paginator), [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(self.fetched), [0, 1, 2])
+
+    def test_full_last_page(self):
+        """
+        After a full last page, the following one is asked for and
+        turns out empty, or not found.
+        """
+        paginator = self.paginate([[1, 2], [3, 4], []])
+        self.assertEqual(self.ids(paginator), [1, 2, 3, 4])
+        self.assertEqual(sorted(self.fetched), [0, 1, 2])
+        paginator = self.paginate([[1, 2], [3, 4]])
+        self.assertEqual(self.ids(paginator), [1, 2, 3, 4])
+        self.assertEqual(sorted(self.fetched), [0, 1, 2])
+        self.assertTrue(paginator.done)
+
+    def test_empty(self):
+        self.assertEqual(self.ids(self.paginate([[]])), [])
+        self.assertEqual(self.ids(self.paginate([])), [])
+        self.assertEqual(self.fetched, [0])
+
+    def test_next_page(self):
+        paginator = self.paginate([[1, 2], [3]])
+        self.assertEqual([item.id for item in paginator.next_page()], [1, 2])
+        self.assertEqual([item.id for item in paginator.next_page()], [3])
+        self.assertEqual(paginator.next_page(), None)
+        self.assertEqual(paginator.page, 2)
+
+    def test_error(self):
+        """
+        An error fetching a page is raised once the pages before it have
+        been consumed.
+        """
+        paginator = self.paginate([[1, 2], pownce.ServerError("Nap")])
+        items = iter(paginator)
+        self.assertEqual([items.next().id, items.next().id], [1, 2])
+        self.assertRaises(pownce.ServerError, items.next)
+
+    def test_since_id(self):
+        paginator = self.paginate([[5, 7], [6]], since_id=3)
+        self.assertEqual(paginator.since_id, 3)
+        self.ids(paginator)
+        self.assertEqual(paginator.since_id, 7)
+        paginator = self.paginate([[1]], since_id=3)
+        self.ids(paginator)
+        self.assertEqual(paginator.since_id, 3)
+
+class ValidatorCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.document = simplejson.dumps({'notes': [make_note(1)]})
+        self.cache = LRUCache(10)
+
+    def get_notes(self, password):
+        api = ChunkedApi(self.document, 100, password, {'etag': '"1"'})
+        api.validator_cache = self.cache
+        api.get_notes('user')
+        return api
+
+    def test_keyed_by_credentials(self):
+        """
+        The validators of a response are only sent with the credentials
+        it was fetched with.
+        """
+        self.get_notes('secret')
+        self.assertEqual(self.get_notes('secret').request_headers,
+                         [{'If-None-Match': '"1"'}])
+        self.assertEqual(self.get_notes('other').request_headers, [{}])
+
+    def test_no_validators(self):
+        api = ChunkedApi(self.document, 100)
+        api.validator_cache = self.cache
+        api.get_notes('user')
+        self.assertEqual(len(self.cache), 0)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+class FakeResponse(object):
+    status = 200
+    will_close = False
+
+    def __init__(self, body):
+        self.body = body
+
+    def getheaders(self):
+        return [('content-type', 'application/json')]
+
+    def read(self, size):
+        chunk, self.body = self.body[:size], self.body[size:]
+        return chunk
+
+class FakeConnection(object):
+    """
+    Answers every request with the number of requests made on it, or
+    raises ``error`` if set.
+    """
+    def __init__(self, host, timeout=None):
+        self.host = host
+        self.requests = 0
+        self.closed = False
+        self.error = None
+
+    def request(self, method, path, body, headers):
+        if self.error is not None:
+            raise self.error
+        self.requests += 1
+
+    def getresponse(self):
+        return FakeResponse(str(self.requests))
+
+    def close(self):
+        self.closed = True
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.patch(pownce, 'time', self.clock)
+        self.patch(httplib, 'HTTPConnection', FakeConnection)
+        self.pool = pownce.ConnectionPool(max_size=1, idle_timeout=30)
+
+    def request(self, host='example.com'):
+        return self.pool.request(host, 'GET', '/')[2]
+
+    def test_reused(self):
+        self.assertEqual([self.request(), self.request(), self.request()],
+                         ['1', '2', '3'])
+        self.assertEqual((self.pool.created, self.pool.reused), (1, 2))
+
+    def test_by_host(self):
+        self.assertEqual([self.request(), self.request('other.com'),
+                          self.request()], ['1', '1', '2'])
+        self.assertEqual((self.pool.created, self.pool.reused), (2, 1))
+
+    def test_max_size(self):
+        """
+        Connections beyond ``max_size`` are closed once they're done.
+        """
+        first, reused = self.pool.get('example.com')
+        second, reused = self.pool.get('example.com')
+        self.pool.put('example.com', first)
+        self.pool.put('example.com', second)
+        self.assertEqual((first.closed, second.closed), (False, True))
+
+    def test_idle_expiry(self):
+        """
+        A connection idle for ``idle_timeout`` seconds is closed and
+        replaced with a new one.
+        """
+        self.request()
+        conn, last_used = self.pool.idle['example.com'][0]
+        self.clock.now += 29
+        self.assertEqual(self.request(), '2')
+        self.clock.now += 30
+        self.assertEqual(self.request(), '1')
+        self.assertTrue(conn.closed)
+        self.assertEqual((self.pool.created, self.pool.reused), (2, 1))
+
+    def test_stale_retried(self):
+        """
+        A GET failing on a reused connection, which the server may have
+        closed, is retried on a new one; other requests aren't.
+        """
+        self.request()
+        conn, last_used = self.pool.idle['example.com'][0]
+        conn.error = socket.error("Connection reset by peer")
+        self.assertEqual(self.request(), '1')
+        self.assertTrue(conn.closed)
+        conn = self.pool.idle['example.com'][0][0]
+        conn.error = socket.error("Connection reset by peer")
+        self.assertRaises(socket.error, self.pool.request, 'example.com', 'POST', '/', 'data')
+        self.assertEqual(self.pool.created, 2)
+
+USER_FIELDS = ('blurb', 'country', 'first_name', 'gender', 'location', 'permalink',
+               'short_name', 'username', 'fan_count', 'fan_of_count',
+               'friend_count', 'max_upload_mb', 'age', 'is_pro', 'profile_photo_urls')
+
+def make_user(username):
+    return {'username': username, 'first_name': 'User', 'short_name': 'User',
+            'permalink': 'http://pownce.com/%s/' % username, 'gender': 'Guy',
+            'fan_count': '3', 'fan_of_count': 4, 'friend_count': 5,
+            'max_upload_mb': '10', 'age': '30', 'is_pro': 0,
+            'profile_photo_urls': {'tiny_photo_url': 'http://pownce.com/t.jpg'}}
+
+def parse_user_eagerly(user_dict):
+    """
+    Returns the attributes ``User.__init__`` set before they were
+    parsed lazily.
+    """
+    attrs = {}
+    for k in USER_FIELDS[:8]:
+        attrs[k] = user_dict.get(k, None)
+    for k in USER_FIELDS[8:12]:
+        try:
+            attrs[k] = long(user_dict[k])
+        except KeyError:
+            attrs[k] = None
+    if user_dict.get('age'):
+        attrs['age'] = int(user_dict['age'])
+    else:
+        attrs['age'] = None
+    attrs['is_pro'] = bool(user_dict['is_pro'])
+    attrs['profile_photo_urls'] = user_dict.get('profile_photo_urls', {})
+    return attrs
+
+def parse_note_eagerly(note_dict):
+    """
+    Returns the attributes ``Note.__init__`` set before they were
+    parsed lazily, with the users as dictionaries of theirs.
+    """
+    attrs = {}
+    for k in ('id', 'num_recipients', 'num_replies', 'seconds_since', 'timestamp'):
+        try:
+            attrs[k] = long(note_dict[k])
+        except KeyError:
+            attrs[k] = None
+    for k in ('body', 'display_since', 'permalink', 'type'):
+        attrs[k] = note_dict[k]
+    attrs['is_public'] = bool(note_dict['is_public'])
+    attrs['seconds_since_delta'] = datetime.timedelta(seconds=attrs['seconds_since'])
+    attrs['sender'] = parse_user_eagerly(note_dict['sender'])
+    attrs['timestamp_parsed'] = datetime.datetime.fromtimestamp(attrs['timestamp'])
+    if 'recipients' in note_dict:
+        attrs['recipients'] = [parse_user_eagerly(user_dict)
+                               for user_dict in note_dict['recipients']]
+    else:
+        attrs['recipients'] = None
+    return attrs
+
+def user_attrs(user):
+    return dict([(k, getattr(user, k)) for k in USER_FIELDS])
+
+def note_attrs(note):
+    attrs = {}
+    for k in ('id', 'num_recipients', 'num_replies', 'seconds_since', 'timestamp',
+              'body', 'display_since', 'permalink', 'type', 'is_public',
+              'seconds_since_delta', 'timestamp_parsed'):
+        attrs[k] = getattr(note, k)
+    attrs['sender'] = user_attrs(note.sender)
+    attrs['recipients'] = note.recipients
+    if attrs['recipients'] is not None:
+        attrs['recipients'] = [user_attrs(user) for user in attrs['recipients']]
+    return attrs
+
+class LazyModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.note_dict = make_note(1)
+        self.note_dict.update({'sender': make_user('user'), 'stars': '4.5',
+                               'recipients': [make_user('friend'), {'is_pro': 1}],
+                               'replies': [{'id': '2', 'body': 'Reply', 'seconds_since': 5,
+                                            'timestamp': 1200000005, 'display_since': 'now',
+                                            'sender': make_user('friend')}]})
+
+    def test_note(self):
+        """
+        A note has the attributes it had when it was parsed eagerly.
+        """
+        self.assertEqual(note_attrs(pownce.Message(self.note_dict)),
+                         parse_note_eagerly(self.note_dict))
+        del self.note_dict['recipients']
+        del self.note_dict['num_replies']
+        self.assertEqual(note_attrs(pownce.Message(self.note_dict)),
+                         parse_note_eagerly(self.note_dict))
+
+    def test_stars(self):
+        self.assertEqual(pownce.Message(self.note_dict).stars, 4.5)
+        del self.note_dict['stars']
+        self.assertEqual(pownce.Message(self.note_dict).stars, None)
+
+    def test_user(self):
+        user_dict = make_user('user')
+        self.assertEqual(user_attrs(pownce.User(user_dict)), parse_user_eagerly(user_dict))
+        user_dict = {'username': 'user', 'age': '', 'is_pro': 1}
+        self.assertEqual(user_attrs(pownce.User(user_dict)), parse_user_eagerly(user_dict))
+
+    def test_replies(self):
+        note = pownce.Message(self.note_dict)
+        reply = note.replies[0]
+        self.assertEqual((reply.id, reply.body, reply.type, reply.sender.username),
+                         (2L, 'Reply', 'reply', 'friend'))
+        self.assertTrue(reply.parent is note)
+        self.assertEqual(reply.timestamp_parsed,
+                         datetime.datetime.fromtimestamp(1200000005))
+
+    def test_other_types(self):
+        self.note_dict.update({'link': {'url': 'http://example.com/'},
+                               'event': {'name': 'Party', 'location': 'Home',
+                                         'date': '2008-01-01 20:00:00'},
+                               'file': {'name': 'photo.jpg', 'type': 'image'}})
+        self.assertEqual(pownce.Link(self.note_dict).link, 'http://example.com/')
+        event = pownce.Event(self.note_dict).event
+        self.assertEqual((event.name, event.location), ('Party', 'Home'))
+        self.assertEqual(pownce.File(self.note_dict).file_details.file_type, 'image')
+
+    def test_lazy(self):
+        """
+        Nothing is parsed before it's used, and only once.
+        """
+        note = pownce.Message({'id': '1'})
+        self.assertEqual(note.id, 1L)
+        self.assertRaises(KeyError, getattr, note, 'sender')
+        note = pownce.Message(self.note_dict)
+        self.assertFalse(hasattr(note, '__dict__'))
+        self.assertRaises(AttributeError, getattr, note, '_sender')
+        self.assertTrue(note.sender is note.sender)
+        self.assertTrue(note.recipients is note.recipients)
@@ -0,0 +1,63 @@
+import os
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from powncebot import commands, profiler
+
+class FailingProfile(object):
+    def enable(self):
+        raise RuntimeError("Another profiler is active")
+
+class FakeBot(object):
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.replies = []
+
+    def reply(self, jid, content):
+        self.replies.append(content)
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(profiler, 'reactor', self.clock)
+        self.profiler = profiler.Profiler(self.mktemp())
+
+    def test_profile(self):
+        os.mkdir(self.profiler.directory)
+        d = self.profiler.start(10)
+        self.assertTrue(self.profiler.running())
+        self.clock.advance(10)
+        self.assertFalse(self.profiler.running())
+        def profiled((path, hottest)):
+            self.assertTrue(os.path.exists(path))
+        return d.addCallback(profiled)
+
+    def test_no_seconds(self):
+        """
+        A profile of no or negative seconds is refused without starting.
+        """
+        for seconds in (0, -5):
+            d = self.profiler.start(seconds)
+            self.assertFailure(d, ValueError)
+            self.assertFalse(self.profiler.running())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_enable_fails(self):
+        """
+        If the profile can't be enabled, nothing is left running.
+        """
+        self.patch(profiler.cProfile, 'Profile', FailingProfile)
+        d = self.profiler.start(10)
+        self.assertFailure(d, RuntimeError)
+        self.assertFalse(self.profiler.running())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        return d
+
+    def test_command_no_seconds(self):
+        bot = FakeBot(self.profiler)
+        message = {'from': 'admin@example.com/home'}
+        commands.profile(bot, message, '-5')
+        commands.profile(bot, message, '0')
+        self.assertEqual(bot.replies, ["Usage: profile [SECONDS]"] * 2)
+        self.assertFalse(self.profiler.running())
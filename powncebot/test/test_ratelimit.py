@@ -0,0 +1,53 @@
+from twisted.trial import unittest
+
+from powncebot.ratelimit import RateLimiter
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_global_rejection_keeps_key_token(self):
+        """
+        A request turned away by the global limit doesn't use up a token
+        of its key.
+        """
+        limiter = RateLimiter(1, 1, 1, 1, self.clock)
+        self.assertTrue(limiter.allow('a'))
+        self.assertFalse(limiter.allow('b'))
+        self.assertEqual(limiter.rejected_global, 1)
+        self.clock.now += 1
+        self.assertTrue(limiter.allow('b'))
+
+    def test_key_rejection_keeps_global_token(self):
+        limiter = RateLimiter(1, 1, 1, 2, self.clock)
+        self.assertTrue(limiter.allow('a'))
+        self.assertFalse(limiter.allow('a'))
+        self.assertEqual(limiter.rejected, 1)
+        self.assertTrue(limiter.allow('b'))
+
+    def test_throttle(self):
+        """
+        A rejected key is told once, again after ``THROTTLE_TIME`` or
+        once it has been admitted in between.
+        """
+        limiter = RateLimiter(1, 1, clock=self.clock)
+        self.assertTrue(limiter.throttle('a'))
+        self.assertFalse(limiter.throttle('a'))
+        self.clock.now += limiter.THROTTLE_TIME
+        self.assertTrue(limiter.throttle('a'))
+        self.assertTrue(limiter.allow('a'))
+        self.assertTrue(limiter.throttle('a'))
+
+    def test_prune_throttled(self):
+        limiter = RateLimiter(1, 1, clock=self.clock)
+        limiter.throttle('a')
+        self.clock.now += limiter.THROTTLE_TIME
+        limiter.prune()
+        self.assertEqual(limiter.stats()['throttled'], 0)
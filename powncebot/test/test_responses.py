@@ -0,0 +1,100 @@
+import simplejson
+
+from twisted.trial import unittest
+
+from powncebot import accounts
+from powncebot.cache import LRUCache, SQLiteCache
+from powncebot.responses import ResponseCache
+from powncebot.test.test_pownce import make_note
+
+USER_URL = 'http://api.pownce.com/2.0/users/user.json'
+TTLS = {'user': 300}
+
+class FakeApi(accounts.Api):
+    """
+    Answers the user, send_to and posting endpoints, and counts the
+    requests for the user.
+    """
+    validator_cache = None
+
+    def __init__(self):
+        accounts.Api.__init__(self, 'user', 'secret', 'key')
+        self.user_requests = 0
+
+    def _send_request(self, url, postdata, user_agent, headers):
+        if '/send/send_to.json' in url:
+            document = {'selected': 'all'}
+        elif '/send/' in url:
+            document = make_note(1)
+        else:
+            self.user_requests += 1
+            document = {'username': 'user', 'requests': self.user_requests}
+        return 200, {}, simplejson.dumps(document)
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def test_cached(self):
+        cache = ResponseCache(LRUCache(10), TTLS)
+        cache.set('auth', USER_URL, 'user', {'username': 'user'})
+        self.assertEqual(cache.get('auth', USER_URL), {'username': 'user'})
+        self.assertEqual(cache.get('other', USER_URL), None)
+        cache.invalidate('auth')
+        self.assertEqual(cache.get('auth', USER_URL), None)
+
+    def test_endpoint(self):
+        cache = ResponseCache(LRUCache(10), {'user': 300, 'note': 60, 'related_users': 0})
+        base = 'http://api.pownce.com/2.0/'
+        self.assertEqual(cache.endpoint(base + 'users/user.json?app_key=key'), 'user')
+        self.assertEqual(cache.endpoint(base + 'notes/12.json'), 'note')
+        self.assertEqual(cache.endpoint(base + 'notes/12/recipients.json'), None)
+        self.assertEqual(cache.endpoint(base + 'users/user/friends.json'), None)
+        self.assertEqual(cache.endpoint(base + 'note_lists/user.json'), None)
+
+    def test_stats(self):
+        cache = ResponseCache(LRUCache(10), TTLS)
+        cache.set('auth', USER_URL, 'user', {'username': 'user'})
+        cache.get('auth', USER_URL)
+        cache.get('auth', USER_URL)
+        cache.get('auth', USER_URL + '?page=1')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['bytes_saved']),
+                         (2, 1, 2 * len('{"username": "user"}')))
+        self.assertAlmostEqual(stats['hit_ratio'], 2 / 3.0)
+
+    def test_shared_backend(self):
+        """
+        An invalidation is seen by the other processes sharing an
+        ``SQLiteCache``, and after a restart.
+        """
+        path = self.mktemp()
+        cache = ResponseCache(SQLiteCache(path, 10), TTLS)
+        other = ResponseCache(SQLiteCache(path, 10), TTLS)
+        cache.set('auth', USER_URL, 'user', {'username': 'user'})
+        self.assertEqual(other.get('auth', USER_URL), {'username': 'user'})
+        other.invalidate('auth')
+        self.assertEqual(cache.get('auth', USER_URL), None)
+        cache.set('auth', USER_URL, 'user', {'username': 'new'})
+        restarted = ResponseCache(SQLiteCache(path, 10), TTLS)
+        self.assertEqual(restarted.get('auth', USER_URL), {'username': 'new'})
+
+class InvalidationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.patch(accounts, 'responses', ResponseCache(LRUCache(10), TTLS))
+        self.api = FakeApi()
+
+    def get_user(self):
+        return self.api._fetch_json(USER_URL)['requests']
+
+    def assertInvalidated(self, write):
+        self.assertEqual((self.get_user(), self.get_user()), (1, 1))
+        write()
+        self.assertEqual(self.get_user(), 2)
+
+    def test_message(self):
+        self.assertInvalidated(lambda: self.api.post_message('all', 'Hello'))
+
+    def test_link(self):
+        self.assertInvalidated(
+            lambda: self.api.post_link('all', 'http://example.com/', 'Look'))
+
+    def test_refresh(self):
+        self.assertInvalidated(lambda: self.api.send_to_default(refresh=True))
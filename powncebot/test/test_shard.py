@@ -0,0 +1,76 @@
+from twisted.trial import unittest
+
+from powncebot.shard import HashRing, Shard
+
+JIDS = ['user%d@example.com' % i for i in xrange(10000)]
+
+class HashRingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ring = HashRing(['worker-0', 'worker-1', 'worker-2', 'worker-3'])
+
+    def assignments(self):
+        return dict([(jid, self.ring.node(jid)) for jid in JIDS])
+
+    def test_empty(self):
+        self.assertEqual(HashRing().node('user@example.com'), None)
+        self.assertEqual(HashRing().shares(), {})
+
+    def test_stable(self):
+        """
+        Every process maps a JID to the same node.
+        """
+        other = HashRing(['worker-3', 'worker-2', 'worker-1', 'worker-0'])
+        self.assertEqual(dict([(jid, other.node(jid)) for jid in JIDS]),
+                         self.assignments())
+        self.assertEqual(self.ring.node(u'user1@example.com'),
+                         self.ring.node('user1@example.com'))
+
+    def test_distribution(self):
+        """
+        The JIDs are spread about evenly, as ``shares`` says.
+        """
+        counts = {}
+        for node in self.assignments().values():
+            counts[node] = counts.get(node, 0) + 1
+        shares = self.ring.shares()
+        self.assertAlmostEqual(sum(shares.values()), 1.0)
+        for node in self.ring.nodes:
+            share = counts[node] / float(len(JIDS))
+            self.assertTrue(0.15 < share < 0.35, (node, share))
+            self.assertTrue(abs(share - shares[node]) < 0.03, (node, share, shares[node]))
+
+    def test_add(self):
+        """
+        A new node only takes JIDs from the others, about its share.
+        """
+        before = self.assignments()
+        self.ring.add('worker-4')
+        self.ring.add('worker-4')
+        self.assertEqual(len(self.ring.points), 5 * self.ring.replicas)
+        after = self.assignments()
+        moved = [jid for jid in JIDS if after[jid] != before[jid]]
+        self.assertEqual(set([after[jid] for jid in moved]), set(['worker-4']))
+        self.assertTrue(0.1 < len(moved) / float(len(JIDS)) < 0.3)
+
+    def test_remove(self):
+        """
+        Only the JIDs of a removed node move.
+        """
+        before = self.assignments()
+        self.ring.remove('worker-1')
+        self.ring.remove('worker-1')
+        after = self.assignments()
+        for jid in JIDS:
+            if before[jid] == 'worker-1':
+                self.assertNotEqual(after[jid], 'worker-1')
+            else:
+                self.assertEqual(after[jid], before[jid])
+
+    def test_shards(self):
+        """
+        Every JID is owned by exactly one worker.
+        """
+        shards = [Shard(self.ring, node) for node in sorted(self.ring.nodes)]
+        for jid in JIDS[:1000]:
+            self.assertEqual(len([shard for shard in shards if shard.owns(jid)]), 1)
+        self.assertEqual(shards[0].size(), 4)
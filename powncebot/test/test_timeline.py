@@ -0,0 +1,111 @@
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from powncebot import timeline
+
+class FakeSender(object):
+    def __init__(self, username):
+        self.username = username
+
+class FakeNote(object):
+    def __init__(self, id, username):
+        self.id = id
+        self.sender = FakeSender(username)
+        self.body = 'Note %d' % id
+
+class FakeApi(object):
+    def __init__(self, notes):
+        self.notes = notes
+        self.requests = []
+
+    def get_notes(self, username, limit=None):
+        self.requests.append(('get_notes', username, limit))
+        return defer.succeed(self.notes[:limit])
+
+    def iter_notes(self, username, **kwargs):
+        raise AssertionError("a paginator is used for the watermark")
+
+class FakeAccounts(object):
+    def __init__(self, api):
+        self.api = api
+
+    def login(self, username, password):
+        return defer.succeed(self.api)
+
+class FakeUser(object):
+    jid = 'user@example.com'
+    username = 'user'
+    password = 'secret'
+    since_id = None
+
+class FakeDatastore(object):
+    def __init__(self):
+        self.since_ids = {}
+
+    def set_since_id(self, jid, since_id):
+        self.since_ids[jid] = since_id
+
+class FakeBot(object):
+    def __init__(self):
+        self.datastore = FakeDatastore()
+        self.replies = []
+
+    def reply(self, jid, content):
+        self.replies.append((jid, content))
+
+class TimelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.accounts = timeline.accounts
+        self.bot = FakeBot()
+        self.timeline = timeline.Timeline(self.bot, catch_up=2)
+        self.user = FakeUser()
+
+    def tearDown(self):
+        timeline.accounts = self.accounts
+
+    @defer.inlineCallbacks
+    def test_first_poll_single_page(self):
+        """
+        The first poll sets the watermark from a single one-note page.
+        """
+        api = FakeApi([FakeNote(7, 'other'), FakeNote(6, 'other')])
+        timeline.accounts = FakeAccounts(api)
+        new = yield self.timeline.poll(self.user)
+        self.assertEqual(new, 0)
+        self.assertEqual(api.requests, [('get_notes', 'user', 1)])
+        self.assertEqual(self.bot.datastore.since_ids, {'user@example.com': 7})
+        self.assertEqual(self.bot.replies, [])
+
+    def test_push_more_few_left(self):
+        """
+        With more notes to come but fewer than ``catch_up`` from others
+        on the page, nothing is counted as skipped.
+        """
+        notes = [FakeNote(1, 'user'), FakeNote(2, 'other'), FakeNote(3, 'user')]
+        self.timeline.push(self.user, notes, more=True)
+        self.assertEqual(self.timeline.skipped, 0)
+        self.assertEqual(self.bot.replies, [
+            ('user@example.com',
+             "You have more than 1 new notes, here are the latest 1."),
+            ('user@example.com', "other: Note 2")])
+
+    def test_push_only_own_notes(self):
+        """
+        No summary is sent when all the notes are the user's own.
+        """
+        notes = [FakeNote(1, 'user'), FakeNote(2, 'user')]
+        self.assertEqual(self.timeline.push(self.user, notes, more=True), 0)
+        self.assertEqual(self.timeline.skipped, 0)
+        self.assertEqual(self.bot.replies, [])
+
+    def test_push_skipped(self):
+        """
+        Beyond ``catch_up`` notes only the newest are sent.
+        """
+        notes = [FakeNote(3, 'other'), FakeNote(2, 'other'), FakeNote(1, 'other')]
+        self.timeline.push(self.user, notes)
+        self.assertEqual(self.timeline.skipped, 1)
+        self.assertEqual(self.bot.replies, [
+            ('user@example.com', "You have 3 new notes, here are the latest 2."),
+            ('user@example.com', "other: Note 2"),
+            ('user@example.com', "other: Note 3")])
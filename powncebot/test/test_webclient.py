@@ -0,0 +1,106 @@
+import socket
+import mimetypes
+
+from twisted.internet import error
+from twisted.python import failure
+from twisted.test import proto_helpers
+from twisted.trial import unittest
+
+from powncebot import pownce, webclient
+
+def encode(fields, boundary):
+    """
+    Encodes ``fields`` in memory, the way ``Api._encode_postdata`` did
+    before ``MultipartBody``.
+    """
+    data = []
+    for (key, value) in fields:
+        if isinstance(value, tuple):
+            (f, filename) = value
+            mime = mimetypes.guess_type(filename)[0]
+            if mime is None:
+                mime = 'application/octet-stream'
+            data.append('--%s\r\nContent-Disposition: form-data; ' % boundary)
+            data.append('name="%s"; filename="%s"\r\n' % (key, filename))
+            data.append('Content-Type: %s\r\n\r\n' % mime)
+            data.append('%s\r\n' % f.read())
+        else:
+            data.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (boundary, key, value))
+    data.append('--%s--\r\n\r\n' % boundary)
+    return ''.join(data)
+
+class FakeReactor(object):
+    def connectTCP(self, host, port, factory):
+        self.factory = factory
+
+class FailingPool(object):
+    def request(self, host, method, path, body=None, headers={}):
+        raise socket.error("Connection reset by peer")
+
+class MultipartBodyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        # more than a chunk, so the file is sent in several
+        f = open(self.path, 'wb')
+        f.write(''.join([chr(i % 256) for i in xrange(100000)]))
+        f.close()
+
+    def fields(self):
+        return [('note_to', 'all'), ('note_body', 'A file'),
+                ('media_file', (open(self.path, 'rb'), 'photo.jpg'))]
+
+    def test_iterated(self):
+        body = pownce.MultipartBody(self.fields(), 'BOUNDARY')
+        streamed = ''.join(body)
+        self.assertEqual(streamed, encode(self.fields(), 'BOUNDARY'))
+        self.assertEqual(len(streamed), body.length)
+
+    def test_written(self):
+        """
+        ``write_body`` writes the same bytes to a consumer, and
+        ``StreamingPageGetter`` sends them after the headers.
+        """
+        body = pownce.MultipartBody(self.fields(), 'BOUNDARY')
+        factory = webclient.StreamingClientFactory('http://example.com/send', body,
+                                                   method='POST')
+        protocol = factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        while transport.producer is not None:
+            transport.producer.resumeProducing()
+        head, sent = transport.value().split('\r\n\r\n', 1)
+        self.assertEqual(sent, encode(self.fields(), 'BOUNDARY'))
+        head = head.split('\r\n')
+        self.assertTrue('Host: example.com' in head)
+        self.assertTrue('Content-Length: %d' % body.length in head)
+
+    def test_host_port(self):
+        body = pownce.MultipartBody([('note_to', 'all')])
+        factory = webclient.StreamingClientFactory('http://localhost:8080/send',
+                                                   body, method='POST')
+        protocol = factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        self.assertTrue('Host: localhost:8080' in transport.value().split('\r\n'))
+
+    def test_closed_async(self):
+        """
+        The file is closed when the connection fails.
+        """
+        fields = self.fields()
+        fake = FakeReactor()
+        self.patch(webclient, 'reactor', fake)
+        d = webclient.fetch('http://example.com/send', 'POST',
+                            pownce.MultipartBody(fields))
+        fake.factory.clientConnectionFailed(
+            None, failure.Failure(error.ConnectionRefusedError()))
+        self.assertTrue(fields[2][1][0].closed)
+        return self.assertFailure(d, error.ConnectionRefusedError)
+
+    def test_closed_blocking(self):
+        api = pownce.Api('user', 'secret', 'key')
+        api.connection_pool = FailingPool()
+        f = open(self.path, 'rb')
+        self.assertRaises(socket.error, api._fetch_response, 'http://example.com/send',
+                          {'note_to': 'all', 'media_file': (f, 'photo.jpg')})
+        self.assertTrue(f.closed)
@@ -0,0 +1,315 @@
+import time
+import heapq
+import random
+
+from twisted.internet import defer, task
+from twisted.python import log
+
+from powncebot import accounts
+from powncebot.ratelimit import TokenBucket
+from pownce import AuthenticationRequired, NotFound, Link, Event, File
+
+class PollState(object):
+    """
+    The polling state of one user.
+
+    ``interval`` follows the user's note rate: it moves towards the
+    time per note seen by a poll with new notes, and doubles after
+    every poll without any. ``available`` is the user's XMPP presence,
+    ``None`` while it is unknown, and ``active_until`` the end of the
+    conversation the user is having with the bot.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.available = None
+        self.active_until = 0
+        self.polled = None
+        self.due = None
+        self.polls = 0
+        self.notes = 0
+
+class Timeline(object):
+    """
+    Pushes the new notes of every registered user to their JID.
+
+    Each user's note list is polled at an interval adapting to the
+    user's activity, between ``min_interval`` and ``max_interval``
+    seconds and starting at ``interval``; see ``PollState``. Users
+    talking to the bot are polled every ``min_interval``, offline users
+    every ``max_interval`` seconds. Every interval varies by ``jitter``
+    (a fraction of the interval).
+
+    At most ``concurrency`` polls run at once and, if ``budget`` is
+    set, at most ``budget`` polls are started per minute; due polls
+    wait for their turn. The budget counts polls, not API requests: a
+    poll usually makes one request, but a full page of new notes also
+    makes the paginator fetch the next one.
+
+    The id of the newest note seen is stored with the user, so no note
+    is sent twice across restarts. A user's first poll only sets that
+    watermark. When more than ``catch_up`` notes have piled up, for
+    example after the bot has been down, only the newest ``catch_up``
+    are sent together with a note about the ones skipped.
+    """
+    # seconds between looking for due polls, and ticks between looking
+    # for newly registered users
+    TICK = 1
+    NEW_USERS_TICKS = 10
+    # notes fetched per poll
+    PAGE_SIZE = 20
+    # seconds a conversation with the bot keeps a user active
+    ACTIVE_TIME = 600
+
+    def __init__(self, bot, interval=300, concurrency=4, jitter=0.2, catch_up=5,
+                 min_interval=30, max_interval=3600, budget=0):
+        self.bot = bot
+        self.datastore = bot.datastore
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.semaphore = defer.DeferredSemaphore(concurrency)
+        self.budget = budget
+        self.bucket = None
+        if budget:
+            self.bucket = TokenBucket(budget / 60.0, max(1, budget / 10))
+        # (time, jid) of the polls to come; entries whose time isn't
+        # the user's due time anymore are skipped
+        self.schedule = []
+        self.states = {}
+        self.inflight = set()
+        self.loop = task.LoopingCall(self.poll_due)
+        self.ticks = 0
+        self.polls = 0
+        self.pushed = 0
+        self.skipped = 0
+        self.errors = 0
+        # polls started in the current and the last minute
+        self.minute = int(time.time() / 60)
+        self.minute_polls = 0
+        self.last_minute_polls = 0
+
+    def start(self):
+        # spread the first polls over a whole interval, so a restart
+        # doesn't make everybody poll at once
+        self.schedule_new(spread=self.interval)
+        self.loop.start(self.TICK)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def next_poll(self, jid, delay):
+        """
+        Schedules the next poll for ``jid`` in ``delay`` seconds,
+        replacing the one scheduled before.
+        """
+        state = self.states.get(jid)
+        if state is None:
+            state = self.states[jid] = PollState(self.interval)
+        state.due = time.time() + delay
+        heapq.heappush(self.schedule, (state.due, jid))
+
+    def poll_soon(self, jid):
+        """
+        Moves the next poll for ``jid`` forward to ``min_interval``
+        seconds from now at the latest.
+        """
+        state = self.states.get(jid)
+        if (state is not None and state.due is not None and
+                state.due > time.time() + self.min_interval):
+            self.next_poll(jid, self.min_interval)
+
+    def jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def delay(self, state):
+        """
+        Returns the seconds until the next poll of a user.
+        """
+        if state.active_until > time.time():
+            return self.jittered(self.min_interval)
+        if state.available is False:
+            return self.jittered(self.max_interval)
+        return self.jittered(state.interval)
+
+    def adapt(self, state, notes):
+        """
+        Adapts a user's interval to a poll which found ``notes`` new
+        notes.
+        """
+        now = time.time()
+        if notes and state.polled is not None:
+            per_note = (now - state.polled) / notes
+            state.interval = (state.interval + per_note) / 2.0
+        elif not notes:
+            state.interval *= 2
+        state.interval = min(self.max_interval, max(self.min_interval, state.interval))
+        state.polled = now
+
+    def active(self, jid):
+        """
+        Called when ``jid`` talks to the bot.
+        """
+        state = self.states.get(jid)
+        if state is not None:
+            state.active_until = time.time() + self.ACTIVE_TIME
+            self.poll_soon(jid)
+
+    def presence(self, jid, available):
+        """
+        Called when the presence of ``jid`` changes.
+        """
+        state = self.states.get(jid)
+        if state is None and jid in self.datastore.users and self.bot.owns(jid):
+            # not scheduled yet, see schedule_new
+            state = self.states[jid] = PollState(self.interval)
+        if state is not None:
+            came_back = available and state.available is False
+            state.available = available
+            if came_back:
+                self.poll_soon(jid)
+
+    def schedule_new(self, spread=0):
+        """
+        Schedules the users registered since the last call, within
+        ``spread`` seconds from now, and forgets the unregistered ones
+        and those the bot isn't responsible for anymore.
+        """
+        users = self.datastore.users
+        for jid in users.keys():
+            if not self.bot.owns(jid):
+                continue
+            state = self.states.get(jid)
+            if state is None or (state.due is None and jid not in self.inflight):
+                self.next_poll(jid, random.uniform(0, spread))
+        for jid in self.states.keys():
+            if jid not in users or not self.bot.owns(jid):
+                del self.states[jid]
+
+    def poll_due(self):
+        """
+        Starts the polls which are due, as far as the budget allows.
+        """
+        now = time.time()
+        self.ticks += 1
+        if self.ticks % self.NEW_USERS_TICKS == 0:
+            self.schedule_new()
+        minute = int(now / 60)
+        if minute != self.minute:
+            if minute == self.minute + 1:
+                self.last_minute_polls = self.minute_polls
+            else:
+                self.last_minute_polls = 0
+            self.minute = minute
+            self.minute_polls = 0
+        while self.schedule and self.schedule[0][0] <= now:
+            due, jid = self.schedule[0]
+            state = self.states.get(jid)
+            if state is None or state.due != due or jid in self.inflight:
+                heapq.heappop(self.schedule)
+                continue
+            if self.bucket is not None and not self.bucket.consume():
+                break
+            heapq.heappop(self.schedule)
+            state.due = None
+            user = self.datastore.users.get(jid)
+            if user is None:
+                continue
+            self.inflight.add(jid)
+            self.minute_polls += 1
+            d = self.semaphore.run(self.bot.background.dispatch, jid, self.poll, user)
+            d.addErrback(self.poll_failed, user)
+            d.addErrback(log.err)
+            d.addBoth(self.done, jid)
+
+    @defer.inlineCallbacks
+    def poll(self, user):
+        """
+        Fetches the notes ``user`` hasn't seen yet and sends them, the
+        oldest first. Returns the number of new notes.
+        """
+        self.polls += 1
+        api = yield accounts.login(user.username, user.password)
+        if user.since_id is None:
+            # only the newest note is needed for the watermark, so the
+            # page is fetched without a paginator prefetching the next
+            try:
+                notes = yield api.get_notes(user.username, limit=1)
+            except NotFound:
+                notes = []
+            if notes:
+                self.datastore.set_since_id(user.jid, max([note.id for note in notes]))
+            defer.returnValue(0)
+        paginator = api.iter_notes(user.username, since_id=user.since_id,
+                                   limit=self.PAGE_SIZE)
+        notes = yield paginator.next_page()
+        new = 0
+        if notes:
+            new = self.push(user, notes, more=not paginator.done)
+        if paginator.since_id != user.since_id:
+            self.datastore.set_since_id(user.jid, paginator.since_id)
+        defer.returnValue(new)
+
+    def push(self, user, notes, more=False):
+        """
+        Sends ``notes`` to ``user``, or the newest of them if there are
+        too many. Returns the number of notes from others.
+        """
+        notes = [note for note in notes if note.sender.username != user.username]
+        count = len(notes)
+        notes.sort(key=lambda note: note.id)
+        skipped = max(0, count - self.catch_up)
+        notes = notes[-self.catch_up:]
+        self.skipped += skipped
+        if notes and (more or skipped):
+            if more:
+                summary = "You have more than %d new notes, here are the latest %d."
+            else:
+                summary = "You have %d new notes, here are the latest %d."
+            self.bot.reply(user.jid, summary % (count, len(notes)))
+        for note in notes:
+            self.pushed += 1
+            self.bot.reply(user.jid, format_note(note))
+        return count
+
+    def poll_failed(self, failure, user):
+        self.errors += 1
+        if failure.check(AuthenticationRequired):
+            accounts.logout(user.username, user.password)
+            log.msg("TIMELINE: credentials of %s do not work" % user.jid)
+        else:
+            log.msg("TIMELINE: polling %s failed: %s" % (
+                user.jid, failure.getErrorMessage()))
+
+    def done(self, notes, jid):
+        self.inflight.discard(jid)
+        state = self.states.get(jid)
+        if state is None:
+            return
+        state.polls += 1
+        state.notes += notes or 0
+        self.adapt(state, notes or 0)
+        if state.due is None:
+            self.next_poll(jid, self.delay(state))
+
+    def stats(self):
+        return {'users': len(self.states), 'inflight': len(self.inflight),
+                'polls': self.polls, 'pushed': self.pushed,
+                'skipped': self.skipped, 'errors': self.errors,
+                'budget': self.budget, 'polls_last_minute': self.last_minute_polls,
+                'polls_this_minute': self.minute_polls}
+
+def format_note(note):
+    """
+    Returns the text a note is pushed as.
+    """
+    text = "%s: %s" % (note.sender.username, note.body)
+    if isinstance(note, Link):
+        text = "%s %s" % (text, note.link)
+    elif isinstance(note, Event):
+        text = "%s (%s)" % (text, note.event)
+    elif isinstance(note, File):
+        text = "%s [%s]" % (text, note.file_details.url)
+    return text
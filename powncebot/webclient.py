@@ -0,0 +1,113 @@
+import urlparse
+
+from twisted.internet import defer, reactor
+from twisted.protocols import basic
+from twisted.web import client, error
+
+# connections opened by fetch
+connections = 0
+
+class StreamingPageGetter(client.HTTPPageGetter):
+    """
+    A page getter which streams a request body like
+    ``pownce.MultipartBody`` to the server, with the files being read
+    only as fast as the connection takes them.
+    """
+    def connectionMade(self):
+        body = self.factory.body
+        self.sendCommand(self.factory.method, self.factory.path)
+        host = self.factory.host
+        if self.factory.port != 80:
+            host = '%s:%d' % (host, self.factory.port)
+        self.sendHeader('Host', self.factory.headers.get('host', host))
+        self.sendHeader('User-Agent', self.factory.agent)
+        self.sendHeader('Content-Length', str(body.length))
+        for (key, value) in self.factory.headers.items():
+            if key.lower() not in ('host', 'content-length'):
+                self.sendHeader(key, value)
+        self.endHeaders()
+        self.headers = {}
+        write_body(body, self.transport).addErrback(self.bodyFailed)
+
+    def bodyFailed(self, failure):
+        self.factory.noPage(failure)
+        self.transport.loseConnection()
+
+class StreamingClientFactory(client.HTTPClientFactory):
+    protocol = StreamingPageGetter
+
+    def __init__(self, url, body, **kwargs):
+        client.HTTPClientFactory.__init__(self, url, **kwargs)
+        self.body = body
+
+def write_body(body, consumer):
+    """
+    Writes the parts of a streamed body to ``consumer``, sending files
+    with a ``FileSender``. Returns a ``Deferred`` firing when done.
+    """
+    parts = iter(body.parts)
+
+    def write_parts(ignored=None):
+        for part in parts:
+            if isinstance(part, str):
+                consumer.write(part)
+            else:
+                sender = basic.FileSender()
+                d = sender.beginFileTransfer(part, consumer)
+                return d.addCallback(write_parts)
+
+    return defer.maybeDeferred(write_parts)
+
+def close_body(result, body):
+    body.close()
+    return result
+
+def fetch(url, method='GET', postdata=None, headers=None,
+          agent='python-pownce-api', timeout=0):
+    """
+    Fetches the given URL without blocking the reactor.
+
+    Returns a ``Deferred`` which fires with a tuple of the HTTP status
+    (as an int), the response headers (a dictionary of lower-cased
+    header names to lists of values) and the response body. Error
+    statuses are not treated as failures, so callers can decode the
+    error documents Pownce returns; only connection problems errback.
+
+    ``postdata`` is either a string or a streamed body like
+    ``pownce.MultipartBody``, which is closed once the request is done
+    or has failed.
+
+    Every call opens a new connection, counted in ``connections``: the
+    ``twisted.web`` client of this Twisted version speaks HTTP/1.0 and
+    can't keep connections alive, so ``pownce.ConnectionPool`` only
+    serves the blocking client.
+    """
+    global connections
+    connections += 1
+    scheme, netloc = urlparse.urlsplit(url)[:2]
+    if ':' in netloc:
+        host, port = netloc.split(':', 1)
+        port = int(port)
+    else:
+        host, port = netloc, 80
+    if postdata is None or isinstance(postdata, str):
+        factory = client.HTTPClientFactory(url, method=method, postdata=postdata,
+                                           headers=headers, agent=agent,
+                                           timeout=timeout)
+    else:
+        factory = StreamingClientFactory(url, postdata, method=method,
+                                         headers=headers, agent=agent,
+                                         timeout=timeout)
+        factory.deferred.addBoth(close_body, postdata)
+    reactor.connectTCP(host, port, factory)
+
+    def response(body):
+        return (int(factory.status), factory.response_headers, body)
+
+    def error_response(failure):
+        failure.trap(error.Error)
+        return (int(failure.value.status),
+                getattr(factory, 'response_headers', {}),
+                failure.value.response)
+
+    return factory.deferred.addCallbacks(response, error_response)